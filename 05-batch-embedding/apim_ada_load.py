@@ -20,8 +20,8 @@ from azure.identity import DefaultAzureCredential
 
 from apim_ada_poc import POC, Context, Settings, build_context
 from utils.embedding_optimization import (
+    TokenBucketLimiter,
     pack_compatible_requests,
-    pacing_interval_seconds,
     percentile,
     target_tokens_per_request,
     token_counter_for_model,
@@ -387,19 +387,16 @@ def run_load(
     max_batch_tokens: int,
     model: str,
     optimization_plan: OptimizationRunPlan,
+    burst_seconds: float = 0.0,
 ) -> None:
     records = []
     sequence = 0
     started = time.monotonic()
-    next_request_at = started
+    resume_at = started
+    rate_limiter = TokenBucketLimiter(tokens_per_minute=target_tpm, burst_seconds=burst_seconds)
     token_counter = token_counter_for_model(model)
     with requests.Session() as session:
         while time.monotonic() - started < duration_seconds:
-            remaining_wait = next_request_at - time.monotonic()
-            if remaining_wait > 0:
-                if next_request_at - started >= duration_seconds:
-                    break
-                time.sleep(remaining_wait)
             candidate_requests = rpm_requests(
                 batch_size,
                 batch_size,
@@ -412,24 +409,26 @@ def run_load(
                 for text in batch["texts"]
             ]
             estimated_tokens = sum(token_counter(text) for text in texts)
+            remaining_wait = max(
+                rate_limiter.reserve(estimated_tokens),
+                resume_at - time.monotonic(),
+            )
+            if remaining_wait > 0:
+                if time.monotonic() + remaining_wait - started >= duration_seconds:
+                    break
+                time.sleep(remaining_wait)
             _, metric = send_embeddings(session, target, texts)
             metric["sequence"] = sequence
             metric["estimated_tokens"] = estimated_tokens
             metric["start_offset_seconds"] = round(time.monotonic() - started, 3)
             records.append(metric)
             sequence += 1
-            prompt_tokens = metric.get("prompt_tokens")
-            if not prompt_tokens:
+            if not metric.get("prompt_tokens"):
                 retry_after = metric.get("retry_after")
-                next_request_at = time.monotonic() + max(
+                resume_at = time.monotonic() + max(
                     float(retry_after or 0),
                     LOAD.minimum_failure_backoff_seconds,
                 )
-                continue
-            next_request_at = max(
-                next_request_at + pacing_interval_seconds(prompt_tokens, target_tpm),
-                time.monotonic(),
-            )
 
     successful = [record for record in records if record["status_code"] == 200]
     durations = [record["duration_ms"] for record in successful]
@@ -454,6 +453,7 @@ def run_load(
         "target": target.name,
         "optimization_plan": asdict(optimization_plan),
         "configured_target_tpm": target_tpm,
+        "burst_seconds": burst_seconds,
         "max_batch_tokens": max_batch_tokens,
         "elapsed_seconds": round(elapsed, 3),
         "requests": len(records),
@@ -515,6 +515,12 @@ def main() -> None:
     load.add_argument("--target-tpm", type=int)
     load.add_argument("--max-batch-tokens", type=int)
     load.add_argument("--requests-per-minute", type=float)
+    load.add_argument(
+        "--burst-seconds",
+        type=float,
+        default=0.0,
+        help="Seconds of --target-tpm that idle time may bank for a burst.",
+    )
     load.add_argument("--output", type=Path, default=Path("outputs/apim-ada-tpm"))
     rpm = subparsers.add_parser(
         "rpm",
@@ -602,6 +608,7 @@ def main() -> None:
             max_batch_tokens,
             context.settings.deployment_name,
             optimization_plan,
+            args.burst_seconds,
         )
 
 
@@ -34,7 +34,23 @@ from network_setup import configure_private_network
 from permissions_setup import configure_permissions
 from utils.fdyauth import AuthHelper
 from utils.aml_metrics import DEFAULT_METRIC_PREFIX, METRICS, MetricLoggingMode
-from utils.embedding_optimization import percentile
+from utils.columnar_input import columnar_row_count, is_columnar
+from utils.embedding_optimization import (
+    DEFAULT_TOKEN_ESTIMATE_RATE,
+    calibrated_token_estimate_rate,
+    percentile,
+    tokenizer_encoding_name,
+)
+from utils.input_manifest import manifest_entry, read_manifest, write_manifest
+from utils.packing_plan import PLAN_FILE, PlannedRequest, read_packing_plan, write_packing_plan
+from utils.token_profile import (
+    TokenCounts,
+    TokenProfile,
+    profile_source,
+    read_token_profile,
+    write_token_profile,
+)
+from utils.tokenizer_bundle import BUNDLE_DIR, write_tokenizer_bundle
 
 ROOT = Path(__file__).resolve().parent
 
@@ -49,6 +65,54 @@ class ModelKey(StrEnum):
 class PackingMode(StrEnum):
     ONE_INPUT_PER_REQUEST = "none"
     PACKED_INPUT_ARRAY = "batch"
+    BIN_PACKED_INPUT_ARRAY = "binpack"
+    LENGTH_SORTED_INPUT_ARRAY = "sorted"
+    REPLAYED_PLAN = "plan"
+
+
+class ExecutionMode(StrEnum):
+    BUFFERED = "buffered"
+    STREAMING = "streaming"
+
+
+class InputStorage(StrEnum):
+    MEMORY = "memory"
+    MAPPED = "mmap"
+
+
+class TokenCounting(StrEnum):
+    TOKENIZER = "tokenizer"
+    ESTIMATE = "estimate"
+
+
+class RequestSizing(StrEnum):
+    FIXED = "fixed"
+    ADAPTIVE = "adaptive"
+
+
+class DispatchEngine(StrEnum):
+    THREAD = "thread"
+    ASYNC = "async"
+
+
+class ConcurrencyControl(StrEnum):
+    STATIC = "static"
+    AIMD = "aimd"
+
+
+class PacingSource(StrEnum):
+    TARGETS = "targets"
+    HEADERS = "headers"
+
+
+class OutputOrder(StrEnum):
+    SUBMISSION = "submission"
+    COMPLETION = "completion"
+
+
+class ShardBalance(StrEnum):
+    INPUTS = "inputs"
+    TOKENS = "tokens"
 
 
 class ExperimentKind(StrEnum):
@@ -101,6 +165,24 @@ class BatchDefaults:
     target_inputs_per_minute: float = 0
     max_retries: int = 8
     request_concurrency: int = 1
+    execution: ExecutionMode = ExecutionMode.BUFFERED
+    ingest_workers: int = 0
+    max_batch_inputs: int = 50_000
+    input_storage: InputStorage = InputStorage.MEMORY
+    input_columns: str = "input_id=input_id,input=input"
+    token_counting: TokenCounting = TokenCounting.TOKENIZER
+    token_estimate_rate: float = DEFAULT_TOKEN_ESTIMATE_RATE
+    token_estimate_margin: float = 0.1
+    request_sizing: RequestSizing = RequestSizing.FIXED
+    engine: DispatchEngine = DispatchEngine.THREAD
+    pacing_burst_seconds: float = 0.0
+    concurrency_control: ConcurrencyControl = ConcurrencyControl.STATIC
+    min_request_concurrency: int = 1
+    pacing: PacingSource = PacingSource.TARGETS
+    output_order: OutputOrder = OutputOrder.SUBMISSION
+    reorder_buffer_size: int = 0
+    max_shards: int = 1
+    shard_balance: ShardBalance = ShardBalance.INPUTS
     metric_logging: MetricLoggingMode = MetricLoggingMode.MLFLOW
     local_metric_logging: MetricLoggingMode = MetricLoggingMode.DISABLED
     metric_prefix: str = DEFAULT_METRIC_PREFIX
@@ -121,6 +203,25 @@ class PipelineFields:
     target_inputs_per_minute: str = "target_inputs_per_minute"
     max_retries: str = "max_retries"
     request_concurrency: str = "request_concurrency"
+    execution: str = "execution"
+    ingest_workers: str = "ingest_workers"
+    max_batch_inputs: str = "max_batch_inputs"
+    input_storage: str = "input_storage"
+    input_columns: str = "input_columns"
+    token_counting: str = "token_counting"
+    token_estimate_rate: str = "token_estimate_rate"
+    token_estimate_margin: str = "token_estimate_margin"
+    request_sizing: str = "request_sizing"
+    engine: str = "engine"
+    pacing_burst_seconds: str = "pacing_burst_seconds"
+    concurrency_control: str = "concurrency_control"
+    min_request_concurrency: str = "min_request_concurrency"
+    pacing: str = "pacing"
+    output_order: str = "output_order"
+    reorder_buffer_size: str = "reorder_buffer_size"
+    shard_count: str = "shard_count"
+    shard_balance: str = "shard_balance"
+    shard_files: str = "shard_files"
     metric_logging: str = "metric_logging"
     metric_prefix: str = "metric_prefix"
     embeddings: str = "embeddings"
@@ -134,6 +235,7 @@ class ArtifactContract:
     artifacts: str = "artifacts"
     root_span: str = "batch.embed"
     request_span: str = "embeddings.create"
+    merge_step: str = "merge_embeddings"
 
 
 ENV = EnvironmentKeys()
@@ -142,6 +244,23 @@ FIELDS = PipelineFields()
 ARTIFACTS = ArtifactContract()
 MODEL_KEYS = tuple(ModelKey)
 FOUNDRY_MODEL_KEYS = (ModelKey.SMALL, ModelKey.LARGE, ModelKey.ADA)
+COMPONENT_CODE_FILES = (
+    "component/embed.py",
+    "utils/__init__.py",
+    "utils/fdyauth.py",
+    "utils/embedding_optimization.py",
+    "utils/aml_metrics.py",
+    "utils/input_index.py",
+    "utils/record_index.py",
+    "utils/columnar_input.py",
+    "utils/input_manifest.py",
+    "utils/token_profile.py",
+    "utils/token_cache.py",
+    "utils/tokenizer_bundle.py",
+    "utils/packing_plan.py",
+    "component/shard.py",
+    "component/merge.py",
+)
 
 
 def packing_label(packing: str) -> str:
@@ -149,6 +268,12 @@ def packing_label(packing: str) -> str:
         return "packed-input-array"
     if packing == PackingMode.ONE_INPUT_PER_REQUEST:
         return "one-input-per-request"
+    if packing == PackingMode.BIN_PACKED_INPUT_ARRAY:
+        return "bin-packed-input-array"
+    if packing == PackingMode.LENGTH_SORTED_INPUT_ARRAY:
+        return "length-sorted-input-array"
+    if packing == PackingMode.REPLAYED_PLAN:
+        return "replayed-packing-plan"
     raise ValueError(f"Unsupported packing mode: {packing}")
 
 
@@ -165,16 +290,17 @@ def job_name(
     max_inputs_per_request: int,
     max_tokens_per_request: int,
     max_retries: int,
-    request_concurrency: int,
+    request_concurrency: int | None,
     timestamp: datetime,
 ) -> str:
     """Return a unique, readable AML batch job name with key run settings."""
     mode_label = packing_label(packing)
     token_label = str(max_tokens_per_request) if max_tokens_per_request else "off"
+    workers_label = request_concurrency if request_concurrency is not None else "default"
     return (
         f"embeddings-{experiment_kind}-{model_key}-{mode_label}-records-{record_count}-"
         f"items-{max_inputs_per_request}-tokens-{token_label}-"
-        f"retries-{max_retries}-workers-{request_concurrency}-"
+        f"retries-{max_retries}-workers-{workers_label}-"
         f"{timestamp.strftime('%Y-%m-%d-%H%M%Sz')}"
     )
 
@@ -369,18 +495,25 @@ def ensure_compute(settings: Settings, ml_client: MLClient) -> str:
     return compute.identity.principal_id
 
 
-def create_pipeline_component(
+def component_environment() -> Environment:
+    return Environment(
+        image=DEFAULTS.environment_image,
+        conda_file=ROOT / "component" / "conda.yaml",
+    )
+
+
+def embed_command(
     settings: Settings,
     model_key: str,
     code_path: str | Path = ROOT,
     default_max_tokens_per_request: int = 0,
+    sharded: bool = False,
 ):
     model_slug = model_key.replace("-", "_")
-    environment = Environment(
-        image=DEFAULTS.environment_image,
-        conda_file=ROOT / "component" / "conda.yaml",
+    shard_inputs = (
+        {FIELDS.shard_files: Input(type=AssetTypes.URI_FOLDER)} if sharded else {}
     )
-    embed = command(
+    return command(
         name=f"embed_documents_{model_slug}_openai_v1",
         display_name=f"Embed documents with {settings.openai_models[model_key]}",
         code=code_path,
@@ -399,10 +532,29 @@ def create_pipeline_component(
             "--target-tpm ${{inputs.target_tpm}} "
             "--target-inputs-per-minute ${{inputs.target_inputs_per_minute}} "
             "--max-retries ${{inputs.max_retries}} "
-            "--request-concurrency ${{inputs.request_concurrency}}"
+            "--request-concurrency ${{inputs.request_concurrency}} "
+            "--execution ${{inputs.execution}} "
+            "--ingest-workers ${{inputs.ingest_workers}} "
+            "--max-batch-inputs ${{inputs.max_batch_inputs}} "
+            "--input-storage ${{inputs.input_storage}} "
+            "--input-columns ${{inputs.input_columns}} "
+            "--token-counting ${{inputs.token_counting}} "
+            "--token-estimate-rate ${{inputs.token_estimate_rate}} "
+            "--token-estimate-margin ${{inputs.token_estimate_margin}} "
+            "--request-sizing ${{inputs.request_sizing}} "
+            "--engine ${{inputs.engine}} "
+            "--pacing-burst-seconds ${{inputs.pacing_burst_seconds}} "
+            "--concurrency-control ${{inputs.concurrency_control}} "
+            "--min-request-concurrency ${{inputs.min_request_concurrency}} "
+            "--pacing ${{inputs.pacing}} "
+            "--output-order ${{inputs.output_order}} "
+            "--reorder-buffer-size ${{inputs.reorder_buffer_size}} "
+            "--shard-count ${{inputs.shard_count}}"
+            + (" --shard-files ${{inputs.shard_files}}" if sharded else "")
         ),
         inputs={
             FIELDS.documents: Input(type=AssetTypes.URI_FOLDER),
+            **shard_inputs,
             FIELDS.packing: Input(
                 type="string",
                 default=DEFAULTS.packing.value,
@@ -431,6 +583,74 @@ def create_pipeline_component(
                 type="integer",
                 default=DEFAULTS.request_concurrency,
             ),
+            FIELDS.execution: Input(
+                type="string",
+                default=DEFAULTS.execution.value,
+            ),
+            FIELDS.ingest_workers: Input(
+                type="integer",
+                default=DEFAULTS.ingest_workers,
+            ),
+            FIELDS.max_batch_inputs: Input(
+                type="integer",
+                default=DEFAULTS.max_batch_inputs,
+            ),
+            FIELDS.input_storage: Input(
+                type="string",
+                default=DEFAULTS.input_storage.value,
+            ),
+            FIELDS.input_columns: Input(
+                type="string",
+                default=DEFAULTS.input_columns,
+            ),
+            FIELDS.token_counting: Input(
+                type="string",
+                default=DEFAULTS.token_counting.value,
+            ),
+            FIELDS.token_estimate_rate: Input(
+                type="number",
+                default=DEFAULTS.token_estimate_rate,
+            ),
+            FIELDS.token_estimate_margin: Input(
+                type="number",
+                default=DEFAULTS.token_estimate_margin,
+            ),
+            FIELDS.request_sizing: Input(
+                type="string",
+                default=DEFAULTS.request_sizing.value,
+            ),
+            FIELDS.engine: Input(
+                type="string",
+                default=DEFAULTS.engine.value,
+            ),
+            FIELDS.pacing_burst_seconds: Input(
+                type="number",
+                default=DEFAULTS.pacing_burst_seconds,
+            ),
+            FIELDS.concurrency_control: Input(
+                type="string",
+                default=DEFAULTS.concurrency_control.value,
+            ),
+            FIELDS.min_request_concurrency: Input(
+                type="integer",
+                default=DEFAULTS.min_request_concurrency,
+            ),
+            FIELDS.pacing: Input(
+                type="string",
+                default=DEFAULTS.pacing.value,
+            ),
+            FIELDS.output_order: Input(
+                type="string",
+                default=DEFAULTS.output_order.value,
+            ),
+            FIELDS.reorder_buffer_size: Input(
+                type="integer",
+                default=DEFAULTS.reorder_buffer_size,
+            ),
+            FIELDS.shard_count: Input(
+                type="integer",
+                default=1,
+            ),
             FIELDS.metric_logging: Input(
                 type="string",
                 default=DEFAULTS.metric_logging.value,
@@ -441,10 +661,25 @@ def create_pipeline_component(
             ),
         },
         outputs={FIELDS.embeddings: Output(type=AssetTypes.URI_FOLDER)},
-        environment=environment,
+        environment=component_environment(),
         is_deterministic=False,
     )
 
+
+def create_pipeline_component(
+    settings: Settings,
+    model_key: str,
+    code_path: str | Path = ROOT,
+    default_max_tokens_per_request: int = 0,
+):
+    model_slug = model_key.replace("-", "_")
+    embed = embed_command(
+        settings,
+        model_key,
+        code_path,
+        default_max_tokens_per_request,
+    )
+
     @dsl.pipeline(name=f"batch_embedding_pipeline_{model_slug}")
     def pipeline(
         documents: Input,
@@ -455,6 +690,22 @@ def create_pipeline_component(
         target_inputs_per_minute: float = DEFAULTS.target_inputs_per_minute,
         max_retries: int = DEFAULTS.max_retries,
         request_concurrency: int = DEFAULTS.request_concurrency,
+        execution: str = DEFAULTS.execution.value,
+        ingest_workers: int = DEFAULTS.ingest_workers,
+        max_batch_inputs: int = DEFAULTS.max_batch_inputs,
+        input_storage: str = DEFAULTS.input_storage.value,
+        input_columns: str = DEFAULTS.input_columns,
+        token_counting: str = DEFAULTS.token_counting.value,
+        token_estimate_rate: float = DEFAULTS.token_estimate_rate,
+        token_estimate_margin: float = DEFAULTS.token_estimate_margin,
+        request_sizing: str = DEFAULTS.request_sizing.value,
+        engine: str = DEFAULTS.engine.value,
+        pacing_burst_seconds: float = DEFAULTS.pacing_burst_seconds,
+        concurrency_control: str = DEFAULTS.concurrency_control.value,
+        min_request_concurrency: int = DEFAULTS.min_request_concurrency,
+        pacing: str = DEFAULTS.pacing.value,
+        output_order: str = DEFAULTS.output_order.value,
+        reorder_buffer_size: int = DEFAULTS.reorder_buffer_size,
         metric_logging: str = DEFAULTS.metric_logging.value,
         metric_prefix: str = DEFAULTS.metric_prefix,
     ):
@@ -467,6 +718,22 @@ def create_pipeline_component(
             target_inputs_per_minute=target_inputs_per_minute,
             max_retries=max_retries,
             request_concurrency=request_concurrency,
+            execution=execution,
+            ingest_workers=ingest_workers,
+            max_batch_inputs=max_batch_inputs,
+            input_storage=input_storage,
+            input_columns=input_columns,
+            token_counting=token_counting,
+            token_estimate_rate=token_estimate_rate,
+            token_estimate_margin=token_estimate_margin,
+            request_sizing=request_sizing,
+            engine=engine,
+            pacing_burst_seconds=pacing_burst_seconds,
+            concurrency_control=concurrency_control,
+            min_request_concurrency=min_request_concurrency,
+            pacing=pacing,
+            output_order=output_order,
+            reorder_buffer_size=reorder_buffer_size,
             metric_logging=metric_logging,
             metric_prefix=metric_prefix,
         )
@@ -481,6 +748,252 @@ def create_pipeline_component(
         target_inputs_per_minute=DEFAULTS.target_inputs_per_minute,
         max_retries=DEFAULTS.max_retries,
         request_concurrency=DEFAULTS.request_concurrency,
+        execution=DEFAULTS.execution.value,
+        ingest_workers=DEFAULTS.ingest_workers,
+        max_batch_inputs=DEFAULTS.max_batch_inputs,
+        input_storage=DEFAULTS.input_storage.value,
+        input_columns=DEFAULTS.input_columns,
+        token_counting=DEFAULTS.token_counting.value,
+        token_estimate_rate=DEFAULTS.token_estimate_rate,
+        token_estimate_margin=DEFAULTS.token_estimate_margin,
+        request_sizing=DEFAULTS.request_sizing.value,
+        engine=DEFAULTS.engine.value,
+        pacing_burst_seconds=DEFAULTS.pacing_burst_seconds,
+        concurrency_control=DEFAULTS.concurrency_control.value,
+        min_request_concurrency=DEFAULTS.min_request_concurrency,
+        pacing=DEFAULTS.pacing.value,
+        output_order=DEFAULTS.output_order.value,
+        reorder_buffer_size=DEFAULTS.reorder_buffer_size,
+        metric_logging=DEFAULTS.metric_logging.value,
+        metric_prefix=DEFAULTS.metric_prefix,
+    ).component
+
+
+def create_sharded_pipeline_component(
+    settings: Settings,
+    model_key: str,
+    max_shards: int,
+    code_path: str | Path = ROOT,
+    default_max_tokens_per_request: int = 0,
+):
+    """Build split -> max_shards parallel embed steps -> merge."""
+    model_slug = model_key.replace("-", "_")
+    default_request_concurrency = max(DEFAULTS.request_concurrency, max_shards)
+    shard_names = [f"shard_{index}" for index in range(max_shards)]
+    embed = embed_command(
+        settings,
+        model_key,
+        code_path,
+        default_max_tokens_per_request,
+        sharded=True,
+    )
+    split_files = command(
+        name=f"split_documents_{model_slug}_v1",
+        display_name="Split documents into balanced shards",
+        code=code_path,
+        command=(
+            "PYTHONPATH=. python component/shard.py --input-dir ${{inputs.documents}} "
+            "--output-dirs "
+            + " ".join(f"${{{{outputs.{name}}}}}" for name in shard_names)
+            + f" --model {settings.openai_models[model_key]} "
+            "--shard-count ${{inputs.shard_count}} "
+            "--balance ${{inputs.shard_balance}} "
+            "--max-batch-inputs ${{inputs.max_batch_inputs}} "
+            "--input-columns ${{inputs.input_columns}} "
+            "--ingest-workers ${{inputs.ingest_workers}} "
+            "--packing ${{inputs.packing}}"
+        ),
+        inputs={
+            FIELDS.documents: Input(type=AssetTypes.URI_FOLDER),
+            FIELDS.shard_count: Input(type="integer", default=max_shards),
+            FIELDS.shard_balance: Input(
+                type="string",
+                default=DEFAULTS.shard_balance.value,
+            ),
+            FIELDS.max_batch_inputs: Input(
+                type="integer",
+                default=DEFAULTS.max_batch_inputs,
+            ),
+            FIELDS.input_columns: Input(
+                type="string",
+                default=DEFAULTS.input_columns,
+            ),
+            FIELDS.ingest_workers: Input(
+                type="integer",
+                default=DEFAULTS.ingest_workers,
+            ),
+            FIELDS.packing: Input(
+                type="string",
+                default=DEFAULTS.packing.value,
+            ),
+        },
+        outputs={name: Output(type=AssetTypes.URI_FOLDER) for name in shard_names},
+        environment=component_environment(),
+        is_deterministic=False,
+    )
+    merge_outputs = command(
+        name=f"merge_embeddings_{model_slug}_v1",
+        display_name="Merge shard embeddings and metrics",
+        code=code_path,
+        command=(
+            "PYTHONPATH=. python component/merge.py --shard-dirs "
+            + " ".join(f"${{{{inputs.{name}}}}}" for name in shard_names)
+            + " --output-dir ${{outputs.embeddings}} "
+            "--shard-count ${{inputs.shard_count}} "
+            "--max-inputs-per-request ${{inputs.max_inputs_per_request}} "
+            "--max-tokens-per-request ${{inputs.max_tokens_per_request}} "
+            "--target-tpm ${{inputs.target_tpm}} "
+            "--target-inputs-per-minute ${{inputs.target_inputs_per_minute}} "
+            "--metric-logging ${{inputs.metric_logging}} "
+            "--metric-prefix ${{inputs.metric_prefix}}"
+        ),
+        inputs={
+            **{name: Input(type=AssetTypes.URI_FOLDER) for name in shard_names},
+            FIELDS.shard_count: Input(type="integer", default=max_shards),
+            FIELDS.max_inputs_per_request: Input(
+                type="integer",
+                default=DEFAULTS.max_inputs_per_request,
+            ),
+            FIELDS.max_tokens_per_request: Input(
+                type="integer",
+                default=default_max_tokens_per_request,
+            ),
+            FIELDS.target_tpm: Input(
+                type="integer",
+                default=DEFAULTS.target_tpm,
+            ),
+            FIELDS.target_inputs_per_minute: Input(
+                type="number",
+                default=DEFAULTS.target_inputs_per_minute,
+            ),
+            FIELDS.metric_logging: Input(
+                type="string",
+                default=DEFAULTS.metric_logging.value,
+            ),
+            FIELDS.metric_prefix: Input(
+                type="string",
+                default=DEFAULTS.metric_prefix,
+            ),
+        },
+        outputs={FIELDS.embeddings: Output(type=AssetTypes.URI_FOLDER)},
+        environment=component_environment(),
+        is_deterministic=False,
+    )
+
+    @dsl.pipeline(name=f"batch_embedding_sharded_pipeline_{model_slug}")
+    def pipeline(
+        documents: Input,
+        shard_count: int = max_shards,
+        shard_balance: str = DEFAULTS.shard_balance.value,
+        packing: str = DEFAULTS.packing.value,
+        max_inputs_per_request: int = DEFAULTS.max_inputs_per_request,
+        max_tokens_per_request: int = default_max_tokens_per_request,
+        target_tpm: int = DEFAULTS.target_tpm,
+        target_inputs_per_minute: float = DEFAULTS.target_inputs_per_minute,
+        max_retries: int = DEFAULTS.max_retries,
+        request_concurrency: int = default_request_concurrency,
+        execution: str = DEFAULTS.execution.value,
+        ingest_workers: int = DEFAULTS.ingest_workers,
+        max_batch_inputs: int = DEFAULTS.max_batch_inputs,
+        input_storage: str = DEFAULTS.input_storage.value,
+        input_columns: str = DEFAULTS.input_columns,
+        token_counting: str = DEFAULTS.token_counting.value,
+        token_estimate_rate: float = DEFAULTS.token_estimate_rate,
+        token_estimate_margin: float = DEFAULTS.token_estimate_margin,
+        request_sizing: str = DEFAULTS.request_sizing.value,
+        engine: str = DEFAULTS.engine.value,
+        pacing_burst_seconds: float = DEFAULTS.pacing_burst_seconds,
+        concurrency_control: str = DEFAULTS.concurrency_control.value,
+        min_request_concurrency: int = DEFAULTS.min_request_concurrency,
+        pacing: str = DEFAULTS.pacing.value,
+        output_order: str = DEFAULTS.output_order.value,
+        reorder_buffer_size: int = DEFAULTS.reorder_buffer_size,
+        metric_logging: str = DEFAULTS.metric_logging.value,
+        metric_prefix: str = DEFAULTS.metric_prefix,
+    ):
+        split_step = split_files(
+            documents=documents,
+            shard_count=shard_count,
+            shard_balance=shard_balance,
+            max_batch_inputs=max_batch_inputs,
+            input_columns=input_columns,
+            ingest_workers=ingest_workers,
+            packing=packing,
+        )
+        shard_outputs = {}
+        for name in shard_names:
+            step = embed(
+                documents=documents,
+                shard_files=split_step.outputs[name],
+                packing=packing,
+                max_inputs_per_request=max_inputs_per_request,
+                max_tokens_per_request=max_tokens_per_request,
+                target_tpm=target_tpm,
+                target_inputs_per_minute=target_inputs_per_minute,
+                max_retries=max_retries,
+                request_concurrency=request_concurrency,
+                execution=execution,
+                ingest_workers=ingest_workers,
+                max_batch_inputs=max_batch_inputs,
+                input_storage=input_storage,
+                input_columns=input_columns,
+                token_counting=token_counting,
+                token_estimate_rate=token_estimate_rate,
+                token_estimate_margin=token_estimate_margin,
+                request_sizing=request_sizing,
+                engine=engine,
+                pacing_burst_seconds=pacing_burst_seconds,
+                concurrency_control=concurrency_control,
+                min_request_concurrency=min_request_concurrency,
+                pacing=pacing,
+                output_order=output_order,
+                reorder_buffer_size=reorder_buffer_size,
+                shard_count=shard_count,
+                metric_logging=MetricLoggingMode.DISABLED.value,
+                metric_prefix=metric_prefix,
+            )
+            step.name = f"embed_{name}"
+            shard_outputs[name] = step.outputs.embeddings
+        merge_step = merge_outputs(
+            **shard_outputs,
+            shard_count=shard_count,
+            max_inputs_per_request=max_inputs_per_request,
+            max_tokens_per_request=max_tokens_per_request,
+            target_tpm=target_tpm,
+            target_inputs_per_minute=target_inputs_per_minute,
+            metric_logging=metric_logging,
+            metric_prefix=metric_prefix,
+        )
+        merge_step.display_name = ARTIFACTS.merge_step
+        return {FIELDS.embeddings: merge_step.outputs.embeddings}
+
+    return pipeline(
+        documents=Input(type=AssetTypes.URI_FOLDER),
+        shard_count=max_shards,
+        shard_balance=DEFAULTS.shard_balance.value,
+        packing=DEFAULTS.packing.value,
+        max_inputs_per_request=DEFAULTS.max_inputs_per_request,
+        max_tokens_per_request=default_max_tokens_per_request,
+        target_tpm=DEFAULTS.target_tpm,
+        target_inputs_per_minute=DEFAULTS.target_inputs_per_minute,
+        max_retries=DEFAULTS.max_retries,
+        request_concurrency=default_request_concurrency,
+        execution=DEFAULTS.execution.value,
+        ingest_workers=DEFAULTS.ingest_workers,
+        max_batch_inputs=DEFAULTS.max_batch_inputs,
+        input_storage=DEFAULTS.input_storage.value,
+        input_columns=DEFAULTS.input_columns,
+        token_counting=DEFAULTS.token_counting.value,
+        token_estimate_rate=DEFAULTS.token_estimate_rate,
+        token_estimate_margin=DEFAULTS.token_estimate_margin,
+        request_sizing=DEFAULTS.request_sizing.value,
+        engine=DEFAULTS.engine.value,
+        pacing_burst_seconds=DEFAULTS.pacing_burst_seconds,
+        concurrency_control=DEFAULTS.concurrency_control.value,
+        min_request_concurrency=DEFAULTS.min_request_concurrency,
+        pacing=DEFAULTS.pacing.value,
+        output_order=DEFAULTS.output_order.value,
+        reorder_buffer_size=DEFAULTS.reorder_buffer_size,
         metric_logging=DEFAULTS.metric_logging.value,
         metric_prefix=DEFAULTS.metric_prefix,
     ).component
@@ -491,22 +1004,23 @@ def ensure_batch_endpoint(
     ml_client: MLClient,
     model_keys: tuple[str, ...] = MODEL_KEYS,
     max_tokens_per_request: dict[str, int] | None = None,
+    max_shards: int = DEFAULTS.max_shards,
 ) -> None:
     with tempfile.TemporaryDirectory(prefix="aml-batch-embedding-multi-") as temp_dir:
         stage = Path(temp_dir)
-        (stage / "component").mkdir()
-        (stage / "utils").mkdir()
-        shutil.copy2(ROOT / "component" / "embed.py", stage / "component" / "embed.py")
-        shutil.copy2(ROOT / "utils" / "__init__.py", stage / "utils" / "__init__.py")
-        shutil.copy2(ROOT / "utils" / "fdyauth.py", stage / "utils" / "fdyauth.py")
-        shutil.copy2(
-            ROOT / "utils" / "embedding_optimization.py",
-            stage / "utils" / "embedding_optimization.py",
-        )
-        shutil.copy2(
-            ROOT / "utils" / "aml_metrics.py",
-            stage / "utils" / "aml_metrics.py",
-        )
+        for relative_path in COMPONENT_CODE_FILES:
+            destination = stage / relative_path
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(ROOT / relative_path, destination)
+        bundle_paths = [
+            write_tokenizer_bundle(encoding_name, stage / BUNDLE_DIR)
+            for encoding_name in sorted(
+                {
+                    tokenizer_encoding_name(settings.openai_models[model_key])
+                    for model_key in model_keys
+                }
+            )
+        ]
         try:
             endpoint = ml_client.batch_endpoints.get(settings.endpoint_name)
         except ResourceNotFoundError:
@@ -517,14 +1031,21 @@ def ensure_batch_endpoint(
                 )
             ).result()
         for model_key in model_keys:
+            default_max_tokens_per_request = (max_tokens_per_request or {}).get(model_key, 0)
             component = ml_client.components.create_or_update(
-                create_pipeline_component(
+                create_sharded_pipeline_component(
                     settings,
                     model_key=model_key,
+                    max_shards=max_shards,
                     code_path=stage,
-                    default_max_tokens_per_request=(
-                        (max_tokens_per_request or {}).get(model_key, 0)
-                    ),
+                    default_max_tokens_per_request=default_max_tokens_per_request,
+                )
+                if max_shards > 1
+                else create_pipeline_component(
+                    settings,
+                    model_key=model_key,
+                    code_path=stage,
+                    default_max_tokens_per_request=default_max_tokens_per_request,
                 )
             )
             deployment = PipelineComponentBatchDeployment(
@@ -540,22 +1061,32 @@ def ensure_batch_endpoint(
             print(
                 f"Ready: batch deployment {model_key} -> "
                 f"{'APIM pooled' if model_key == ModelKey.ADA_APIM else 'Foundry direct'} "
-                f"({settings.openai_endpoints[model_key]})"
+                f"({settings.openai_endpoints[model_key]}"
+                f"{f', up to {max_shards} shards' if max_shards > 1 else ''})"
             )
-        print("Ready: minimal component code uploaded (5 files)")
+        print(
+            "Ready: minimal component code uploaded "
+            f"({len(COMPONENT_CODE_FILES)} files, "
+            f"{len(bundle_paths)} tokenizer bundles)"
+        )
         if not endpoint.defaults.deployment_name:
             endpoint.defaults.deployment_name = settings.batch_deployments[ModelKey.SMALL]
             ml_client.batch_endpoints.begin_create_or_update(endpoint).result()
         print(f"Ready: AML batch endpoint {endpoint.name}")
 
 
-def provision(settings: Settings) -> None:
+def provision(settings: Settings, max_shards: int = DEFAULTS.max_shards) -> None:
+    if max_shards < 1 or max_shards > DEFAULTS.compute_max_instances:
+        raise ValueError(
+            "max_shards must be between 1 and the compute cluster's "
+            f"{DEFAULTS.compute_max_instances} instances"
+        )
     ml_client, cognitive_client, authorization_client = clients(settings)
     for model_key in FOUNDRY_MODEL_KEYS:
         ensure_model_deployment(settings, cognitive_client, model_key)
     ensure_compute(settings, ml_client)
     configure_permissions(settings, ml_client, authorization_client)
-    ensure_batch_endpoint(settings, ml_client)
+    ensure_batch_endpoint(settings, ml_client, max_shards=max_shards)
 
 
 def provision_apim_deployment(settings: Settings) -> None:
@@ -678,11 +1209,48 @@ def print_output_summary(ml_client: MLClient, job_name: str) -> None:
         print(f"  packing:         {attributes['embedding.packing']}")
         print(f"  max retries:     {attributes['embedding.max_retries']}")
         print(f"  concurrency:     {attributes['embedding.request_concurrency']}")
+        if "embedding.execution" in attributes:
+            print(f"  execution:       {attributes['embedding.execution']}")
+        if "embedding.engine" in attributes:
+            print(f"  engine:          {attributes['embedding.engine']}")
+        if "embedding.output_order" in attributes:
+            output_order = attributes["embedding.output_order"]
+            if "embedding.reorder_buffer_size" in attributes:
+                output_order += (
+                    f" (reorder buffer {attributes['embedding.reorder_buffer_size']})"
+                )
+            print(f"  output order:    {output_order}")
+        if "embedding.concurrency_limits" in attributes:
+            limits = attributes["embedding.concurrency_limits"]
+            print(
+                f"  aimd limit:      {limits[0]} -> {limits[-1]} "
+                f"(max {max(limits)}, {len(limits) - 1} changes)"
+            )
+        if attributes.get("embedding.pacing") == "headers":
+            print(
+                "  header gating:   "
+                f"{attributes['embedding.rate_limit_gated_requests']} requests held "
+                f"{attributes['embedding.rate_limit_gated_ms']} ms"
+            )
+        if "embedding.input_storage" in attributes:
+            print(f"  input storage:   {attributes['embedding.input_storage']}")
+        if "embedding.token_budgets" in attributes:
+            budgets = attributes["embedding.token_budgets"]
+            print(
+                f"  token budget:    {budgets[0]} -> {budgets[-1]} "
+                f"({len(budgets) - 1} changes)"
+            )
         print(f"  source lines:    {attributes['embedding.source_line_count']}")
         print(f"  embedding inputs:{attributes['embedding.input_count']}")
         print(f"  online requests: {attributes['embedding.online_request_count']}")
         print(f"  duration ms:     {duration_ms}")
         print(f"  failed requests: {attributes['embedding.failed_count']}")
+        if attributes.get("embedding.unprocessable_input_count"):
+            print(
+                "  unprocessable:   "
+                f"{attributes['embedding.unprocessable_input_count']} inputs "
+                "isolated by bisecting packed requests"
+            )
         run_metrics = {
             name.removeprefix("metric."): value
             for name, value in attributes.items()
@@ -698,6 +1266,10 @@ def print_output_summary(ml_client: MLClient, job_name: str) -> None:
                 f"  token fill:      "
                 f"{run_metrics[METRICS.token_ceiling_fill_ratio]:.3%}"
             )
+            print(
+                f"  estimated fill:  "
+                f"{run_metrics[METRICS.estimated_token_ceiling_fill_ratio]:.3%}"
+            )
             print(
                 f"  item fill:       "
                 f"{run_metrics[METRICS.item_ceiling_fill_ratio]:.3%}"
@@ -706,6 +1278,31 @@ def print_output_summary(ml_client: MLClient, job_name: str) -> None:
                 f"  token estimate:  "
                 f"{run_metrics[METRICS.estimated_to_actual_token_ratio]:.6f}"
             )
+            print(
+                f"  estimate error:  "
+                f"{run_metrics.get(METRICS.token_estimate_error_p95, 0):.3%} p95"
+            )
+            if (
+                METRICS.token_estimate_rate in run_metrics
+                and run_metrics[METRICS.estimated_to_actual_token_ratio] > 0
+            ):
+                calibrated_rate = calibrated_token_estimate_rate(
+                    run_metrics[METRICS.token_estimate_rate],
+                    run_metrics[METRICS.token_estimate_margin],
+                    run_metrics[METRICS.estimated_to_actual_token_ratio],
+                )
+                print(f"  calibrated rate: {calibrated_rate:.6f} tokens/byte")
+            print(
+                f"  token cache:     "
+                f"{run_metrics.get(METRICS.token_cache_hits, 0):.0f} hits, "
+                f"{run_metrics.get(METRICS.token_cache_misses, 0):.0f} misses"
+            )
+            if METRICS.process_start_to_first_request_ms in run_metrics:
+                print(
+                    f"  first request:   "
+                    f"{run_metrics[METRICS.process_start_to_first_request_ms]:.3f} ms "
+                    "after process start"
+                )
         if request_durations:
             print(f"  latency p50 ms:  {percentile(request_durations, 50):.3f}")
             print(f"  latency p95 ms:  {percentile(request_durations, 95):.3f}")
@@ -827,16 +1424,44 @@ def invoke(
     target_tpm: int,
     target_inputs_per_minute: float,
     max_retries: int,
-    request_concurrency: int,
+    request_concurrency: int | None,
     repeat_inputs: int,
     metric_logging: str,
     metric_prefix: str,
+    execution: str = DEFAULTS.execution,
+    ingest_workers: int = DEFAULTS.ingest_workers,
+    max_batch_inputs: int = DEFAULTS.max_batch_inputs,
+    input_storage: str = DEFAULTS.input_storage,
+    input_columns: str = DEFAULTS.input_columns,
+    token_counting: str = DEFAULTS.token_counting,
+    token_estimate_rate: float = DEFAULTS.token_estimate_rate,
+    token_estimate_margin: float = DEFAULTS.token_estimate_margin,
+    request_sizing: str = DEFAULTS.request_sizing,
+    engine: str = DEFAULTS.engine,
+    pacing_burst_seconds: float = DEFAULTS.pacing_burst_seconds,
+    concurrency_control: str = DEFAULTS.concurrency_control,
+    min_request_concurrency: int = DEFAULTS.min_request_concurrency,
+    pacing: str = DEFAULTS.pacing,
+    output_order: str = DEFAULTS.output_order,
+    reorder_buffer_size: int = DEFAULTS.reorder_buffer_size,
+    shard_count: int | None = None,
+    shard_balance: str = DEFAULTS.shard_balance,
+    packing_plan: Path | None = None,
 ) -> None:
     if repeat_inputs < 1 or repeat_inputs > DEFAULTS.max_repeat_inputs:
         raise ValueError(
             "repeat_inputs must be between 1 and "
             f"{DEFAULTS.max_repeat_inputs}"
         )
+    if (packing == PackingMode.REPLAYED_PLAN) != (packing_plan is not None):
+        raise ValueError("--packing plan and --packing-plan must be used together")
+    if request_concurrency is None and shard_count is not None:
+        request_concurrency = max(DEFAULTS.request_concurrency, shard_count)
+    if shard_count is not None and request_concurrency < shard_count:
+        raise ValueError(
+            f"request_concurrency {request_concurrency} cannot be shared by "
+            f"{shard_count} shards; use at least one request per shard"
+        )
     ml_client, _, _ = clients(settings)
     if max_tokens_per_request is None:
         if model_key == ModelKey.ADA_APIM:
@@ -855,6 +1480,7 @@ def invoke(
             upload_path,
             repeat_inputs,
             settings.openai_models[model_key],
+            packing_plan,
         )
         if repeat_inputs > 1:
             print(
@@ -905,9 +1531,39 @@ def invoke(
                     default=target_inputs_per_minute,
                 ),
                 FIELDS.max_retries: Input(type="integer", default=max_retries),
-                FIELDS.request_concurrency: Input(
-                    type="integer", default=request_concurrency
+                **(
+                    {
+                        FIELDS.request_concurrency: Input(
+                            type="integer", default=request_concurrency
+                        )
+                    }
+                    if request_concurrency is not None
+                    else {}
+                ),
+                FIELDS.execution: Input(type="string", default=execution),
+                FIELDS.ingest_workers: Input(type="integer", default=ingest_workers),
+                FIELDS.max_batch_inputs: Input(type="integer", default=max_batch_inputs),
+                FIELDS.input_storage: Input(type="string", default=input_storage),
+                FIELDS.input_columns: Input(type="string", default=input_columns),
+                FIELDS.token_counting: Input(type="string", default=token_counting),
+                FIELDS.token_estimate_rate: Input(
+                    type="number",
+                    default=token_estimate_rate,
+                ),
+                FIELDS.token_estimate_margin: Input(
+                    type="number",
+                    default=token_estimate_margin,
                 ),
+                FIELDS.request_sizing: Input(type="string", default=request_sizing),
+                FIELDS.engine: Input(type="string", default=engine),
+                FIELDS.pacing_burst_seconds: Input(type="number", default=pacing_burst_seconds),
+                FIELDS.concurrency_control: Input(type="string", default=concurrency_control),
+                FIELDS.min_request_concurrency: Input(
+                    type="integer", default=min_request_concurrency
+                ),
+                FIELDS.pacing: Input(type="string", default=pacing),
+                FIELDS.output_order: Input(type="string", default=output_order),
+                FIELDS.reorder_buffer_size: Input(type="integer", default=reorder_buffer_size),
                 FIELDS.metric_logging: Input(
                     type="string",
                     default=metric_logging,
@@ -916,6 +1572,14 @@ def invoke(
                     type="string",
                     default=metric_prefix,
                 ),
+                **(
+                    {
+                        FIELDS.shard_count: Input(type="integer", default=shard_count),
+                        FIELDS.shard_balance: Input(type="string", default=shard_balance),
+                    }
+                    if shard_count is not None
+                    else {}
+                ),
             },
         )
         print(f"Experiment: {experiment}")
@@ -924,7 +1588,8 @@ def invoke(
             f"Submitted job ID: {job.name} "
             f"({model_key} -> {settings.openai_deployments[model_key]}, "
             f"packing={packing}, repeats={repeat_inputs}, max_retries={max_retries}, "
-            f"concurrency={request_concurrency}, target_tpm={target_tpm}, "
+            f"concurrency={request_concurrency or 'default'}, execution={execution}, "
+            f"target_tpm={target_tpm}, "
             f"target_inputs_per_minute={target_inputs_per_minute}, "
             f"metrics={metric_logging}, "
             f"metric_prefix={metric_prefix})"
@@ -932,9 +1597,25 @@ def invoke(
         monitor(settings, job.name)
 
 
+def input_source_files(input_path: Path) -> list[Path]:
+    """List JSONL and columnar input files, skipping a staged packing plan."""
+    return [
+        path
+        for path in sorted(input_path.rglob("*"))
+        if path.is_file()
+        and (path.suffix == ".jsonl" or is_columnar(path))
+        and path.name != PLAN_FILE
+    ]
+
+
 def count_jsonl_records(input_path: Path) -> int:
+    manifest = read_manifest(input_path)
+    if manifest is not None:
+        return sum(entry.records for entry in manifest)
     record_count = 0
-    for source_path in sorted(input_path.rglob("*.jsonl")):
+    for source_path in input_source_files(input_path):
+        if source_path.suffix != ".jsonl":
+            continue
         with source_path.open(encoding="utf-8") as source:
             record_count += sum(1 for line in source if line.strip())
     if record_count == 0:
@@ -947,12 +1628,24 @@ def repeat_jsonl_inputs(
     output_path: Path,
     repetitions: int,
     model: str,
+    packing_plan: Path | None = None,
 ) -> int:
     output_path.mkdir(parents=True, exist_ok=True)
     record_count = 0
-    for source_path in sorted(input_path.rglob("*.jsonl")):
+    manifest_entries = []
+    source_paths = input_source_files(input_path)
+    source_profile = read_token_profile(
+        input_path,
+        tokenizer_encoding_name(model),
+        source_paths,
+    )
+    repeated_tokens: dict[str, int] = {}
+    for source_path in source_paths:
+        if source_path.suffix != ".jsonl":
+            continue
         destination = output_path / source_path.relative_to(input_path)
         destination.parent.mkdir(parents=True, exist_ok=True)
+        file_record_count = 0
         with source_path.open(encoding="utf-8") as source, destination.open(
             "w", encoding="utf-8"
         ) as output:
@@ -975,6 +1668,10 @@ def repeat_jsonl_inputs(
                         raise ValueError(
                             f"{source_path}: input_id must be a string or array"
                         )
+                    if source_profile is not None and repetitions > 1:
+                        for value in [input_id] if isinstance(input_id, str) else input_id:
+                            if value in source_profile.tokens:
+                                repeated_tokens[value + suffix] = source_profile.tokens[value]
                     output.write(
                         json.dumps(
                             {
@@ -986,9 +1683,58 @@ def repeat_jsonl_inputs(
                         )
                         + "\n"
                     )
-                    record_count += 1
+                    file_record_count += 1
+        manifest_entries.append(
+            manifest_entry(output_path, destination, file_record_count)
+        )
+        record_count += file_record_count
+    for source_path in source_paths:
+        if not is_columnar(source_path):
+            continue
+        if repetitions > 1:
+            raise ValueError(f"{source_path}: repeat_inputs supports only JSONL inputs")
+        destination = output_path / source_path.relative_to(input_path)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(source_path, destination)
+        file_record_count = columnar_row_count(source_path)
+        manifest_entries.append(
+            manifest_entry(output_path, destination, file_record_count)
+        )
+        record_count += file_record_count
     if record_count == 0:
-        raise ValueError(f"No JSONL records found under {input_path}")
+        raise ValueError(f"No input records found under {input_path}")
+    write_manifest(output_path, manifest_entries)
+    if packing_plan is not None:
+        write_packing_plan(
+            output_path / PLAN_FILE,
+            (
+                PlannedRequest(
+                    [
+                        input_id + (f"-repeat-{repetition:02d}" if repetitions > 1 else "")
+                        for input_id in planned.input_ids
+                    ],
+                    planned.estimated_tokens,
+                )
+                for repetition in range(1, repetitions + 1)
+                for planned in read_packing_plan(packing_plan)
+            ),
+        )
+    if source_profile is not None:
+        write_token_profile(
+            output_path,
+            TokenProfile(
+                encoding=source_profile.encoding,
+                sources={
+                    entry.path: profile_source(output_path / entry.path, entry.sha256)
+                    for entry in manifest_entries
+                },
+                tokens=(
+                    source_profile.tokens
+                    if repetitions == 1
+                    else TokenCounts.from_items(repeated_tokens.items())
+                ),
+            ),
+        )
     return record_count
 
 
@@ -1013,7 +1759,10 @@ def export_metrics(
     ml_client, _, _ = clients(settings)
     requested_job = ml_client.jobs.get(job_name)
     children = list(ml_client.jobs.list(parent_job_name=job_name))
-    metric_job = children[0] if children else requested_job
+    metric_job = next(
+        (child for child in children if child.display_name == ARTIFACTS.merge_step),
+        children[0] if children else requested_job,
+    )
     workspace = ml_client.workspaces.get(settings.aml_workspace)
     mlflow.set_tracking_uri(workspace.mlflow_tracking_uri)
     run = mlflow.get_run(metric_job.name)
@@ -1050,6 +1799,23 @@ def test_local(
     request_concurrency: int,
     metric_logging: str,
     metric_prefix: str,
+    execution: str = DEFAULTS.execution,
+    ingest_workers: int = DEFAULTS.ingest_workers,
+    max_batch_inputs: int = DEFAULTS.max_batch_inputs,
+    input_storage: str = DEFAULTS.input_storage,
+    input_columns: str = DEFAULTS.input_columns,
+    token_counting: str = DEFAULTS.token_counting,
+    token_estimate_rate: float = DEFAULTS.token_estimate_rate,
+    token_estimate_margin: float = DEFAULTS.token_estimate_margin,
+    request_sizing: str = DEFAULTS.request_sizing,
+    engine: str = DEFAULTS.engine,
+    pacing_burst_seconds: float = DEFAULTS.pacing_burst_seconds,
+    concurrency_control: str = DEFAULTS.concurrency_control,
+    min_request_concurrency: int = DEFAULTS.min_request_concurrency,
+    pacing: str = DEFAULTS.pacing,
+    output_order: str = DEFAULTS.output_order,
+    reorder_buffer_size: int = DEFAULTS.reorder_buffer_size,
+    packing_plan: Path | None = None,
 ) -> None:
     from component.embed import run
 
@@ -1069,9 +1835,43 @@ def test_local(
         dry_run=True,
         metric_logging=metric_logging,
         metric_prefix=metric_prefix,
+        execution=execution,
+        ingest_workers=ingest_workers,
+        max_batch_inputs=max_batch_inputs,
+        input_storage=input_storage,
+        input_columns=input_columns,
+        token_counting=token_counting,
+        token_estimate_rate=token_estimate_rate,
+        token_estimate_margin=token_estimate_margin,
+        request_sizing=request_sizing,
+        engine=engine,
+        pacing_burst_seconds=pacing_burst_seconds,
+        concurrency_control=concurrency_control,
+        min_request_concurrency=min_request_concurrency,
+        pacing=pacing,
+        output_order=output_order,
+        reorder_buffer_size=reorder_buffer_size,
+        packing_plan_path=packing_plan,
     )
 
 
+def profile_inputs(
+    settings: Settings,
+    input_path: Path,
+    model_key: str,
+    input_columns: str = DEFAULTS.input_columns,
+    target_tpm: int = DEFAULTS.target_tpm,
+) -> None:
+    from component.profile import profile
+
+    token_profile = profile(input_path, settings.openai_models[model_key], input_columns)
+    if target_tpm:
+        print(
+            f"Estimated send time at {target_tpm} TPM: "
+            f"{token_profile.total_tokens / target_tpm:.1f} minutes"
+        )
+
+
 def main() -> None:
     load_dotenv(ROOT / "config" / ".env")
     parser = argparse.ArgumentParser(description=__doc__)
@@ -1085,7 +1885,19 @@ def main() -> None:
         "permissions",
         help="Ensure and verify runtime roles for Foundry, AML compute, and storage",
     )
-    subparsers.add_parser("provision", help="Create/update the model deployment and AML endpoint")
+    provision_parser = subparsers.add_parser(
+        "provision",
+        help="Create/update the model deployment and AML endpoint",
+    )
+    provision_parser.add_argument(
+        "--max-shards",
+        type=int,
+        default=DEFAULTS.max_shards,
+        help=(
+            "Deploy a split/embed/merge pipeline with this many parallel embed "
+            "steps; 1 deploys the single-step pipeline"
+        ),
+    )
     subparsers.add_parser(
         "provision-apim",
         help="Create/update only the parallel APIM-pooled ADA AML deployment",
@@ -1103,7 +1915,10 @@ def main() -> None:
         choices=tuple(PackingMode),
         default=DEFAULTS.packing,
         help=(
-            "none sends one input per HTTP request; batch sends packed input arrays"
+            "none sends one input per HTTP request; batch sends packed input arrays; "
+            "binpack packs arrays by token count to fill the token ceiling; "
+            "sorted packs inputs of similar token length together; "
+            "plan replays --packing-plan"
         ),
     )
     test_parser.add_argument(
@@ -1136,12 +1951,117 @@ def main() -> None:
         type=int,
         default=DEFAULTS.request_concurrency,
     )
+    test_parser.add_argument(
+        "--execution",
+        choices=tuple(ExecutionMode),
+        default=DEFAULTS.execution,
+    )
+    test_parser.add_argument(
+        "--ingest-workers",
+        type=int,
+        default=DEFAULTS.ingest_workers,
+    )
+    test_parser.add_argument(
+        "--max-batch-inputs",
+        type=int,
+        default=DEFAULTS.max_batch_inputs,
+    )
+    test_parser.add_argument(
+        "--input-storage",
+        choices=tuple(InputStorage),
+        default=DEFAULTS.input_storage,
+    )
+    test_parser.add_argument(
+        "--input-columns",
+        default=DEFAULTS.input_columns,
+    )
+    test_parser.add_argument(
+        "--token-counting",
+        choices=tuple(TokenCounting),
+        default=DEFAULTS.token_counting,
+    )
+    test_parser.add_argument(
+        "--token-estimate-rate",
+        type=float,
+        default=DEFAULTS.token_estimate_rate,
+    )
+    test_parser.add_argument(
+        "--token-estimate-margin",
+        type=float,
+        default=DEFAULTS.token_estimate_margin,
+    )
+    test_parser.add_argument(
+        "--request-sizing",
+        choices=tuple(RequestSizing),
+        default=DEFAULTS.request_sizing,
+    )
+    test_parser.add_argument(
+        "--engine",
+        choices=tuple(DispatchEngine),
+        default=DEFAULTS.engine,
+    )
+    test_parser.add_argument(
+        "--pacing-burst-seconds",
+        type=float,
+        default=DEFAULTS.pacing_burst_seconds,
+    )
+    test_parser.add_argument(
+        "--concurrency-control",
+        choices=tuple(ConcurrencyControl),
+        default=DEFAULTS.concurrency_control,
+    )
+    test_parser.add_argument(
+        "--min-request-concurrency",
+        type=int,
+        default=DEFAULTS.min_request_concurrency,
+    )
+    test_parser.add_argument(
+        "--pacing",
+        choices=tuple(PacingSource),
+        default=DEFAULTS.pacing,
+    )
+    test_parser.add_argument(
+        "--output-order",
+        choices=tuple(OutputOrder),
+        default=DEFAULTS.output_order,
+    )
+    test_parser.add_argument(
+        "--reorder-buffer-size",
+        type=int,
+        default=DEFAULTS.reorder_buffer_size,
+    )
+    test_parser.add_argument(
+        "--packing-plan",
+        type=Path,
+        help="packing_plan.jsonl from an earlier run to replay with --packing plan",
+    )
     test_parser.add_argument(
         "--metric-logging",
         choices=tuple(MetricLoggingMode),
         default=DEFAULTS.local_metric_logging,
     )
     test_parser.add_argument("--metric-prefix", default=DEFAULTS.metric_prefix)
+    profile_parser = subparsers.add_parser(
+        "profile",
+        help="Write per-input token counts next to a local input folder",
+    )
+    profile_parser.add_argument(
+        "--input",
+        type=Path,
+        default=ROOT / "data" / "workshop-rpm",
+    )
+    profile_parser.add_argument("--model", choices=MODEL_KEYS, required=True)
+    profile_parser.add_argument(
+        "--input-columns",
+        default=DEFAULTS.input_columns,
+        help="Comma-separated field=column pairs for Parquet and Arrow IPC inputs",
+    )
+    profile_parser.add_argument(
+        "--target-tpm",
+        type=int,
+        default=DEFAULTS.target_tpm,
+        help="Print the send time this profile needs at a token-per-minute target",
+    )
     invoke_parser = subparsers.add_parser("invoke", help="Submit an AML batch job")
     invoke_parser.add_argument(
         "--input",
@@ -1160,7 +2080,10 @@ def main() -> None:
         choices=tuple(PackingMode),
         default=DEFAULTS.packing,
         help=(
-            "none sends one input per HTTP request; batch sends packed input arrays"
+            "none sends one input per HTTP request; batch sends packed input arrays; "
+            "binpack packs arrays by token count to fill the token ceiling; "
+            "sorted packs inputs of similar token length together; "
+            "plan replays --packing-plan"
         ),
     )
     invoke_parser.add_argument(
@@ -1187,9 +2110,147 @@ def main() -> None:
     invoke_parser.add_argument(
         "--request-concurrency",
         type=int,
-        default=DEFAULTS.request_concurrency,
+        help=(
+            "Concurrent requests across all shards; defaults to the deployment's "
+            "setting, or one per shard with --shard-count"
+        ),
     )
     invoke_parser.add_argument("--repeat-inputs", type=int, default=1)
+    invoke_parser.add_argument(
+        "--execution",
+        choices=tuple(ExecutionMode),
+        default=DEFAULTS.execution,
+        help="streaming keeps component memory flat for large input folders",
+    )
+    invoke_parser.add_argument(
+        "--ingest-workers",
+        type=int,
+        default=DEFAULTS.ingest_workers,
+        help="Parse input files in parallel worker processes on the AML node",
+    )
+    invoke_parser.add_argument(
+        "--max-batch-inputs",
+        type=int,
+        default=DEFAULTS.max_batch_inputs,
+        help="Reject batches with more embedding inputs; zero removes the limit",
+    )
+    invoke_parser.add_argument(
+        "--input-storage",
+        choices=tuple(InputStorage),
+        default=DEFAULTS.input_storage,
+        help=(
+            "memory keeps decoded texts until dispatch; mmap reads texts from "
+            "memory-mapped input files at dispatch"
+        ),
+    )
+    invoke_parser.add_argument(
+        "--input-columns",
+        default=DEFAULTS.input_columns,
+        help="Comma-separated field=column pairs for Parquet and Arrow IPC inputs",
+    )
+    invoke_parser.add_argument(
+        "--token-counting",
+        choices=tuple(TokenCounting),
+        default=DEFAULTS.token_counting,
+        help="tokenizer counts tokens with tiktoken; estimate predicts them from UTF-8 length",
+    )
+    invoke_parser.add_argument(
+        "--token-estimate-rate",
+        type=float,
+        default=DEFAULTS.token_estimate_rate,
+        help="Estimated tokens per UTF-8 byte for --token-counting estimate",
+    )
+    invoke_parser.add_argument(
+        "--token-estimate-margin",
+        type=float,
+        default=DEFAULTS.token_estimate_margin,
+        help="Fraction added to every token estimate as a safety margin",
+    )
+    invoke_parser.add_argument(
+        "--request-sizing",
+        choices=tuple(RequestSizing),
+        default=DEFAULTS.request_sizing,
+        help=(
+            "adaptive moves the request token budget by observed throughput, "
+            "latency, and 429s; requires --execution streaming"
+        ),
+    )
+    invoke_parser.add_argument(
+        "--engine",
+        choices=tuple(DispatchEngine),
+        default=DEFAULTS.engine,
+        help=(
+            "async dispatches AsyncOpenAI tasks on one event loop and allows up to "
+            "10,000 concurrent requests"
+        ),
+    )
+    invoke_parser.add_argument(
+        "--pacing-burst-seconds",
+        type=float,
+        default=DEFAULTS.pacing_burst_seconds,
+        help=(
+            "seconds of the TPM and input-rate targets that idle time may bank "
+            "for a burst"
+        ),
+    )
+    invoke_parser.add_argument(
+        "--concurrency-control",
+        choices=tuple(ConcurrencyControl),
+        default=DEFAULTS.concurrency_control,
+        help=(
+            "aimd adds in-flight requests while responses succeed and halves "
+            "them on 429 or 503"
+        ),
+    )
+    invoke_parser.add_argument(
+        "--min-request-concurrency",
+        type=int,
+        default=DEFAULTS.min_request_concurrency,
+        help=(
+            "lower bound for --concurrency-control aimd, which also starts "
+            "there"
+        ),
+    )
+    invoke_parser.add_argument(
+        "--pacing",
+        choices=tuple(PacingSource),
+        default=DEFAULTS.pacing,
+        help=(
+            "headers also holds each request until the last response's "
+            "x-ratelimit-remaining headers cover it"
+        ),
+    )
+    invoke_parser.add_argument(
+        "--output-order",
+        choices=tuple(OutputOrder),
+        default=DEFAULTS.output_order,
+        help="completion writes each response as soon as it arrives",
+    )
+    invoke_parser.add_argument(
+        "--reorder-buffer-size",
+        type=int,
+        default=DEFAULTS.reorder_buffer_size,
+        help=(
+            "with submission order, the most requests sent but not yet written, "
+            "at least --request-concurrency"
+        ),
+    )
+    invoke_parser.add_argument(
+        "--packing-plan",
+        type=Path,
+        help="packing_plan.jsonl from an earlier run to replay with --packing plan",
+    )
+    invoke_parser.add_argument(
+        "--shard-count",
+        type=int,
+        help="Parallel embed steps to use on a deployment provisioned with --max-shards",
+    )
+    invoke_parser.add_argument(
+        "--shard-balance",
+        choices=tuple(ShardBalance),
+        default=DEFAULTS.shard_balance,
+        help="Balance shards by embedding input count or tokenizer token count",
+    )
     invoke_parser.add_argument(
         "--metric-logging",
         choices=tuple(MetricLoggingMode),
@@ -1223,7 +2284,7 @@ def main() -> None:
         setup_permissions(settings)
     elif args.command == "provision":
         print_plan(settings)
-        provision(settings)
+        provision(settings, args.max_shards)
     elif args.command == "provision-apim":
         print_plan(settings)
         provision_apim_deployment(settings)
@@ -1242,6 +2303,31 @@ def main() -> None:
             args.request_concurrency,
             args.metric_logging,
             args.metric_prefix,
+            args.execution,
+            args.ingest_workers,
+            args.max_batch_inputs,
+            args.input_storage,
+            args.input_columns,
+            args.token_counting,
+            args.token_estimate_rate,
+            args.token_estimate_margin,
+            args.request_sizing,
+            args.engine,
+            args.pacing_burst_seconds,
+            args.concurrency_control,
+            args.min_request_concurrency,
+            args.pacing,
+            args.output_order,
+            args.reorder_buffer_size,
+            args.packing_plan,
+        )
+    elif args.command == "profile":
+        profile_inputs(
+            settings,
+            args.input,
+            args.model,
+            args.input_columns,
+            args.target_tpm,
         )
     elif args.command == "invoke":
         invoke(
@@ -1259,6 +2345,25 @@ def main() -> None:
             args.repeat_inputs,
             args.metric_logging,
             args.metric_prefix,
+            args.execution,
+            args.ingest_workers,
+            args.max_batch_inputs,
+            args.input_storage,
+            args.input_columns,
+            args.token_counting,
+            args.token_estimate_rate,
+            args.token_estimate_margin,
+            args.request_sizing,
+            args.engine,
+            args.pacing_burst_seconds,
+            args.concurrency_control,
+            args.min_request_concurrency,
+            args.pacing,
+            args.output_order,
+            args.reorder_buffer_size,
+            args.shard_count,
+            args.shard_balance,
+            args.packing_plan,
         )
     elif args.command == "monitor":
         monitor(settings, args.job_name)
@@ -36,6 +36,7 @@ class RouteOutput:
     path: Path
     vectors: dict[str, tuple[float, ...]] = field(default_factory=dict)
     batch_sizes: list[int] = field(default_factory=list)
+    batches: list[tuple[str, ...]] = field(default_factory=list)
     duplicate_ids: list[str] = field(default_factory=list)
     error_records: int = 0
     prompt_tokens: int = 0
@@ -99,6 +100,7 @@ def load_route(target: Path, label: str) -> RouteOutput:
             route.models.add(str(record["model"]))
         items = record.get("data") or []
         route.batch_sizes.append(len(items))
+        route.batches.append(tuple(str(item.get("input_id")) for item in items))
         for item in items:
             input_id = item.get("input_id")
             if input_id is None:
@@ -241,7 +243,7 @@ def build_report(
 ) -> dict[str, Any]:
     return {
         "routes": [_summarize(baseline), _summarize(candidate)],
-        "identical_batching": baseline.batch_sizes == candidate.batch_sizes,
+        "identical_batching": sorted(baseline.batches) == sorted(candidate.batches),
         "comparison": {
             "common_input_ids": comparison.common,
             "only_baseline": comparison.only_baseline[:SAMPLE_LIMIT],
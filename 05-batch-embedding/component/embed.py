@@ -1,17 +1,39 @@
 import argparse
+import asyncio
 import json
+import math
+import os
+from array import array
 import sys
 import time
 import threading
-from concurrent.futures import ThreadPoolExecutor
-from collections.abc import Iterable
-from dataclasses import dataclass
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from collections import deque
+from collections.abc import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterable,
+    Iterator,
+    Mapping,
+)
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
 from enum import StrEnum
+from functools import partial
+from itertools import islice
 from pathlib import Path
+from queue import Empty, SimpleQueue
 from typing import Any
 
 from azure.identity import get_bearer_token_provider
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
 from opentelemetry import trace
 from opentelemetry.trace import Status, StatusCode
 from opentelemetry.sdk.resources import Resource
@@ -26,22 +48,95 @@ from opentelemetry.sdk.trace.export import (
 from utils.fdyauth import AuthHelper
 from utils.aml_metrics import (
     DEFAULT_METRIC_PREFIX,
+    METRICS,
     MetricLoggingMode,
     RequestMeasurement,
     calculate_run_metrics,
+    publish_metric_series,
     publish_run_metrics,
 )
+from utils.columnar_input import (
+    COLUMNAR_SUFFIXES,
+    column_batches,
+    column_value,
+    is_columnar,
+    parse_column_mapping,
+)
+from utils.input_index import InputIdIndex
+from utils.input_manifest import MANIFEST_FILE, read_manifest
+from utils.record_index import (
+    RecordReader,
+    RecordText,
+    default_index_dir,
+    write_line_offsets,
+)
 from utils.embedding_optimization import (
-    input_pacing_interval_seconds,
+    DEFAULT_TOKEN_ESTIMATE_RATE,
+    AdaptiveConcurrency,
+    AdaptiveTokenBudget,
+    RateLimitHeaderGate,
+    TokenBucketLimiter,
     pack_compatible_requests,
-    pacing_interval_seconds,
+    replay_packing_plan,
     token_counter_for_model,
+    token_estimator,
+    tokenizer_encoding_name,
+)
+from utils.packing_plan import (
+    PLAN_FILE,
+    folder_packing_plan,
+    read_packing_plan,
+    write_plan_entry,
 )
+from utils.token_profile import TokenProfile, read_token_profile
 
 
 class PackingMode(StrEnum):
     ONE_INPUT_PER_REQUEST = "none"
     PACKED_INPUT_ARRAY = "batch"
+    BIN_PACKED_INPUT_ARRAY = "binpack"
+    LENGTH_SORTED_INPUT_ARRAY = "sorted"
+    REPLAYED_PLAN = "plan"
+
+
+class ExecutionMode(StrEnum):
+    BUFFERED = "buffered"
+    STREAMING = "streaming"
+
+
+class DispatchEngine(StrEnum):
+    THREAD = "thread"
+    ASYNC = "async"
+
+
+class PacingSource(StrEnum):
+    TARGETS = "targets"
+    HEADERS = "headers"
+
+
+class OutputOrder(StrEnum):
+    SUBMISSION = "submission"
+    COMPLETION = "completion"
+
+
+class ConcurrencyControl(StrEnum):
+    STATIC = "static"
+    AIMD = "aimd"
+
+
+class TokenCounting(StrEnum):
+    TOKENIZER = "tokenizer"
+    ESTIMATE = "estimate"
+
+
+class RequestSizing(StrEnum):
+    FIXED = "fixed"
+    ADAPTIVE = "adaptive"
+
+
+class InputStorage(StrEnum):
+    MEMORY = "memory"
+    MAPPED = "mmap"
 
 
 class EncodingFormat(StrEnum):
@@ -94,6 +189,39 @@ class TraceContract:
     target_inputs_per_minute: str = "embedding.target_inputs_per_minute"
     max_retries: str = "embedding.max_retries"
     request_concurrency: str = "embedding.request_concurrency"
+    max_batch_inputs: str = "embedding.max_batch_inputs"
+    input_id_index_bytes: str = "embedding.input_id_index_bytes"
+    execution: str = "embedding.execution"
+    engine: str = "embedding.engine"
+    pacing_burst_seconds: str = "embedding.pacing_burst_seconds"
+    concurrency_control: str = "embedding.concurrency_control"
+    min_request_concurrency: str = "embedding.min_request_concurrency"
+    concurrency_limits: str = "embedding.concurrency_limits"
+    concurrency_limit_offsets_ms: str = "embedding.concurrency_limit_offsets_ms"
+    pacing: str = "embedding.pacing"
+    rate_limit_gated_requests: str = "embedding.rate_limit_gated_requests"
+    rate_limit_gated_ms: str = "embedding.rate_limit_gated_ms"
+    output_order: str = "embedding.output_order"
+    reorder_buffer_size: str = "embedding.reorder_buffer_size"
+    first_output_offset_ms: str = "embedding.first_output_offset_ms"
+    max_in_flight_requests: str = "embedding.max_in_flight_requests"
+    ingest_workers: str = "embedding.ingest_workers"
+    input_storage: str = "embedding.input_storage"
+    input_manifest: str = "embedding.input_manifest"
+    token_profile: str = "embedding.token_profile"
+    token_counting: str = "embedding.token_counting"
+    tokenizer_load_ms: str = "embedding.tokenizer_load_ms"
+    request_sizing: str = "embedding.request_sizing"
+    packing_plan_replayed: str = "embedding.packing_plan_replayed"
+    packing_plan: str = "embedding.packing_plan"
+    token_budgets: str = "embedding.token_budgets"
+    token_budget_offsets_ms: str = "embedding.token_budget_offsets_ms"
+    shard_count: str = "embedding.shard_count"
+    ingest_file_count: str = "embedding.ingest_file_count"
+    ingest_bytes: str = "embedding.ingest_bytes"
+    ingest_duration_ms: str = "embedding.ingest_duration_ms"
+    ingest_worker_parse_ms: str = "embedding.ingest_worker_parse_ms"
+    ingest_rows_per_second: str = "embedding.ingest_rows_per_second"
     token_scope: str = "embedding.token_scope"
     metric_logging: str = "embedding.metric_logging"
     metric_prefix: str = "embedding.metric_prefix"
@@ -102,12 +230,17 @@ class TraceContract:
     online_request_count: str = "embedding.online_request_count"
     embedding_input_count: str = "embedding.input_count"
     failed_count: str = "embedding.failed_count"
+    unprocessable_input_count: str = "embedding.unprocessable_input_count"
     duration_ms: str = "embedding.duration_ms"
     request_start_offset_ms: str = "request.start_offset_ms"
     request_duration_ms: str = "request.duration_ms"
     batch_number: str = "batch.number"
     batch_input_count: str = "batch.embedding_input_count"
     batch_estimated_tokens: str = "batch.estimated_tokens"
+    batch_token_budget: str = "batch.token_budget"
+    batch_concurrency_limit: str = "batch.concurrency_limit"
+    batch_bisect_calls: str = "batch.bisect_calls"
+    batch_unprocessable_input_count: str = "batch.unprocessable_input_count"
     batch_prompt_tokens: str = "batch.prompt_tokens"
     http_status_code: str = "http.status_code"
     http_retry_after_ms: str = "http.retry_after_ms"
@@ -118,14 +251,19 @@ class TraceContract:
 class ComponentFiles:
     embeddings: str = "embeddings.jsonl"
     trace: str = "trace.jsonl"
+    packing_plan: str = "packing_plan.jsonl"
+    unprocessable_inputs: str = "unprocessable_inputs.jsonl"
 
 
 @dataclass(frozen=True)
 class ComponentLimits:
     max_array_inputs: int = 2048
     max_request_tokens: int = 300_000
-    max_batch_inputs: int = 50_000
     max_request_concurrency: int = 100
+    max_async_request_concurrency: int = 10_000
+    max_in_flight_requests: int = 10_000
+    max_ingest_workers: int = 64
+    max_shards: int = 64
 
 
 @dataclass(frozen=True)
@@ -138,6 +276,30 @@ class ComponentDefaults:
     target_inputs_per_minute: float = 0
     max_retries: int = 8
     request_concurrency: int = 1
+    max_batch_inputs: int = 50_000
+    execution: ExecutionMode = ExecutionMode.BUFFERED
+    engine: DispatchEngine = DispatchEngine.THREAD
+    pacing_burst_seconds: float = 0.0
+    concurrency_control: ConcurrencyControl = ConcurrencyControl.STATIC
+    min_request_concurrency: int = 1
+    pacing: PacingSource = PacingSource.TARGETS
+    output_order: OutputOrder = OutputOrder.SUBMISSION
+    reorder_buffer_size: int = 0
+    max_in_flight_requests: int = 0
+    in_flight_requests_per_worker: int = 2
+    ingest_workers: int = 0
+    in_flight_files_per_ingest_worker: int = 2
+    columnar_batch_rows: int = 8_192
+    shard_count: int = 1
+    input_storage: InputStorage = InputStorage.MEMORY
+    token_counting: TokenCounting = TokenCounting.TOKENIZER
+    token_estimate_rate: float = DEFAULT_TOKEN_ESTIMATE_RATE
+    token_estimate_margin: float = 0.1
+    request_sizing: RequestSizing = RequestSizing.FIXED
+    adaptive_min_token_fraction: float = 0.125
+    bisect_status_codes: tuple[int, ...] = (413,)
+    bisect_error_codes: tuple[str, ...] = ("context_length_exceeded", "string_above_max_length")
+    bisect_error_message: str = "maximum context length"
     token_scope: str = "https://ai.azure.com/.default"
     dry_run_dimensions: int = 2
     dry_run_base64_embedding: str = "AAAAAA=="
@@ -165,6 +327,15 @@ LIMITS = ComponentLimits()
 DEFAULTS = ComponentDefaults()
 RATE_LIMIT = RateLimitHeaders()
 
+ROW_FIELDS = (
+    REQUEST.input_id,
+    REQUEST.input,
+    REQUEST.model,
+    REQUEST.dimensions,
+    REQUEST.encoding_format,
+    REQUEST.user,
+)
+
 
 class JsonLinesSpanExporter(SpanExporter):
     def __init__(self, path: Path) -> None:
@@ -197,6 +368,38 @@ class JsonLinesSpanExporter(SpanExporter):
         self._stream.close()
 
 
+class LazyOutputFile:
+    """A text output that replaces any earlier file and is created on first write."""
+
+    def __init__(self, path: Path) -> None:
+        path.unlink(missing_ok=True)
+        self._path = path
+        self._stream: Any = None
+
+    def write(self, text: str) -> int:
+        if self._stream is None:
+            self._stream = self._path.open("w", encoding="utf-8")
+        return self._stream.write(text)
+
+    def __enter__(self) -> "LazyOutputFile":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        if self._stream is not None:
+            self._stream.close()
+
+
+def process_uptime_seconds() -> float | None:
+    """Return how long ago this process started, from /proc on Linux."""
+    try:
+        stat_fields = Path("/proc/self/stat").read_text().rsplit(")", 1)[1].split()
+        uptime_seconds = float(Path("/proc/uptime").read_text().split()[0])
+        started_ticks = int(stat_fields[19])
+    except (OSError, IndexError, ValueError):
+        return None
+    return max(uptime_seconds - started_ticks / os.sysconf("SC_CLK_TCK"), 0.0)
+
+
 def configure_tracing(output_dir: Path) -> TracerProvider:
     provider = TracerProvider(resource=Resource.create({"service.name": TRACE.service_name}))
     provider.add_span_processor(SimpleSpanProcessor(ConsoleSpanExporter(out=sys.stdout)))
@@ -207,109 +410,596 @@ def configure_tracing(output_dir: Path) -> TracerProvider:
     return provider
 
 
-def validate_request(row: Any, source: str, expected_model: str) -> dict[str, Any]:
-    if not isinstance(row, dict):
-        raise ValueError(f"{source}: each line must be a JSON object")
-    allowed_fields = {
-        REQUEST.input_id,
-        REQUEST.input,
-        REQUEST.model,
-        REQUEST.dimensions,
-        REQUEST.encoding_format,
-        REQUEST.user,
-    }
-    unknown_fields = sorted(set(row) - allowed_fields)
-    if unknown_fields:
-        raise ValueError(f"{source}: unsupported fields: {', '.join(unknown_fields)}")
-    if row.get(REQUEST.model) != expected_model:
-        raise ValueError(
-            f"{source}: model must match the selected deployment model "
-            f"{expected_model!r}"
-        )
-    input_value = row.get(REQUEST.input)
-    input_id_value = row.get(REQUEST.input_id)
-    if isinstance(input_value, str):
-        if not input_value:
-            raise ValueError(f"{source}: input must not be empty")
-        if not isinstance(input_id_value, str) or not input_id_value:
-            raise ValueError(f"{source}: input_id must be a non-empty string")
-        input_ids = [input_id_value]
-        texts = [input_value]
-    elif isinstance(input_value, list) and input_value:
-        if len(input_value) > LIMITS.max_array_inputs:
-            raise ValueError(
-                f"{source}: input must contain at most "
-                f"{LIMITS.max_array_inputs} texts"
+def ordered_results(
+    executor: Executor,
+    execute: Callable[[Any], Any],
+    items: Iterable[Any],
+    max_in_flight: int | None = None,
+) -> Iterator[tuple[Any, Any]]:
+    """Yield results in submission order with a bounded submit window."""
+    pending: deque[tuple[Any, Future]] = deque()
+    for item in items:
+        pending.append((item, executor.submit(execute, item)))
+        if max_in_flight is not None and len(pending) >= max_in_flight:
+            completed_item, future = pending.popleft()
+            yield completed_item, future.result()
+    while pending:
+        completed_item, future = pending.popleft()
+        yield completed_item, future.result()
+
+
+def completed_results(
+    executor: Executor,
+    execute: Callable[[Any], Any],
+    items: Iterable[Any],
+    max_in_flight: int | None = None,
+) -> Iterator[tuple[Any, Any]]:
+    """Yield results in completion order with a bounded submit window."""
+    done: SimpleQueue[tuple[Any, Future]] = SimpleQueue()
+    pending = 0
+
+    def collect(item: Any, future: Future) -> None:
+        done.put((item, future))
+
+    for item in items:
+        executor.submit(execute, item).add_done_callback(partial(collect, item))
+        pending += 1
+        if max_in_flight is not None and pending >= max_in_flight:
+            completed_item, future = done.get()
+            pending -= 1
+            yield completed_item, future.result()
+        while True:
+            try:
+                completed_item, future = done.get_nowait()
+            except Empty:
+                break
+            pending -= 1
+            yield completed_item, future.result()
+    while pending:
+        completed_item, future = done.get()
+        pending -= 1
+        yield completed_item, future.result()
+
+
+async def ordered_async_results(
+    execute: Callable[[Any], Awaitable[Any]],
+    items: Iterable[Any],
+    max_in_flight: int | None = None,
+) -> AsyncIterator[tuple[Any, Any]]:
+    """Yield task results in creation order with a bounded task window."""
+    pending: deque[tuple[Any, asyncio.Task]] = deque()
+    for item in items:
+        pending.append((item, asyncio.create_task(execute(item))))
+        if max_in_flight is not None and len(pending) >= max_in_flight:
+            completed_item, task = pending.popleft()
+            yield completed_item, await task
+        else:
+            await asyncio.sleep(0)
+    while pending:
+        completed_item, task = pending.popleft()
+        yield completed_item, await task
+
+
+async def completed_async_results(
+    execute: Callable[[Any], Awaitable[Any]],
+    items: Iterable[Any],
+    max_in_flight: int | None = None,
+) -> AsyncIterator[tuple[Any, Any]]:
+    """Yield task results in completion order with a bounded task window."""
+    done: asyncio.Queue[tuple[Any, asyncio.Task]] = asyncio.Queue()
+    pending = 0
+
+    def collect(item: Any, task: asyncio.Task) -> None:
+        done.put_nowait((item, task))
+
+    for item in items:
+        asyncio.create_task(execute(item)).add_done_callback(partial(collect, item))
+        pending += 1
+        if max_in_flight is not None and pending >= max_in_flight:
+            completed_item, task = await done.get()
+            pending -= 1
+            yield completed_item, task.result()
+        else:
+            await asyncio.sleep(0)
+        while not done.empty():
+            completed_item, task = done.get_nowait()
+            pending -= 1
+            yield completed_item, task.result()
+    while pending:
+        completed_item, task = await done.get()
+        pending -= 1
+        yield completed_item, task.result()
+
+
+class RequestValidator:
+    """Row validator with a single-pass fast path for plain single-text rows."""
+
+    def __init__(self, expected_model: str) -> None:
+        self.expected_model = expected_model
+        self.allowed_fields = frozenset(ROW_FIELDS)
+        self.encoding_formats = frozenset(EncodingFormat)
+
+    def __call__(self, row: Any, source: str) -> dict[str, Any]:
+        if type(row) is dict and len(row) == 3:
+            request = self.single(
+                row.get(REQUEST.input_id),
+                row.get(REQUEST.input),
+                row.get(REQUEST.model),
             )
-        if not all(isinstance(text, str) and bool(text) for text in input_value):
-            raise ValueError(f"{source}: input must contain only non-empty strings")
-        if not isinstance(input_id_value, list) or len(input_id_value) != len(input_value):
+            if request is not None:
+                return request
+        return self.validate(row, source)
+
+    def single(
+        self,
+        input_id_value: Any,
+        input_value: Any,
+        model: Any,
+    ) -> dict[str, Any] | None:
+        """Return the request for a valid single-text row, or None to fall back."""
+        if (
+            type(input_value) is str
+            and input_value
+            and type(input_id_value) is str
+            and input_id_value
+            and model == self.expected_model
+        ):
+            return {
+                REQUEST.input_ids: [input_id_value],
+                REQUEST.texts: [input_value],
+                REQUEST.body: {
+                    REQUEST.model: self.expected_model,
+                    REQUEST.input: input_value,
+                },
+                REQUEST.input_count: 1,
+            }
+        return None
+
+    def validate(self, row: Any, source: str) -> dict[str, Any]:
+        if not isinstance(row, dict):
+            raise ValueError(f"{source}: each line must be a JSON object")
+        if not self.allowed_fields.issuperset(row):
+            unknown_fields = sorted(row.keys() - self.allowed_fields)
+            raise ValueError(f"{source}: unsupported fields: {', '.join(unknown_fields)}")
+        if row.get(REQUEST.model) != self.expected_model:
             raise ValueError(
-                f"{source}: input_id must be an array with one ID per input text"
+                f"{source}: model must match the selected deployment model "
+                f"{self.expected_model!r}"
             )
-        if not all(isinstance(input_id, str) and bool(input_id) for input_id in input_id_value):
-            raise ValueError(f"{source}: input_id must contain only non-empty strings")
-        input_ids = input_id_value
-        texts = input_value
+        input_value = row.get(REQUEST.input)
+        input_id_value = row.get(REQUEST.input_id)
+        if isinstance(input_value, str):
+            if not input_value:
+                raise ValueError(f"{source}: input must not be empty")
+            if not isinstance(input_id_value, str) or not input_id_value:
+                raise ValueError(f"{source}: input_id must be a non-empty string")
+            input_ids = [input_id_value]
+            texts = [input_value]
+        elif isinstance(input_value, list) and input_value:
+            if len(input_value) > LIMITS.max_array_inputs:
+                raise ValueError(
+                    f"{source}: input must contain at most "
+                    f"{LIMITS.max_array_inputs} texts"
+                )
+            for text in input_value:
+                if not isinstance(text, str) or not text:
+                    raise ValueError(f"{source}: input must contain only non-empty strings")
+            if not isinstance(input_id_value, list) or len(input_id_value) != len(input_value):
+                raise ValueError(
+                    f"{source}: input_id must be an array with one ID per input text"
+                )
+            for input_id in input_id_value:
+                if not isinstance(input_id, str) or not input_id:
+                    raise ValueError(f"{source}: input_id must contain only non-empty strings")
+            input_ids = input_id_value
+            texts = input_value
+        else:
+            raise ValueError(f"{source}: input must be a non-empty string or array of strings")
+        if len(input_ids) > 1 and len(set(input_ids)) != len(input_ids):
+            raise ValueError(f"{source}: input_id values must be unique")
+
+        encoding_format = row.get(REQUEST.encoding_format, DEFAULTS.encoding_format)
+        if encoding_format not in self.encoding_formats:
+            raise ValueError(f"{source}: encoding_format must be float or base64")
+        dimensions = row.get(REQUEST.dimensions)
+        if dimensions is not None and (
+            not isinstance(dimensions, int) or isinstance(dimensions, bool) or dimensions <= 0
+        ):
+            raise ValueError(f"{source}: dimensions must be a positive integer")
+        user = row.get(REQUEST.user)
+        if user is not None and not isinstance(user, str):
+            raise ValueError(f"{source}: user must be a string")
+
+        body = dict(row)
+        body.pop(REQUEST.input_id, None)
+        return {
+            REQUEST.input_ids: input_ids,
+            REQUEST.texts: texts,
+            REQUEST.body: body,
+            REQUEST.input_count: len(texts),
+        }
+
+
+def validate_request(row: Any, source: str, expected_model: str) -> dict[str, Any]:
+    return RequestValidator(expected_model)(row, source)
+
+
+@dataclass
+class IngestStats:
+    file_count: int = 0
+    row_count: int = 0
+    byte_count: int = 0
+    worker_parse_seconds: float = 0.0
+    input_id_index_bytes: int = 0
+    started_seconds: float | None = None
+    completed_seconds: float | None = None
+
+    def add(self, other: "IngestStats") -> None:
+        self.file_count += other.file_count
+        self.row_count += other.row_count
+        self.byte_count += other.byte_count
+        self.worker_parse_seconds += other.worker_parse_seconds
+
+
+@dataclass(frozen=True)
+class InputFile:
+    index: int
+    path: Path
+    sidecar: Path | None = None
+    columns: Mapping[str, str] = field(default_factory=dict)
+
+
+CompactRow = tuple[int, list[str], Any, dict[str, Any]]
+
+
+@dataclass(frozen=True)
+class ParsedFile:
+    rows: list[CompactRow]
+    stats: IngestStats = field(default_factory=IngestStats)
+    error: ValueError | None = None
+
+
+@dataclass
+class RequestAttempt:
+    span: trace.Span
+    started_seconds: float
+    status_code: int | None = None
+    prompt_tokens: int = 0
+
+
+def input_files(input_dir: Path, shard_files: Path | None = None) -> list[Path]:
+    """List input files from a shard or folder manifest, or walk the tree without one."""
+    if shard_files is not None:
+        manifest = read_manifest(shard_files)
+        if manifest is None:
+            raise ValueError(f"{shard_files} has no {MANIFEST_FILE}")
+        return [input_dir / entry.path for entry in manifest]
+    manifest = read_manifest(input_dir)
+    if manifest is not None:
+        return [input_dir / entry.path for entry in manifest]
+    return [
+        path
+        for path in sorted(input_dir.rglob("*"))
+        if path.is_file()
+        and path.suffix in (".jsonl", *COLUMNAR_SUFFIXES)
+        and path.name != PLAN_FILE
+    ]
+
+
+def row_location(file_index: int, row_number: int) -> int:
+    return file_index << 32 | row_number
+
+
+def row_input_ids(
+    sources: list[InputFile],
+    location: int,
+    reader: RecordReader | None = None,
+) -> list[str]:
+    """Re-read the input IDs of one row to confirm a digest match."""
+    source = sources[location >> 32]
+    row_number = location & 0xFFFFFFFF
+    if is_columnar(source.path):
+        input_id = column_value(
+            source.path,
+            source.columns.get(REQUEST.input_id, REQUEST.input_id),
+            row_number - 1,
+        )
     else:
-        raise ValueError(f"{source}: input must be a non-empty string or array of strings")
-    if len(set(input_ids)) != len(input_ids):
-        raise ValueError(f"{source}: input_id values must be unique")
-
-    encoding_format = row.get(REQUEST.encoding_format, DEFAULTS.encoding_format)
-    if encoding_format not in (EncodingFormat.FLOAT, EncodingFormat.BASE64):
-        raise ValueError(f"{source}: encoding_format must be float or base64")
-    dimensions = row.get(REQUEST.dimensions)
-    if dimensions is not None and (
-        not isinstance(dimensions, int) or isinstance(dimensions, bool) or dimensions <= 0
-    ):
-        raise ValueError(f"{source}: dimensions must be a positive integer")
-    user = row.get(REQUEST.user)
-    if user is not None and not isinstance(user, str):
-        raise ValueError(f"{source}: user must be a string")
-
-    body = {
-        key: value
-        for key, value in row.items()
-        if key != REQUEST.input_id
+        if reader is not None:
+            line = reader.line(source.index, row_number)
+        else:
+            with source.path.open("rb") as stream:
+                line = next(islice(stream, row_number - 1, None))
+        input_id = json.loads(line)[REQUEST.input_id]
+    return [input_id] if isinstance(input_id, str) else input_id
+
+
+def reference_texts(request: dict[str, Any], record: RecordText) -> dict[str, Any]:
+    """Replace decoded texts with line references resolved at dispatch time."""
+    body = request[REQUEST.body]
+    if isinstance(body[REQUEST.input], str):
+        references = [record]
+        body_input: Any = record
+    else:
+        references = [
+            RecordText(record.file_index, record.offset, record.length, position)
+            for position in range(request[REQUEST.input_count])
+        ]
+        body_input = references
+    return {
+        **request,
+        REQUEST.texts: references,
+        REQUEST.body: {**body, REQUEST.input: body_input},
     }
+
+
+def parse_request_lines(
+    input_file: InputFile,
+    validate: RequestValidator,
+    stats: IngestStats,
+) -> Iterator[tuple[int, dict[str, Any]]]:
+    stats.file_count += 1
+    offsets = array("Q", [0]) if input_file.sidecar is not None else None
+    offset = 0
+    with input_file.path.open("rb") as stream:
+        for row_number, line in enumerate(stream, start=1):
+            line_offset = offset
+            offset += len(line)
+            stats.byte_count += len(line)
+            if offsets is not None:
+                offsets.append(offset)
+            if not line.strip():
+                continue
+            source = f"{input_file.path.name}:{row_number}"
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as error:
+                raise ValueError(f"{source}: invalid JSON: {error.msg}") from error
+            stats.row_count += 1
+            request = validate(row, source)
+            if offsets is not None:
+                request = reference_texts(
+                    request,
+                    RecordText(input_file.index, line_offset, len(line)),
+                )
+            yield row_number, request
+    if offsets is not None:
+        write_line_offsets(input_file.path, input_file.sidecar, offsets)
+
+
+def parse_request_columns(
+    input_file: InputFile,
+    validate: RequestValidator,
+    stats: IngestStats,
+) -> Iterator[tuple[int, dict[str, Any]]]:
+    """Validate a Parquet or Arrow IPC file one record batch at a time."""
+    stats.file_count += 1
+    stats.byte_count += input_file.path.stat().st_size
+    row_number = 0
+    for batch in column_batches(
+        input_file.path,
+        ROW_FIELDS,
+        input_file.columns,
+        required=(REQUEST.input_id, REQUEST.input),
+        batch_rows=DEFAULTS.columnar_batch_rows,
+    ):
+        input_ids = batch[REQUEST.input_id]
+        texts = batch[REQUEST.input]
+        models = batch.get(REQUEST.model)
+        simple = all(
+            field in (REQUEST.input_id, REQUEST.input, REQUEST.model)
+            for field in batch
+        )
+        for index, (input_id, text) in enumerate(zip(input_ids, texts, strict=True)):
+            row_number += 1
+            model = models[index] if models is not None else validate.expected_model
+            request = validate.single(input_id, text, model) if simple else None
+            if request is None:
+                row = {
+                    field: values[index]
+                    for field, values in batch.items()
+                    if values[index] is not None
+                }
+                row.setdefault(REQUEST.model, validate.expected_model)
+                request = validate(row, f"{input_file.path.name}:{row_number}")
+            stats.row_count += 1
+            yield row_number, request
+
+
+def parse_requests(
+    input_file: InputFile,
+    validate: RequestValidator,
+    stats: IngestStats,
+) -> Iterator[tuple[int, dict[str, Any]]]:
+    if is_columnar(input_file.path):
+        return parse_request_columns(input_file, validate, stats)
+    return parse_request_lines(input_file, validate, stats)
+
+
+def compact_row(
+    row_number: int,
+    request: dict[str, Any],
+    settings: dict[tuple[Any, ...], dict[str, Any]],
+) -> CompactRow:
+    """Flatten a request for the trip back from a worker, sharing settings dicts."""
+    body = request[REQUEST.body]
+    value = body[REQUEST.input]
+    if isinstance(value, RecordText):
+        value = (value.offset, value.length, None)
+    elif isinstance(value[0], RecordText):
+        value = (value[0].offset, value[0].length, len(value))
+    body_settings = {field: item for field, item in body.items() if field != REQUEST.input}
+    key = tuple(body_settings.items())
+    return row_number, request[REQUEST.input_ids], value, settings.setdefault(key, body_settings)
+
+
+def expanded_request(file_index: int, row: CompactRow) -> dict[str, Any]:
+    _, input_ids, value, settings = row
+    if isinstance(value, tuple):
+        offset, length, count = value
+        if count is None:
+            body_input = RecordText(file_index, offset, length)
+            texts = [body_input]
+        else:
+            texts = [
+                RecordText(file_index, offset, length, position)
+                for position in range(count)
+            ]
+            body_input = texts
+    else:
+        body_input = value
+        texts = [value] if isinstance(value, str) else value
     return {
         REQUEST.input_ids: input_ids,
         REQUEST.texts: texts,
-        REQUEST.body: body,
+        REQUEST.body: {**settings, REQUEST.input: body_input},
         REQUEST.input_count: len(texts),
     }
 
 
-def read_requests(input_dir: Path, expected_model: str) -> Iterable[dict[str, Any]]:
-    input_ids: set[str] = set()
+def parse_request_file(
+    input_file: InputFile,
+    validate: RequestValidator,
+    max_inputs: int = 0,
+) -> ParsedFile:
+    """Parse one file in a worker; stop at its first error or past max_inputs."""
+    started = time.perf_counter()
+    stats = IngestStats()
+    rows: list[CompactRow] = []
+    settings: dict[tuple[Any, ...], dict[str, Any]] = {}
+    inputs = 0
+    error = None
+    try:
+        for row_number, request in parse_requests(input_file, validate, stats):
+            rows.append(compact_row(row_number, request, settings))
+            inputs += request[REQUEST.input_count]
+            if max_inputs and inputs > max_inputs:
+                break
+    except ValueError as parse_error:
+        error = parse_error
+    stats.worker_parse_seconds = time.perf_counter() - started
+    return ParsedFile(rows=rows, stats=stats, error=error)
+
+
+def parsed_requests(
+    input_files: list[InputFile],
+    validate: RequestValidator,
+    ingest_workers: int,
+    stats: IngestStats,
+    max_inputs: int = 0,
+) -> Iterator[tuple[int, int, dict[str, Any]]]:
+    if ingest_workers <= 1 or len(input_files) <= 1:
+        for input_file in input_files:
+            for row_number, request in parse_requests(
+                input_file,
+                validate,
+                stats,
+            ):
+                yield input_file.index, row_number, request
+        return
+    with ProcessPoolExecutor(max_workers=min(ingest_workers, len(input_files))) as executor:
+        try:
+            for input_file, parsed in ordered_results(
+                executor,
+                partial(parse_request_file, validate=validate, max_inputs=max_inputs),
+                input_files,
+                max_in_flight=ingest_workers * DEFAULTS.in_flight_files_per_ingest_worker,
+            ):
+                stats.add(parsed.stats)
+                for row in parsed.rows:
+                    yield input_file.index, row[0], expanded_request(input_file.index, row)
+                if parsed.error is not None:
+                    raise parsed.error
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+
+def located_requests(
+    input_dir: Path,
+    expected_model: str,
+    ingest_workers: int = DEFAULTS.ingest_workers,
+    stats: IngestStats | None = None,
+    max_batch_inputs: int = DEFAULTS.max_batch_inputs,
+    reader: RecordReader | None = None,
+    columns: Mapping[str, str] | None = None,
+    shard_files: Path | None = None,
+) -> Iterator[tuple[Path, int, dict[str, Any]]]:
+    """Merge parsed files in order with their file and row; ID and limit checks stay here."""
+    stats = stats if stats is not None else IngestStats()
+    columns = dict(columns or {})
+    paths = input_files(input_dir, shard_files) if reader is None else reader.paths
+    sources = [
+        InputFile(
+            index,
+            path,
+            sidecar=(
+                reader.sidecar(index)
+                if reader is not None and not is_columnar(path)
+                else None
+            ),
+            columns=columns,
+        )
+        for index, path in enumerate(paths)
+    ]
+    input_ids = InputIdIndex(partial(row_input_ids, sources, reader=reader))
     total_inputs = 0
-    for path in sorted(input_dir.rglob("*")):
-        if not path.is_file() or path.suffix != ".jsonl":
-            continue
-        with path.open(encoding="utf-8") as stream:
-            for row_number, line in enumerate(stream, start=1):
-                if not line.strip():
-                    continue
-                source = f"{path.name}:{row_number}"
-                try:
-                    row = json.loads(line)
-                except json.JSONDecodeError as error:
-                    raise ValueError(f"{source}: invalid JSON: {error.msg}") from error
-                request = validate_request(row, source, expected_model)
-                for input_id in request[REQUEST.input_ids]:
-                    if input_id in input_ids:
-                        raise ValueError(
-                            f"{source}: duplicate batch input_id {input_id!r}"
-                        )
-                    input_ids.add(input_id)
-                total_inputs += request[REQUEST.input_count]
-                if total_inputs > LIMITS.max_batch_inputs:
-                    raise ValueError(
-                        f"batch exceeds the {LIMITS.max_batch_inputs:,} "
-                        "embedding input limit"
-                    )
-                yield request
+    stats.started_seconds = time.perf_counter()
+    for file_index, row_number, request in parsed_requests(
+        sources,
+        RequestValidator(expected_model),
+        ingest_workers,
+        stats,
+        max_batch_inputs,
+    ):
+        location = row_location(file_index, row_number)
+        for input_id in request[REQUEST.input_ids]:
+            if not input_ids.add(input_id, location):
+                raise ValueError(
+                    f"{paths[file_index].name}:{row_number}: "
+                    f"duplicate batch input_id {input_id!r}"
+                )
+        total_inputs += request[REQUEST.input_count]
+        if max_batch_inputs and total_inputs > max_batch_inputs:
+            raise ValueError(
+                f"batch exceeds the {max_batch_inputs:,} "
+                "embedding input limit"
+            )
+        yield paths[file_index], row_number, request
+    stats.completed_seconds = time.perf_counter()
+    stats.input_id_index_bytes = input_ids.nbytes
+
+
+def read_requests(
+    input_dir: Path,
+    expected_model: str,
+    ingest_workers: int = DEFAULTS.ingest_workers,
+    stats: IngestStats | None = None,
+    max_batch_inputs: int = DEFAULTS.max_batch_inputs,
+    reader: RecordReader | None = None,
+    columns: Mapping[str, str] | None = None,
+    shard_files: Path | None = None,
+) -> Iterable[dict[str, Any]]:
+    for _, _, request in located_requests(
+        input_dir,
+        expected_model,
+        ingest_workers=ingest_workers,
+        stats=stats,
+        max_batch_inputs=max_batch_inputs,
+        reader=reader,
+        columns=columns,
+        shard_files=shard_files,
+    ):
+        yield request
+
+
+def is_size_error(error: Exception) -> bool:
+    status_code = getattr(error, "status_code", None)
+    if status_code in DEFAULTS.bisect_status_codes:
+        return True
+    return status_code == 400 and (
+        getattr(error, "code", None) in DEFAULTS.bisect_error_codes
+        or DEFAULTS.bisect_error_message in str(error).lower()
+    )
 
 
 def dry_run_response(body: dict[str, Any], model: str) -> dict[str, Any]:
@@ -356,6 +1046,28 @@ def run(
     dry_run: bool = False,
     metric_logging: str = MetricLoggingMode.DISABLED,
     metric_prefix: str = DEFAULT_METRIC_PREFIX,
+    execution: str = DEFAULTS.execution,
+    max_in_flight_requests: int = DEFAULTS.max_in_flight_requests,
+    ingest_workers: int = DEFAULTS.ingest_workers,
+    max_batch_inputs: int = DEFAULTS.max_batch_inputs,
+    input_storage: str = DEFAULTS.input_storage,
+    input_index_dir: Path | None = None,
+    input_columns: str = "",
+    shard_count: int = DEFAULTS.shard_count,
+    token_cache_path: Path | None = None,
+    token_counting: str = DEFAULTS.token_counting,
+    token_estimate_rate: float = DEFAULTS.token_estimate_rate,
+    token_estimate_margin: float = DEFAULTS.token_estimate_margin,
+    request_sizing: str = DEFAULTS.request_sizing,
+    packing_plan_path: Path | None = None,
+    engine: str = DEFAULTS.engine,
+    pacing_burst_seconds: float = DEFAULTS.pacing_burst_seconds,
+    concurrency_control: str = DEFAULTS.concurrency_control,
+    min_request_concurrency: int = DEFAULTS.min_request_concurrency,
+    pacing: str = DEFAULTS.pacing,
+    output_order: str = DEFAULTS.output_order,
+    reorder_buffer_size: int = DEFAULTS.reorder_buffer_size,
+    shard_files: Path | None = None,
 ) -> None:
     if max_inputs_per_request < 1 or max_inputs_per_request > LIMITS.max_array_inputs:
         raise ValueError(
@@ -373,11 +1085,157 @@ def run(
         raise ValueError("target_inputs_per_minute must be non-negative")
     if max_retries < 0:
         raise ValueError("max_retries must be non-negative")
-    if request_concurrency < 1 or request_concurrency > LIMITS.max_request_concurrency:
+    if pacing_burst_seconds < 0:
+        raise ValueError("pacing_burst_seconds must be non-negative")
+    try:
+        selected_engine = DispatchEngine(engine)
+    except ValueError as error:
+        raise ValueError(
+            f"engine must be one of: {', '.join(DispatchEngine)}"
+        ) from error
+    max_request_concurrency = (
+        LIMITS.max_async_request_concurrency
+        if selected_engine == DispatchEngine.ASYNC
+        else LIMITS.max_request_concurrency
+    )
+    if request_concurrency < 1 or request_concurrency > max_request_concurrency:
         raise ValueError(
             "request_concurrency must be between 1 and "
-            f"{LIMITS.max_request_concurrency}"
+            f"{max_request_concurrency} for the {selected_engine} engine"
+        )
+    if max_in_flight_requests < 0 or max_in_flight_requests > LIMITS.max_in_flight_requests:
+        raise ValueError(
+            "max_in_flight_requests must be between 0 and "
+            f"{LIMITS.max_in_flight_requests}"
         )
+    if max_batch_inputs < 0:
+        raise ValueError("max_batch_inputs must be non-negative")
+    if ingest_workers < 0 or ingest_workers > LIMITS.max_ingest_workers:
+        raise ValueError(
+            f"ingest_workers must be between 0 and {LIMITS.max_ingest_workers}"
+        )
+    try:
+        selected_execution = ExecutionMode(execution)
+    except ValueError as error:
+        raise ValueError(
+            f"execution must be one of: {', '.join(ExecutionMode)}"
+        ) from error
+    try:
+        selected_input_storage = InputStorage(input_storage)
+    except ValueError as error:
+        raise ValueError(
+            f"input_storage must be one of: {', '.join(InputStorage)}"
+        ) from error
+    try:
+        selected_token_counting = TokenCounting(token_counting)
+    except ValueError as error:
+        raise ValueError(
+            f"token_counting must be one of: {', '.join(TokenCounting)}"
+        ) from error
+    if token_estimate_rate <= 0:
+        raise ValueError("token_estimate_rate must be positive")
+    if token_estimate_margin < 0:
+        raise ValueError("token_estimate_margin must be non-negative")
+    try:
+        selected_request_sizing = RequestSizing(request_sizing)
+    except ValueError as error:
+        raise ValueError(
+            f"request_sizing must be one of: {', '.join(RequestSizing)}"
+        ) from error
+    token_budget: AdaptiveTokenBudget | None = None
+    if selected_request_sizing == RequestSizing.ADAPTIVE:
+        if not max_tokens_per_request:
+            raise ValueError("adaptive request_sizing requires max_tokens_per_request")
+        if selected_execution != ExecutionMode.STREAMING:
+            raise ValueError("adaptive request_sizing requires streaming execution")
+        token_budget = AdaptiveTokenBudget(
+            max_tokens_per_request,
+            max(int(max_tokens_per_request * DEFAULTS.adaptive_min_token_fraction), 1),
+            LIMITS.max_request_tokens,
+        )
+    try:
+        selected_concurrency_control = ConcurrencyControl(concurrency_control)
+    except ValueError as error:
+        raise ValueError(
+            f"concurrency_control must be one of: {', '.join(ConcurrencyControl)}"
+        ) from error
+    if min_request_concurrency < 1 or min_request_concurrency > request_concurrency:
+        raise ValueError(
+            "min_request_concurrency must be between 1 and request_concurrency"
+        )
+    try:
+        selected_pacing = PacingSource(pacing)
+    except ValueError as error:
+        raise ValueError(f"pacing must be one of: {', '.join(PacingSource)}") from error
+    try:
+        selected_output_order = OutputOrder(output_order)
+    except ValueError as error:
+        raise ValueError(
+            f"output_order must be one of: {', '.join(OutputOrder)}"
+        ) from error
+    if reorder_buffer_size < 0 or reorder_buffer_size > LIMITS.max_in_flight_requests:
+        raise ValueError(
+            "reorder_buffer_size must be between 0 and "
+            f"{LIMITS.max_in_flight_requests}"
+        )
+    if reorder_buffer_size and selected_output_order != OutputOrder.SUBMISSION:
+        raise ValueError("reorder_buffer_size requires submission output_order")
+    if packing == PackingMode.REPLAYED_PLAN:
+        packing_plan_path = packing_plan_path or folder_packing_plan(input_dir)
+        if packing_plan_path is None:
+            raise ValueError(
+                f"packing {packing} needs packing_plan_path or {PLAN_FILE} in the input folder"
+            )
+    elif packing_plan_path is not None:
+        raise ValueError(f"packing_plan_path requires packing {PackingMode.REPLAYED_PLAN}")
+    if packing_plan_path is not None and token_budget is not None:
+        raise ValueError("a packing plan cannot be replayed with adaptive request_sizing")
+    if packing_plan_path is not None:
+        print(
+            f"Replaying packing plan {packing_plan_path}: planned requests must fit "
+            "--max-inputs-per-request and --max-tokens-per-request"
+        )
+    columns = parse_column_mapping(input_columns, ROW_FIELDS)
+    if shard_count < 1 or shard_count > LIMITS.max_shards:
+        raise ValueError(f"shard_count must be between 1 and {LIMITS.max_shards}")
+    if request_concurrency < shard_count:
+        raise ValueError(
+            f"request_concurrency {request_concurrency} cannot be shared by "
+            f"{shard_count} shards; use at least one request per shard"
+        )
+    if shard_count > 1:
+        target_tpm = max(target_tpm // shard_count, 1) if target_tpm else 0
+        target_inputs_per_minute /= shard_count
+        request_concurrency = max(request_concurrency // shard_count, 1)
+        min_request_concurrency = min(min_request_concurrency, request_concurrency)
+    concurrency_limit: AdaptiveConcurrency | None = None
+    if selected_concurrency_control == ConcurrencyControl.AIMD:
+        concurrency_limit = AdaptiveConcurrency(min_request_concurrency, request_concurrency)
+    header_gate = RateLimitHeaderGate() if selected_pacing == PacingSource.HEADERS else None
+    observes_responses = concurrency_limit is not None or header_gate is not None
+
+    def record_response(response: httpx.Response) -> None:
+        if concurrency_limit is not None:
+            concurrency_limit.record(response.status_code)
+        if header_gate is not None:
+            header_gate.observe(response.headers)
+    in_flight_window = max(
+        max_in_flight_requests
+        or request_concurrency * DEFAULTS.in_flight_requests_per_worker,
+        request_concurrency,
+    )
+    if reorder_buffer_size and reorder_buffer_size < request_concurrency:
+        raise ValueError(
+            f"reorder_buffer_size {reorder_buffer_size} is below request_concurrency "
+            f"{request_concurrency}; it must hold every concurrent request"
+        )
+    windowed = (
+        selected_execution == ExecutionMode.STREAMING
+        or selected_engine == DispatchEngine.ASYNC
+    )
+    max_in_flight = in_flight_window if windowed else None
+    if reorder_buffer_size:
+        max_in_flight = min(max_in_flight or reorder_buffer_size, reorder_buffer_size)
     try:
         selected_metric_logging = MetricLoggingMode(metric_logging)
     except ValueError as error:
@@ -386,30 +1244,69 @@ def run(
         ) from error
     output_dir.mkdir(parents=True, exist_ok=True)
     provider = configure_tracing(output_dir)
-    tracer = trace.get_tracer(__name__)
+    tracer = provider.get_tracer(__name__)
     client: Any = None
+    async_client_factory: Callable[[], AsyncOpenAI] | None = None
     if not dry_run:
         credential = AuthHelper.test_credential(
             scope=token_scope,
             allow_interactive=False,
         )
         token_provider = get_bearer_token_provider(credential, token_scope)
-        client = OpenAI(
-            base_url=endpoint.rstrip("/") + "/",
-            api_key=token_provider,
-            max_retries=max_retries,
-            timeout=120,
-        )
+        if selected_engine == DispatchEngine.ASYNC:
+
+            async def async_token_provider() -> str:
+                # The provider caches the token, so only a refresh blocks the loop.
+                return token_provider()
+
+            async def record_response_async(response: httpx.Response) -> None:
+                record_response(response)
+
+            def async_client_factory() -> AsyncOpenAI:
+                return AsyncOpenAI(
+                    base_url=endpoint.rstrip("/") + "/",
+                    api_key=async_token_provider,
+                    max_retries=max_retries,
+                    timeout=120,
+                    http_client=DefaultAsyncHttpxClient(
+                        limits=httpx.Limits(
+                            max_connections=request_concurrency,
+                            max_keepalive_connections=request_concurrency,
+                        ),
+                        event_hooks=(
+                            {"response": [record_response_async]}
+                            if observes_responses
+                            else None
+                        ),
+                    ),
+                )
+
+        else:
+            client = OpenAI(
+                base_url=endpoint.rstrip("/") + "/",
+                api_key=token_provider,
+                max_retries=max_retries,
+                timeout=120,
+                http_client=(
+                    DefaultHttpxClient(event_hooks={"response": [record_response]})
+                    if observes_responses
+                    else None
+                ),
+            )
 
     output_path = output_dir / FILES.embeddings
     source_line_count = 0
     online_request_count = 0
     embedding_input_count = 0
     failed_count = 0
+    unprocessable_count = 0
     first_request_error: Exception | None = None
+    first_output_seconds: float | None = None
     request_measurements: list[RequestMeasurement] = []
+    ingest_stats = IngestStats()
     measurement_lock = threading.Lock()
     started = time.perf_counter()
+    process_uptime = process_uptime_seconds()
     with tracer.start_as_current_span(TRACE.root_span) as root_span:
         root_span.set_attribute(TRACE.deployment, deployment)
         root_span.set_attribute(TRACE.model, model)
@@ -424,64 +1321,288 @@ def run(
         )
         root_span.set_attribute(TRACE.max_retries, max_retries)
         root_span.set_attribute(TRACE.request_concurrency, request_concurrency)
+        root_span.set_attribute(TRACE.max_batch_inputs, max_batch_inputs)
+        root_span.set_attribute(TRACE.execution, selected_execution)
+        root_span.set_attribute(TRACE.engine, selected_engine)
+        root_span.set_attribute(TRACE.pacing_burst_seconds, pacing_burst_seconds)
+        root_span.set_attribute(TRACE.concurrency_control, selected_concurrency_control)
+        root_span.set_attribute(TRACE.pacing, selected_pacing)
+        root_span.set_attribute(TRACE.output_order, selected_output_order)
+        if reorder_buffer_size:
+            root_span.set_attribute(TRACE.reorder_buffer_size, max_in_flight)
+        if concurrency_limit is not None:
+            root_span.set_attribute(
+                TRACE.min_request_concurrency,
+                min_request_concurrency,
+            )
+        if windowed:
+            root_span.set_attribute(TRACE.max_in_flight_requests, in_flight_window)
+        root_span.set_attribute(TRACE.ingest_workers, ingest_workers)
+        root_span.set_attribute(TRACE.input_storage, selected_input_storage)
+        root_span.set_attribute(TRACE.token_counting, selected_token_counting)
+        root_span.set_attribute(TRACE.request_sizing, selected_request_sizing)
+        root_span.set_attribute(TRACE.packing_plan_replayed, packing_plan_path is not None)
+        if packing_plan_path is not None:
+            root_span.set_attribute(TRACE.packing_plan, str(packing_plan_path))
+        root_span.set_attribute(
+            TRACE.input_manifest,
+            ((shard_files or input_dir) / MANIFEST_FILE).is_file(),
+        )
+        root_span.set_attribute(TRACE.shard_count, shard_count)
         root_span.set_attribute(TRACE.token_scope, token_scope)
         root_span.set_attribute(TRACE.metric_logging, selected_metric_logging)
         root_span.set_attribute(TRACE.metric_prefix, metric_prefix)
-        with output_path.open("w", encoding="utf-8") as output:
-            input_requests = list(read_requests(input_dir, model))
-            source_line_count = len(input_requests)
-            requests = list(
-                pack_compatible_requests(
-                    input_requests,
+        reader: RecordReader | None = None
+        if selected_input_storage == InputStorage.MAPPED:
+            reader = RecordReader(
+                input_dir,
+                input_files(input_dir, shard_files),
+                input_index_dir or default_index_dir(input_dir),
+            )
+        with reader if reader is not None else nullcontext(), output_path.open(
+            "w", encoding="utf-8"
+        ) as output, LazyOutputFile(
+            output_dir / FILES.packing_plan
+        ) as plan_output, LazyOutputFile(
+            output_dir / FILES.unprocessable_inputs
+        ) as unprocessable_output:
+
+            def counted_requests() -> Iterator[dict[str, Any]]:
+                nonlocal source_line_count
+                for request in read_requests(
+                    input_dir,
+                    model,
+                    ingest_workers=ingest_workers,
+                    stats=ingest_stats,
+                    max_batch_inputs=max_batch_inputs,
+                    reader=reader,
+                    columns=columns,
+                    shard_files=shard_files,
+                ):
+                    source_line_count += 1
+                    yield request
+
+            needs_token_counts = packing_plan_path is None and (
+                bool(max_tokens_per_request)
+                or packing == PackingMode.LENGTH_SORTED_INPUT_ARRAY
+                or header_gate is not None
+            )
+            tokenizer_started = time.perf_counter()
+            token_counter = (
+                token_counter_for_model(model, cache_path=token_cache_path)
+                if needs_token_counts
+                and selected_token_counting == TokenCounting.TOKENIZER
+                else None
+            )
+            if token_counter is not None:
+                root_span.set_attribute(
+                    TRACE.tokenizer_load_ms,
+                    round((time.perf_counter() - tokenizer_started) * 1000, 3),
+                )
+            count_tokens = token_counter
+            count_tokens_batch = token_counter.count_batch if token_counter else None
+            if needs_token_counts and selected_token_counting == TokenCounting.ESTIMATE:
+                count_tokens = token_estimator(token_estimate_rate, token_estimate_margin)
+            token_profile: TokenProfile | None = None
+            if count_tokens is not None:
+                token_profile = read_token_profile(
+                    input_dir,
+                    tokenizer_encoding_name(model),
+                    input_files(input_dir, shard_files),
+                    manifest_dir=shard_files,
+                )
+            root_span.set_attribute(TRACE.token_profile, token_profile is not None)
+            if count_tokens is not None and reader is not None:
+                count_text_tokens = count_tokens
+
+                def count_tokens(reference: RecordText) -> int:
+                    return count_text_tokens(reader.text(reference))
+
+            if count_tokens_batch is not None and reader is not None:
+                count_text_batch = count_tokens_batch
+
+                def count_tokens_batch(references: list[RecordText]) -> list[int]:
+                    return count_text_batch(
+                        [reader.text(reference) for reference in references]
+                    )
+
+            requests: Iterable[dict[str, Any]] = (
+                replay_packing_plan(
+                    counted_requests(),
+                    read_packing_plan(packing_plan_path),
+                    max_inputs_per_request=max_inputs_per_request,
+                    max_tokens_per_request=(
+                        max_tokens_per_request or LIMITS.max_request_tokens
+                    ),
+                )
+                if packing_plan_path is not None
+                else pack_compatible_requests(
+                    counted_requests(),
                     packing,
                     max_inputs_per_request,
                     max_tokens_per_request=(max_tokens_per_request or None),
-                    count_tokens=(
-                        token_counter_for_model(model)
-                        if max_tokens_per_request
-                        else None
-                    ),
+                    count_tokens=count_tokens,
+                    token_counts=token_profile.tokens if token_profile else None,
+                    stream=selected_execution == ExecutionMode.STREAMING,
+                    count_tokens_batch=count_tokens_batch,
+                    token_budget=token_budget,
+                    estimated_counts=selected_token_counting == TokenCounting.ESTIMATE,
                 )
             )
+            if selected_execution == ExecutionMode.BUFFERED:
+                requests = list(requests)
 
-            start_gate = threading.Event()
-            pacing_lock = threading.Lock()
-            next_request_at = started
+            rate_limiter = TokenBucketLimiter(
+                tokens_per_minute=target_tpm,
+                inputs_per_minute=target_inputs_per_minute,
+                burst_seconds=pacing_burst_seconds,
+            )
 
-            def execute_request(item: tuple[int, dict[str, Any]]) -> dict[str, Any]:
-                nonlocal next_request_at
-                batch_number, request = item
-                start_gate.wait()
-                if target_tpm or target_inputs_per_minute:
-                    with pacing_lock:
-                        now = time.perf_counter()
-                        if next_request_at > now:
-                            time.sleep(next_request_at - now)
-                            now = time.perf_counter()
-                        intervals = []
-                        if target_tpm:
-                            intervals.append(
-                                pacing_interval_seconds(
-                                    request.get(REQUEST.estimated_tokens, 0),
-                                    target_tpm,
-                                )
-                            )
-                        if target_inputs_per_minute:
-                            intervals.append(
-                                input_pacing_interval_seconds(
-                                    request[REQUEST.input_count],
-                                    target_inputs_per_minute,
-                                )
-                            )
-                        next_request_at = max(next_request_at, now) + max(intervals)
+            def request_body(request: dict[str, Any]) -> dict[str, Any]:
+                body = request[REQUEST.body]
+                if reader is None:
+                    return body
+                return {**body, REQUEST.input: reader.materialize(body[REQUEST.input])}
+
+            def record_headers(raw_response: Any, span: trace.Span) -> dict[str, Any]:
+                for header_name in RATE_LIMIT.values:
+                    header_value = raw_response.headers.get(header_name)
+                    if header_value is not None:
+                        span.set_attribute(f"http.{header_name}", header_value)
+                return raw_response.parse().model_dump(mode="json")
+
+            def deployment_body(body: dict[str, Any]) -> dict[str, Any]:
+                return {key: value for key, value in body.items() if key != REQUEST.model}
+
+            def dry_run_embeddings(body: dict[str, Any]) -> dict[str, Any]:
+                if concurrency_limit is None:
+                    return dry_run_response(body, model)
+                try:
+                    response_body = dry_run_response(body, model)
+                except Exception as error:
+                    concurrency_limit.record(getattr(error, "status_code", None))
+                    raise
+                concurrency_limit.record(200)
+                return response_body
+
+            def create_embeddings(body: dict[str, Any], span: trace.Span) -> dict[str, Any]:
+                if dry_run:
+                    return dry_run_embeddings(body)
+                raw_response = client.embeddings.with_raw_response.create(
+                    model=deployment, **deployment_body(body)
+                )
+                return record_headers(raw_response, span)
+
+            async def create_embeddings_async(
+                async_client: Any,
+                body: dict[str, Any],
+                span: trace.Span,
+            ) -> dict[str, Any]:
+                if dry_run:
+                    return dry_run_embeddings(body)
+                raw_response = await async_client.embeddings.with_raw_response.create(
+                    model=deployment, **deployment_body(body)
+                )
+                return record_headers(raw_response, span)
+
+            def bisect_failure(
+                body: dict[str, Any],
+                error: Exception,
+                bisecting: bool,
+            ) -> list[tuple[int, dict[str, Any]]] | None:
+                """Return the halves to retry after a size error, or None for a lone input."""
+                inputs = body[REQUEST.input]
+                if not is_size_error(error):
+                    raise error
+                if isinstance(inputs, str) or len(inputs) < 2:
+                    if not bisecting:
+                        raise error
+                    return None
+                middle = len(inputs) // 2
+                return [
+                    (0, {**body, REQUEST.input: inputs[:middle]}),
+                    (middle, {**body, REQUEST.input: inputs[middle:]}),
+                ]
+
+            def merge_halves(
+                halves: list[
+                    tuple[int, tuple[dict[str, Any], list[tuple[int, Exception]], int]]
+                ],
+            ) -> tuple[dict[str, Any], list[tuple[int, Exception]], int]:
+                merged: dict[str, Any] = {RESPONSE.data: [], RESPONSE.usage: {}}
+                unprocessable: list[tuple[int, Exception]] = []
+                call_count = 1
+                prompt_tokens = 0
+                for start, (half_body, half_unprocessable, half_calls) in halves:
+                    call_count += half_calls
+                    merged[RESPONSE.data].extend(
+                        {**item, RESPONSE.index: item[RESPONSE.index] + start}
+                        for item in half_body[RESPONSE.data]
+                    )
+                    unprocessable.extend(
+                        (start + index, error) for index, error in half_unprocessable
+                    )
+                    prompt_tokens += int(
+                        half_body[RESPONSE.usage].get(RESPONSE.prompt_tokens, 0)
+                    )
+                    for field_name in (RESPONSE.object, RESPONSE.model):
+                        if field_name in half_body:
+                            merged.setdefault(field_name, half_body[field_name])
+                merged[RESPONSE.usage] = {
+                    RESPONSE.prompt_tokens: prompt_tokens,
+                    RESPONSE.total_tokens: prompt_tokens,
+                }
+                return merged, unprocessable, call_count
+
+            def pace(tokens: int, inputs: int) -> None:
+                rate_limiter.wait(tokens, inputs)
+                if header_gate is not None:
+                    header_gate.wait(tokens)
+
+            async def pace_async(tokens: int, inputs: int) -> None:
+                await rate_limiter.wait_async(tokens, inputs)
+                if header_gate is not None:
+                    await header_gate.wait_async(tokens)
+
+            def half_estimate(body: dict[str, Any], half: dict[str, Any], tokens: int) -> int:
+                return math.ceil(
+                    tokens * len(half[REQUEST.input]) / len(body[REQUEST.input])
+                )
+
+            def bisected_response(
+                body: dict[str, Any],
+                span: trace.Span,
+                estimated_tokens: int,
+                bisecting: bool = False,
+            ) -> tuple[dict[str, Any], list[tuple[int, Exception]], int]:
+                """Send a request, halving it on size errors; return body, failed inputs, calls."""
+                try:
+                    return create_embeddings(body, span), [], 1
+                except Exception as error:
+                    halves = bisect_failure(body, error, bisecting)
+                    if halves is None:
+                        return {RESPONSE.data: [], RESPONSE.usage: {}}, [(0, error)], 1
+                results = []
+                for start, half in halves:
+                    half_tokens = half_estimate(body, half, estimated_tokens)
+                    pace(half_tokens, len(half[REQUEST.input]))
+                    results.append(
+                        (start, bisected_response(half, span, half_tokens, bisecting=True))
+                    )
+                return merge_halves(results)
+
+            @contextmanager
+            def request_attempt(
+                batch_number: int,
+                request: dict[str, Any],
+            ) -> Iterator[RequestAttempt]:
+                """Open the request span and record its measurement on exit."""
                 with trace.use_span(root_span, end_on_exit=False):
                     with tracer.start_as_current_span(TRACE.request_span) as span:
-                        request_started = time.perf_counter()
-                        request_status_code: int | None = None
-                        request_prompt_tokens = 0
+                        attempt = RequestAttempt(span, time.perf_counter())
                         span.set_attribute(
                             TRACE.request_start_offset_ms,
-                            round((request_started - started) * 1000, 3),
+                            round((attempt.started_seconds - started) * 1000, 3),
                         )
                         span.set_attribute(TRACE.batch_number, batch_number)
                         span.set_attribute(
@@ -492,145 +1613,420 @@ def run(
                             TRACE.batch_estimated_tokens,
                             request.get(REQUEST.estimated_tokens, 0),
                         )
-                        body = request[REQUEST.body]
-                        try:
-                            if dry_run:
-                                response_body = dry_run_response(body, model)
-                            else:
-                                request_body = {
-                                    key: value
-                                    for key, value in body.items()
-                                    if key != REQUEST.model
-                                }
-                                raw_response = client.embeddings.with_raw_response.create(
-                                    model=deployment, **request_body
-                                )
-                                response = raw_response.parse()
-                                for header_name in RATE_LIMIT.values:
-                                    header_value = raw_response.headers.get(header_name)
-                                    if header_value is not None:
-                                        span.set_attribute(f"http.{header_name}", header_value)
-                                response_body = response.model_dump(mode="json")
+                        if token_budget is not None:
+                            span.set_attribute(TRACE.batch_token_budget, token_budget())
+                        if concurrency_limit is not None:
                             span.set_attribute(
-                                TRACE.batch_prompt_tokens,
-                                int(
-                                    response_body.get(RESPONSE.usage, {}).get(
-                                        RESPONSE.prompt_tokens,
-                                        0,
-                                    )
-                                ),
-                            )
-                            request_prompt_tokens = int(
-                                response_body.get(RESPONSE.usage, {}).get(
-                                    RESPONSE.prompt_tokens,
-                                    0,
-                                )
+                                TRACE.batch_concurrency_limit,
+                                concurrency_limit(),
                             )
-                            request_status_code = 200
-                            span.set_attribute(TRACE.http_status_code, 200)
-                            response_items = sorted(
-                                response_body[RESPONSE.data],
-                                key=lambda response_item: response_item[RESPONSE.index],
-                            )
-                            if [
-                                response_item[RESPONSE.index]
-                                for response_item in response_items
-                            ] != list(
-                                range(request[REQUEST.input_count])
-                            ):
-                                raise ValueError("embedding response indexes are incomplete")
-                            span.set_status(Status(StatusCode.OK))
-                            return {
-                                RESPONSE.object: response_body[RESPONSE.object],
-                                RESPONSE.data: [
-                                    {
-                                        **response_item,
-                                        REQUEST.input_id: request[REQUEST.input_ids][
-                                            response_item[RESPONSE.index]
-                                        ],
-                                    }
-                                    for response_item in response_items
-                                ],
-                                RESPONSE.model: response_body[RESPONSE.model],
-                                RESPONSE.usage: response_body[RESPONSE.usage],
-                            }
-                        except Exception as error:
-                            response = getattr(error, "response", None)
-                            status_code = getattr(error, "status_code", None)
-                            if status_code is not None:
-                                span.set_attribute(TRACE.http_status_code, status_code)
-                                request_status_code = int(status_code)
-                            if response is not None:
-                                retry_after_ms = response.headers.get(
-                                    RATE_LIMIT.retry_after_ms
-                                )
-                                retry_after = response.headers.get(RATE_LIMIT.retry_after)
-                                if retry_after_ms is not None:
-                                    span.set_attribute(
-                                        TRACE.http_retry_after_ms,
-                                        retry_after_ms,
-                                    )
-                                elif retry_after is not None:
-                                    span.set_attribute(TRACE.http_retry_after, retry_after)
-                            span.record_exception(error)
-                            span.set_status(Status(StatusCode.ERROR, str(error)))
-                            return {
-                                REQUEST.input_ids: request[REQUEST.input_ids],
-                                RESPONSE.error: {
-                                    RESPONSE.code: type(error).__name__,
-                                    RESPONSE.message: str(error),
-                                },
-                                "_exception": error,
-                            }
+                        try:
+                            yield attempt
                         finally:
                             request_completed = time.perf_counter()
                             span.set_attribute(
                                 TRACE.request_duration_ms,
-                                round((request_completed - request_started) * 1000, 3),
+                                round(
+                                    (request_completed - attempt.started_seconds) * 1000,
+                                    3,
+                                ),
                             )
                             with measurement_lock:
                                 request_measurements.append(
                                     RequestMeasurement(
-                                        started_seconds=request_started,
+                                        started_seconds=attempt.started_seconds,
                                         completed_seconds=request_completed,
                                         input_count=request[REQUEST.input_count],
                                         estimated_tokens=request.get(
                                             REQUEST.estimated_tokens,
                                             0,
                                         ),
-                                        prompt_tokens=request_prompt_tokens,
-                                        status_code=request_status_code,
+                                        prompt_tokens=attempt.prompt_tokens,
+                                        status_code=attempt.status_code,
                                     )
                                 )
+                            if token_budget is not None:
+                                token_budget.observe(
+                                    attempt.started_seconds,
+                                    request_completed,
+                                    attempt.prompt_tokens,
+                                    attempt.status_code,
+                                )
 
-            with ThreadPoolExecutor(max_workers=request_concurrency) as executor:
-                futures = [
-                    executor.submit(execute_request, item)
-                    for item in enumerate(requests)
+            def completed_result(
+                request: dict[str, Any],
+                attempt: RequestAttempt,
+                response_body: dict[str, Any],
+                unprocessable: list[tuple[int, Exception]],
+                call_count: int,
+            ) -> dict[str, Any]:
+                span = attempt.span
+                if call_count > 1:
+                    span.set_attribute(TRACE.batch_bisect_calls, call_count)
+                    span.set_attribute(
+                        TRACE.batch_unprocessable_input_count,
+                        len(unprocessable),
+                    )
+                attempt.prompt_tokens = int(
+                    response_body.get(RESPONSE.usage, {}).get(
+                        RESPONSE.prompt_tokens,
+                        0,
+                    )
+                )
+                span.set_attribute(TRACE.batch_prompt_tokens, attempt.prompt_tokens)
+                input_ids = request[REQUEST.input_ids]
+                unprocessable_inputs = [
+                    (input_ids[index], error) for index, error in unprocessable
                 ]
-                start_gate.set()
-                results = (future.result() for future in futures)
-                for request, result in zip(requests, results, strict=True):
-                    request_error = result.pop("_exception", None)
-                    if RESPONSE.error in result:
-                        failed_count += 1
-                        if first_request_error is None:
-                            first_request_error = request_error
+                if not response_body[RESPONSE.data]:
+                    attempt.status_code = int(
+                        getattr(unprocessable[0][1], "status_code", 400)
+                    )
+                    span.set_attribute(TRACE.http_status_code, attempt.status_code)
+                    span.set_status(Status(StatusCode.ERROR, "every input is unprocessable"))
+                    return {"_unprocessable": unprocessable_inputs}
+                attempt.status_code = 200
+                span.set_attribute(TRACE.http_status_code, 200)
+                response_items = sorted(
+                    response_body[RESPONSE.data],
+                    key=lambda response_item: response_item[RESPONSE.index],
+                )
+                if sorted(
+                    [
+                        *(response_item[RESPONSE.index] for response_item in response_items),
+                        *(index for index, _ in unprocessable),
+                    ]
+                ) != list(range(request[REQUEST.input_count])):
+                    raise ValueError("embedding response indexes are incomplete")
+                span.set_status(Status(StatusCode.OK))
+                return {
+                    "_unprocessable": unprocessable_inputs,
+                    RESPONSE.object: response_body[RESPONSE.object],
+                    RESPONSE.data: [
+                        {
+                            **response_item,
+                            REQUEST.input_id: input_ids[response_item[RESPONSE.index]],
+                        }
+                        for response_item in response_items
+                    ],
+                    RESPONSE.model: response_body[RESPONSE.model],
+                    RESPONSE.usage: response_body[RESPONSE.usage],
+                }
+
+            def failed_result(
+                request: dict[str, Any],
+                attempt: RequestAttempt,
+                error: Exception,
+            ) -> dict[str, Any]:
+                span = attempt.span
+                response = getattr(error, "response", None)
+                status_code = getattr(error, "status_code", None)
+                if status_code is not None:
+                    span.set_attribute(TRACE.http_status_code, status_code)
+                    attempt.status_code = int(status_code)
+                if response is not None:
+                    retry_after_ms = response.headers.get(RATE_LIMIT.retry_after_ms)
+                    retry_after = response.headers.get(RATE_LIMIT.retry_after)
+                    if retry_after_ms is not None:
+                        span.set_attribute(TRACE.http_retry_after_ms, retry_after_ms)
+                    elif retry_after is not None:
+                        span.set_attribute(TRACE.http_retry_after, retry_after)
+                span.record_exception(error)
+                span.set_status(Status(StatusCode.ERROR, str(error)))
+                return {
+                    REQUEST.input_ids: request[REQUEST.input_ids],
+                    RESPONSE.error: {
+                        RESPONSE.code: type(error).__name__,
+                        RESPONSE.message: str(error),
+                    },
+                    "_exception": error,
+                }
+
+            def execute_request(item: tuple[int, dict[str, Any]]) -> dict[str, Any]:
+                batch_number, request = item
+                if concurrency_limit is not None:
+                    concurrency_limit.acquire()
+                try:
+                    pace(request.get(REQUEST.estimated_tokens, 0), request[REQUEST.input_count])
+                    with request_attempt(batch_number, request) as attempt:
+                        try:
+                            return completed_result(
+                                request,
+                                attempt,
+                                *bisected_response(
+                                    request_body(request),
+                                    attempt.span,
+                                    request.get(REQUEST.estimated_tokens, 0),
+                                ),
+                            )
+                        except Exception as error:
+                            return failed_result(request, attempt, error)
+                finally:
+                    if concurrency_limit is not None:
+                        concurrency_limit.release()
+
+            def write_result(request: dict[str, Any], result: dict[str, Any]) -> None:
+                nonlocal failed_count
+                nonlocal first_request_error
+                nonlocal unprocessable_count
+                nonlocal online_request_count
+                nonlocal embedding_input_count
+                nonlocal first_output_seconds
+                if first_output_seconds is None:
+                    first_output_seconds = time.perf_counter()
+                request_error = result.pop("_exception", None)
+                unprocessable_inputs = result.pop("_unprocessable", [])
+                if RESPONSE.error in result:
+                    failed_count += 1
+                    if first_request_error is None:
+                        first_request_error = request_error
+                if unprocessable_inputs:
+                    failed_count += len(unprocessable_inputs)
+                    if first_request_error is None:
+                        first_request_error = unprocessable_inputs[0][1]
+                if result:
                     output.write(json.dumps(result, separators=(",", ":")) + "\n")
-                    online_request_count += 1
-                    embedding_input_count += request[REQUEST.input_count]
+                for input_id, input_error in unprocessable_inputs:
+                    error_record = {
+                        REQUEST.input_ids: [input_id],
+                        RESPONSE.error: {
+                            RESPONSE.code: type(input_error).__name__,
+                            RESPONSE.message: str(input_error),
+                        },
+                    }
+                    output.write(json.dumps(error_record, separators=(",", ":")) + "\n")
+                    unprocessable_output.write(
+                        json.dumps(
+                            {
+                                REQUEST.input_id: input_id,
+                                RESPONSE.error: error_record[RESPONSE.error],
+                            },
+                            separators=(",", ":"),
+                        )
+                        + "\n"
+                    )
+                    unprocessable_count += 1
+                write_plan_entry(
+                    plan_output,
+                    request[REQUEST.input_ids],
+                    request.get(REQUEST.estimated_tokens, 0),
+                )
+                online_request_count += 1
+                embedding_input_count += request[REQUEST.input_count]
+
+            if selected_engine == DispatchEngine.ASYNC:
+
+                async def dispatch_async() -> None:
+                    async_client = async_client_factory() if not dry_run else None
+                    request_slots = asyncio.Semaphore(request_concurrency)
+
+                    async def try_acquire_slot() -> bool:
+                        if concurrency_limit is not None:
+                            return concurrency_limit.try_acquire()
+                        if request_slots.locked():
+                            return False
+                        await request_slots.acquire()
+                        return True
+
+                    def release_slot() -> None:
+                        if concurrency_limit is not None:
+                            concurrency_limit.release()
+                        else:
+                            request_slots.release()
+
+                    async def bisected_response_async(
+                        body: dict[str, Any],
+                        span: trace.Span,
+                        estimated_tokens: int,
+                        bisecting: bool = False,
+                    ) -> tuple[dict[str, Any], list[tuple[int, Exception]], int]:
+                        try:
+                            return await create_embeddings_async(async_client, body, span), [], 1
+                        except Exception as error:
+                            halves = bisect_failure(body, error, bisecting)
+                            if halves is None:
+                                return {RESPONSE.data: [], RESPONSE.usage: {}}, [(0, error)], 1
+
+                        async def send_half(
+                            half: dict[str, Any],
+                            holds_slot: bool = False,
+                        ) -> tuple[dict[str, Any], list[tuple[int, Exception]], int]:
+                            try:
+                                half_tokens = half_estimate(body, half, estimated_tokens)
+                                await pace_async(half_tokens, len(half[REQUEST.input]))
+                                return await bisected_response_async(
+                                    half,
+                                    span,
+                                    half_tokens,
+                                    bisecting=True,
+                                )
+                            finally:
+                                if holds_slot:
+                                    release_slot()
+
+                        (first_start, first), (second_start, second) = halves
+                        if await try_acquire_slot():
+                            results = await asyncio.gather(
+                                send_half(first),
+                                send_half(second, holds_slot=True),
+                                return_exceptions=True,
+                            )
+                            for result in results:
+                                if isinstance(result, BaseException):
+                                    raise result
+                        else:
+                            results = [await send_half(first), await send_half(second)]
+                        return merge_halves(list(zip((first_start, second_start), results)))
+
+                    async def execute_request_async(
+                        item: tuple[int, dict[str, Any]],
+                    ) -> dict[str, Any]:
+                        batch_number, request = item
+                        if concurrency_limit is not None:
+                            await concurrency_limit.acquire_async()
+                        else:
+                            await request_slots.acquire()
+                        try:
+                            await pace_async(
+                                request.get(REQUEST.estimated_tokens, 0),
+                                request[REQUEST.input_count],
+                            )
+                            with request_attempt(batch_number, request) as attempt:
+                                try:
+                                    return completed_result(
+                                        request,
+                                        attempt,
+                                        *await bisected_response_async(
+                                            request_body(request),
+                                            attempt.span,
+                                            request.get(REQUEST.estimated_tokens, 0),
+                                        ),
+                                    )
+                                except Exception as error:
+                                    return failed_result(request, attempt, error)
+                        finally:
+                            release_slot()
+
+                    try:
+                        async for (_, request), result in (
+                            completed_async_results
+                            if selected_output_order == OutputOrder.COMPLETION
+                            else ordered_async_results
+                        )(
+                            execute_request_async,
+                            enumerate(requests),
+                            max_in_flight=max_in_flight,
+                        ):
+                            write_result(request, result)
+                    finally:
+                        if async_client is not None:
+                            await async_client.close()
+
+                asyncio.run(dispatch_async())
+            else:
+                with ThreadPoolExecutor(max_workers=request_concurrency) as executor:
+                    for (_, request), result in (
+                        completed_results
+                        if selected_output_order == OutputOrder.COMPLETION
+                        else ordered_results
+                    )(
+                        executor,
+                        execute_request,
+                        enumerate(requests),
+                        max_in_flight=max_in_flight,
+                    ):
+                        write_result(request, result)
 
         root_span.set_attribute(TRACE.source_line_count, source_line_count)
+        root_span.set_attribute(TRACE.ingest_file_count, ingest_stats.file_count)
+        root_span.set_attribute(TRACE.ingest_bytes, ingest_stats.byte_count)
+        if ingest_stats.started_seconds is not None and ingest_stats.completed_seconds:
+            ingest_seconds = ingest_stats.completed_seconds - ingest_stats.started_seconds
+            root_span.set_attribute(
+                TRACE.ingest_duration_ms,
+                round(ingest_seconds * 1000, 3),
+            )
+            if ingest_seconds > 0:
+                root_span.set_attribute(
+                    TRACE.ingest_rows_per_second,
+                    round(ingest_stats.row_count / ingest_seconds, 3),
+                )
+        root_span.set_attribute(
+            TRACE.input_id_index_bytes,
+            ingest_stats.input_id_index_bytes,
+        )
+        if ingest_stats.worker_parse_seconds:
+            root_span.set_attribute(
+                TRACE.ingest_worker_parse_ms,
+                round(ingest_stats.worker_parse_seconds * 1000, 3),
+            )
         root_span.set_attribute(TRACE.online_request_count, online_request_count)
         root_span.set_attribute(TRACE.embedding_input_count, embedding_input_count)
         root_span.set_attribute(TRACE.failed_count, failed_count)
+        root_span.set_attribute(TRACE.unprocessable_input_count, unprocessable_count)
+        if first_output_seconds is not None:
+            root_span.set_attribute(
+                TRACE.first_output_offset_ms,
+                round((first_output_seconds - started) * 1000, 3),
+            )
+        if token_budget is not None:
+            root_span.set_attribute(
+                TRACE.token_budgets,
+                [budget for _, budget in token_budget.history],
+            )
+            root_span.set_attribute(
+                TRACE.token_budget_offsets_ms,
+                [
+                    round((completed - started) * 1000, 3) if completed is not None else 0.0
+                    for completed, _ in token_budget.history
+                ],
+            )
+        if concurrency_limit is not None:
+            root_span.set_attribute(
+                TRACE.concurrency_limits,
+                [limit for _, limit in concurrency_limit.history],
+            )
+            root_span.set_attribute(
+                TRACE.concurrency_limit_offsets_ms,
+                [
+                    round(max(changed - started, 0.0) * 1000, 3)
+                    for changed, _ in concurrency_limit.history
+                ],
+            )
+        if header_gate is not None:
+            root_span.set_attribute(
+                TRACE.rate_limit_gated_requests,
+                header_gate.gated_requests,
+            )
+            root_span.set_attribute(
+                TRACE.rate_limit_gated_ms,
+                round(header_gate.gated_seconds * 1000, 3),
+            )
         run_metrics = calculate_run_metrics(
             request_measurements,
             max_inputs_per_request=max_inputs_per_request,
             max_tokens_per_request=max_tokens_per_request,
             target_tpm=target_tpm,
             target_inputs_per_minute=target_inputs_per_minute,
+            token_cache_hits=token_counter.hits if token_counter else 0,
+            token_cache_misses=token_counter.misses if token_counter else 0,
         )
+        if token_counter is not None:
+            token_counter.save()
+        if selected_token_counting == TokenCounting.ESTIMATE:
+            run_metrics[METRICS.token_estimate_rate] = token_estimate_rate
+            run_metrics[METRICS.token_estimate_margin] = token_estimate_margin
+        if header_gate is not None:
+            run_metrics[METRICS.rate_limit_gated_requests] = float(header_gate.gated_requests)
+            run_metrics[METRICS.rate_limit_gated_seconds] = round(header_gate.gated_seconds, 3)
+        if process_uptime is not None and request_measurements:
+            first_request_started = min(
+                measurement.started_seconds for measurement in request_measurements
+            )
+            run_metrics[METRICS.process_start_to_first_request_ms] = round(
+                (first_request_started - started + process_uptime) * 1000,
+                3,
+            )
         for name, value in run_metrics.items():
             root_span.set_attribute(f"metric.{name}", value)
         try:
@@ -644,6 +2040,16 @@ def run(
                     f"Published {len(published_metrics)} MLflow metrics with "
                     f"prefix {metric_prefix!r}"
                 )
+            if concurrency_limit is not None:
+                publish_metric_series(
+                    METRICS.concurrency_limit,
+                    [
+                        (round(max(changed - started, 0.0) * 1000), float(limit))
+                        for changed, limit in concurrency_limit.history
+                    ],
+                    selected_metric_logging,
+                    metric_prefix,
+                )
         except Exception as error:
             message = f"MLflow metric publishing failed: {error}"
             root_span.set_attribute(TRACE.metric_logging_error, message)
@@ -663,6 +2069,11 @@ def run(
         f"Wrote {online_request_count} response records to {output_path} "
         f"({failed_count} failed)"
     )
+    if unprocessable_count:
+        print(
+            f"Isolated {unprocessable_count} unprocessable inputs in "
+            f"{output_dir / FILES.unprocessable_inputs}"
+        )
     print(f"Wrote trace spans to {output_dir / FILES.trace}")
     if first_request_error is not None:
         raise first_request_error
@@ -712,6 +2123,178 @@ def main() -> None:
         type=int,
         default=DEFAULTS.request_concurrency,
     )
+    parser.add_argument(
+        "--max-batch-inputs",
+        type=int,
+        default=DEFAULTS.max_batch_inputs,
+        help="Reject batches with more embedding inputs; zero removes the limit",
+    )
+    parser.add_argument(
+        "--execution",
+        choices=tuple(ExecutionMode),
+        default=DEFAULTS.execution,
+        help=(
+            "buffered reads and packs the whole batch before dispatch; streaming "
+            "chains reading, packing, dispatch, and writing with a bounded window"
+        ),
+    )
+    parser.add_argument(
+        "--max-in-flight-requests",
+        type=int,
+        default=DEFAULTS.max_in_flight_requests,
+        help=(
+            "Streaming or async window of submitted but unwritten requests; zero uses "
+            f"{DEFAULTS.in_flight_requests_per_worker} per worker"
+        ),
+    )
+    parser.add_argument(
+        "--ingest-workers",
+        type=int,
+        default=DEFAULTS.ingest_workers,
+        help="Parse input files in this many worker processes; zero or one parses in-process",
+    )
+    parser.add_argument(
+        "--input-storage",
+        choices=tuple(InputStorage),
+        default=DEFAULTS.input_storage,
+        help=(
+            "memory keeps decoded texts until dispatch; mmap keeps line offsets "
+            "and reads texts from memory-mapped input files when requests are sent"
+        ),
+    )
+    parser.add_argument(
+        "--input-index-dir",
+        type=Path,
+        help=(
+            "Line offset sidecar folder for mmap storage; defaults to a cache under "
+            "the system temp folder keyed by INPUT_DIR"
+        ),
+    )
+    parser.add_argument(
+        "--input-columns",
+        default="",
+        help=(
+            "Comma-separated field=column pairs that map Parquet or Arrow IPC "
+            "columns onto request fields, for example input_id=chunk_id,input=text"
+        ),
+    )
+    parser.add_argument(
+        "--shard-count",
+        type=int,
+        default=DEFAULTS.shard_count,
+        help=(
+            "Number of parallel embed steps sharing the TPM, input-rate, and "
+            "concurrency budgets; this step uses an equal share"
+        ),
+    )
+    parser.add_argument(
+        "--token-cache",
+        type=Path,
+        help="File that keeps token counts across runs for token-targeted packing",
+    )
+    parser.add_argument(
+        "--token-counting",
+        choices=tuple(TokenCounting),
+        default=DEFAULTS.token_counting,
+        help=(
+            "tokenizer counts tokens with tiktoken; estimate predicts them from "
+            "UTF-8 length at --token-estimate-rate plus --token-estimate-margin"
+        ),
+    )
+    parser.add_argument(
+        "--token-estimate-rate",
+        type=float,
+        default=DEFAULTS.token_estimate_rate,
+        help="Estimated tokens per UTF-8 byte, calibrated from earlier runs",
+    )
+    parser.add_argument(
+        "--token-estimate-margin",
+        type=float,
+        default=DEFAULTS.token_estimate_margin,
+        help="Fraction added to every token estimate as a safety margin",
+    )
+    parser.add_argument(
+        "--request-sizing",
+        choices=tuple(RequestSizing),
+        default=DEFAULTS.request_sizing,
+        help=(
+            "adaptive moves the request token budget from --max-tokens-per-request "
+            "by observed throughput, latency, and 429s; requires streaming execution"
+        ),
+    )
+    parser.add_argument(
+        "--packing-plan",
+        type=Path,
+        help=(
+            "packing_plan.jsonl to replay with --packing plan; defaults to "
+            f"{PLAN_FILE} in the input folder"
+        ),
+    )
+    parser.add_argument(
+        "--engine",
+        choices=tuple(DispatchEngine),
+        default=DEFAULTS.engine,
+        help=(
+            "thread dispatches from a thread pool of up to "
+            f"{LIMITS.max_request_concurrency} workers; async runs up to "
+            f"{LIMITS.max_async_request_concurrency} concurrent requests as "
+            "AsyncOpenAI tasks on one event loop"
+        ),
+    )
+    parser.add_argument(
+        "--pacing-burst-seconds",
+        type=float,
+        default=DEFAULTS.pacing_burst_seconds,
+        help=(
+            "Seconds of --target-tpm and --target-inputs-per-minute that idle "
+            "time may bank for a burst; zero spaces every request by its cost"
+        ),
+    )
+    parser.add_argument(
+        "--concurrency-control",
+        choices=tuple(ConcurrencyControl),
+        default=DEFAULTS.concurrency_control,
+        help=(
+            "aimd starts at --min-request-concurrency, adds requests while "
+            "responses succeed, and halves in-flight requests on 429 or 503, up "
+            "to --request-concurrency"
+        ),
+    )
+    parser.add_argument(
+        "--min-request-concurrency",
+        type=int,
+        default=DEFAULTS.min_request_concurrency,
+    )
+    parser.add_argument(
+        "--pacing",
+        choices=tuple(PacingSource),
+        default=DEFAULTS.pacing,
+        help=(
+            "headers also holds each request until the x-ratelimit-remaining "
+            "tokens and requests reported by the last response cover it, or "
+            "until the reported reset"
+        ),
+    )
+    parser.add_argument(
+        "--output-order",
+        choices=tuple(OutputOrder),
+        default=DEFAULTS.output_order,
+        help="completion writes each response as soon as it arrives",
+    )
+    parser.add_argument(
+        "--reorder-buffer-size",
+        type=int,
+        default=DEFAULTS.reorder_buffer_size,
+        help=(
+            "with submission order, the most requests sent but not yet written, "
+            "at least --request-concurrency; 0 keeps the execution mode's window"
+        ),
+    )
+    parser.add_argument(
+        "--shard-files",
+        type=Path,
+        help="Folder with the split step's manifest of this shard's files under INPUT_DIR",
+    )
     parser.add_argument(
         "--token-scope",
         default=DEFAULTS.token_scope,
@@ -741,6 +2324,28 @@ def main() -> None:
         args.dry_run,
         args.metric_logging,
         args.metric_prefix,
+        args.execution,
+        args.max_in_flight_requests,
+        args.ingest_workers,
+        args.max_batch_inputs,
+        args.input_storage,
+        args.input_index_dir,
+        args.input_columns,
+        args.shard_count,
+        args.token_cache,
+        args.token_counting,
+        args.token_estimate_rate,
+        args.token_estimate_margin,
+        args.request_sizing,
+        args.packing_plan,
+        args.engine,
+        args.pacing_burst_seconds,
+        args.concurrency_control,
+        args.min_request_concurrency,
+        args.pacing,
+        args.output_order,
+        args.reorder_buffer_size,
+        args.shard_files,
     )
 
 
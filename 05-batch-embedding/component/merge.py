@@ -0,0 +1,235 @@
+import argparse
+import json
+import shutil
+import sys
+from pathlib import Path
+from typing import Any
+
+from opentelemetry.trace import Status, StatusCode
+
+from component.embed import FILES, TRACE, configure_tracing
+from utils.aml_metrics import (
+    DEFAULT_METRIC_PREFIX,
+    METRICS,
+    MetricLoggingMode,
+    RequestMeasurement,
+    calculate_run_metrics,
+    publish_run_metrics,
+)
+
+
+SUMMED_ATTRIBUTES = (
+    TRACE.source_line_count,
+    TRACE.online_request_count,
+    TRACE.embedding_input_count,
+    TRACE.failed_count,
+    TRACE.unprocessable_input_count,
+    TRACE.rate_limit_gated_requests,
+    TRACE.rate_limit_gated_ms,
+    TRACE.ingest_file_count,
+    TRACE.ingest_bytes,
+)
+PER_SHARD_ATTRIBUTES = (
+    TRACE.ingest_duration_ms,
+    TRACE.ingest_worker_parse_ms,
+    TRACE.ingest_rows_per_second,
+    TRACE.input_id_index_bytes,
+    TRACE.tokenizer_load_ms,
+    TRACE.token_budgets,
+    TRACE.token_budget_offsets_ms,
+    TRACE.concurrency_limits,
+    TRACE.concurrency_limit_offsets_ms,
+    TRACE.first_output_offset_ms,
+)
+
+
+def read_spans(path: Path) -> list[dict[str, Any]]:
+    if not path.exists():
+        return []
+    with path.open(encoding="utf-8") as stream:
+        return [json.loads(line) for line in stream if line.strip()]
+
+
+def request_measurement(span: dict[str, Any]) -> RequestMeasurement:
+    """Rebuild a request measurement from an exported request span."""
+    attributes = span["attributes"]
+    status_code = attributes.get(TRACE.http_status_code)
+    return RequestMeasurement(
+        started_seconds=span["start_time_unix_nano"] / 1e9,
+        completed_seconds=span["end_time_unix_nano"] / 1e9,
+        input_count=int(attributes.get(TRACE.batch_input_count, 0)),
+        estimated_tokens=int(attributes.get(TRACE.batch_estimated_tokens, 0)),
+        prompt_tokens=int(attributes.get(TRACE.batch_prompt_tokens, 0)),
+        status_code=int(status_code) if status_code is not None else None,
+    )
+
+
+def merge(
+    shard_dirs: list[Path],
+    output_dir: Path,
+    shard_count: int,
+    max_inputs_per_request: int = 0,
+    max_tokens_per_request: int = 0,
+    target_tpm: int = 0,
+    target_inputs_per_minute: float = 0,
+    metric_logging: str = MetricLoggingMode.DISABLED,
+    metric_prefix: str = DEFAULT_METRIC_PREFIX,
+) -> dict[str, float]:
+    """Combine shard outputs into one output folder and one metric set."""
+    used_dirs = shard_dirs[:shard_count]
+    shard_spans = [read_spans(shard_dir / FILES.trace) for shard_dir in used_dirs]
+    root_spans = [
+        span for spans in shard_spans for span in spans if span["name"] == TRACE.root_span
+    ]
+    request_spans = [
+        span
+        for spans in shard_spans
+        for span in spans
+        if span["name"] == TRACE.request_span
+    ]
+    if not root_spans:
+        raise ValueError("no shard produced a batch trace span")
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output_path = output_dir / FILES.embeddings
+    with output_path.open("wb") as output:
+        for shard_dir in used_dirs:
+            shard_output = shard_dir / FILES.embeddings
+            if shard_output.exists():
+                with shard_output.open("rb") as source:
+                    shutil.copyfileobj(source, output)
+    for file_name in (FILES.packing_plan, FILES.unprocessable_inputs):
+        shard_files = [
+            shard_dir / file_name
+            for shard_dir in used_dirs
+            if (shard_dir / file_name).exists()
+        ]
+        if not shard_files:
+            continue
+        with (output_dir / file_name).open("wb") as merged_output:
+            for shard_file in shard_files:
+                with shard_file.open("rb") as source:
+                    shutil.copyfileobj(source, merged_output)
+
+    run_metrics = calculate_run_metrics(
+        [request_measurement(span) for span in request_spans],
+        max_inputs_per_request=max_inputs_per_request,
+        max_tokens_per_request=max_tokens_per_request,
+        target_tpm=target_tpm,
+        target_inputs_per_minute=target_inputs_per_minute,
+        token_cache_hits=sum(
+            int(span["attributes"].get(f"metric.{METRICS.token_cache_hits}", 0))
+            for span in root_spans
+        ),
+        token_cache_misses=sum(
+            int(span["attributes"].get(f"metric.{METRICS.token_cache_misses}", 0))
+            for span in root_spans
+        ),
+    )
+    started_ns = min(span["start_time_unix_nano"] for span in root_spans)
+    completed_ns = max(span["end_time_unix_nano"] for span in root_spans)
+    provider = configure_tracing(output_dir)
+    tracer = provider.get_tracer(__name__)
+    root_span = tracer.start_span(TRACE.root_span, start_time=started_ns)
+    for name, value in root_spans[0]["attributes"].items():
+        if not name.startswith("metric.") and name not in PER_SHARD_ATTRIBUTES:
+            root_span.set_attribute(name, value)
+    for name in SUMMED_ATTRIBUTES:
+        root_span.set_attribute(
+            name,
+            sum(span["attributes"].get(name, 0) for span in root_spans),
+        )
+    root_span.set_attribute(TRACE.shard_count, shard_count)
+    root_span.set_attribute(TRACE.target_tpm, target_tpm)
+    root_span.set_attribute(TRACE.target_inputs_per_minute, target_inputs_per_minute)
+    root_span.set_attribute(
+        TRACE.request_concurrency,
+        sum(span["attributes"].get(TRACE.request_concurrency, 0) for span in root_spans),
+    )
+    root_span.set_attribute(
+        TRACE.duration_ms,
+        round((completed_ns - started_ns) / 1e6, 3),
+    )
+    for name in (METRICS.token_estimate_rate, METRICS.token_estimate_margin):
+        value = root_spans[0]["attributes"].get(f"metric.{name}")
+        if value is not None:
+            run_metrics[name] = value
+    startup_ms = [
+        span["attributes"][f"metric.{METRICS.process_start_to_first_request_ms}"]
+        for span in root_spans
+        if f"metric.{METRICS.process_start_to_first_request_ms}" in span["attributes"]
+    ]
+    if startup_ms:
+        run_metrics[METRICS.process_start_to_first_request_ms] = max(startup_ms)
+    for name in (METRICS.rate_limit_gated_requests, METRICS.rate_limit_gated_seconds):
+        values = [
+            span["attributes"][f"metric.{name}"]
+            for span in root_spans
+            if f"metric.{name}" in span["attributes"]
+        ]
+        if values:
+            run_metrics[name] = round(sum(values), 3)
+    for name, value in run_metrics.items():
+        root_span.set_attribute(f"metric.{name}", value)
+    try:
+        published_metrics = publish_run_metrics(
+            run_metrics,
+            metric_logging,
+            metric_prefix,
+        )
+        if published_metrics:
+            print(
+                f"Published {len(published_metrics)} MLflow metrics with "
+                f"prefix {metric_prefix!r}"
+            )
+    except Exception as error:
+        message = f"MLflow metric publishing failed: {error}"
+        root_span.set_attribute(TRACE.metric_logging_error, message)
+        print(f"WARNING: {message}", file=sys.stderr)
+    failed_count = sum(span["attributes"].get(TRACE.failed_count, 0) for span in root_spans)
+    root_span.set_status(Status(StatusCode.ERROR if failed_count else StatusCode.OK))
+    root_span.end(end_time=completed_ns)
+    provider.shutdown()
+
+    with (output_dir / FILES.trace).open("a", encoding="utf-8") as trace_output:
+        for spans in shard_spans:
+            for span in spans:
+                trace_output.write(json.dumps(span, separators=(",", ":")) + "\n")
+    print(
+        f"Merged {len(used_dirs)} shards into {output_path} "
+        f"({len(request_spans)} requests, {failed_count} failed)"
+    )
+    return run_metrics
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shard-dirs", type=Path, nargs="+", required=True)
+    parser.add_argument("--output-dir", type=Path, required=True)
+    parser.add_argument("--shard-count", type=int, required=True)
+    parser.add_argument("--max-inputs-per-request", type=int, default=0)
+    parser.add_argument("--max-tokens-per-request", type=int, default=0)
+    parser.add_argument("--target-tpm", type=int, default=0)
+    parser.add_argument("--target-inputs-per-minute", type=float, default=0)
+    parser.add_argument(
+        "--metric-logging",
+        choices=tuple(MetricLoggingMode),
+        default=MetricLoggingMode.DISABLED,
+    )
+    parser.add_argument("--metric-prefix", default=DEFAULT_METRIC_PREFIX)
+    args = parser.parse_args()
+    merge(
+        args.shard_dirs,
+        args.output_dir,
+        args.shard_count,
+        args.max_inputs_per_request,
+        args.max_tokens_per_request,
+        args.target_tpm,
+        args.target_inputs_per_minute,
+        args.metric_logging,
+        args.metric_prefix,
+    )
+
+
+if __name__ == "__main__":
+    main()
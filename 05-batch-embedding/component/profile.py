@@ -0,0 +1,65 @@
+import argparse
+from pathlib import Path
+
+from component.embed import REQUEST, ROW_FIELDS, input_files, located_requests
+from utils.columnar_input import parse_column_mapping
+from utils.embedding_optimization import token_counter_for_model, tokenizer_encoding_name
+from utils.token_profile import (
+    TokenCounts,
+    TokenProfile,
+    profile_sources,
+    write_token_profile,
+)
+
+
+def profile(
+    input_dir: Path,
+    model: str,
+    input_columns: str = "",
+) -> TokenProfile:
+    """Tokenize every input once and write the folder's token profile.
+
+    The profile is written next to the inputs, where the embed component,
+    the shard split, and invoke staging look for it.
+    """
+    count_tokens = token_counter_for_model(model)
+    tokens = TokenCounts.from_items(
+        (input_id, count_tokens(text))
+        for _, _, request in located_requests(
+            input_dir,
+            model,
+            max_batch_inputs=0,
+            columns=parse_column_mapping(input_columns, ROW_FIELDS),
+        )
+        for input_id, text in zip(
+            request[REQUEST.input_ids],
+            request[REQUEST.texts],
+            strict=True,
+        )
+    )
+    token_profile = TokenProfile(
+        encoding=tokenizer_encoding_name(model),
+        sources=profile_sources(input_dir, input_files(input_dir)),
+        tokens=tokens,
+    )
+    path = write_token_profile(input_dir, token_profile)
+    print(
+        f"Profiled {token_profile.input_count} inputs "
+        f"({token_profile.total_tokens} tokens) into {path}"
+    )
+    for bound, count in token_profile.histogram().items():
+        print(f"  <= {bound} tokens: {count}")
+    return token_profile
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input-dir", type=Path, required=True)
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--input-columns", default="")
+    args = parser.parse_args()
+    profile(args.input_dir, args.model, args.input_columns)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+import argparse
+from collections import Counter, defaultdict
+from collections.abc import Iterable
+from enum import StrEnum
+from pathlib import Path
+
+from component.embed import (
+    DEFAULTS,
+    LIMITS,
+    REQUEST,
+    ROW_FIELDS,
+    PackingMode,
+    input_files,
+    located_requests,
+)
+from utils.columnar_input import parse_column_mapping
+from utils.embedding_optimization import (
+    TOKENIZE_CHUNK_INPUTS,
+    token_counter_for_model,
+    tokenizer_encoding_name,
+)
+from utils.input_manifest import manifest_entry, write_manifest
+from utils.packing_plan import PLAN_FILE, PlannedRequest, folder_packing_plan, read_packing_plan
+from utils.token_profile import read_token_profile
+
+
+class ShardBalance(StrEnum):
+    INPUTS = "inputs"
+    TOKENS = "tokens"
+
+
+def file_weights(
+    input_dir: Path,
+    model: str,
+    balance: str,
+    max_batch_inputs: int,
+    input_columns: str = "",
+    record_counts: Counter[Path] | None = None,
+    ingest_workers: int = DEFAULTS.ingest_workers,
+    input_id_files: dict[str, Path] | None = None,
+) -> dict[Path, int]:
+    """Validate the whole batch once and weigh each input file."""
+    token_counter = token_counter_for_model(model) if balance == ShardBalance.TOKENS else None
+    token_profile = (
+        read_token_profile(input_dir, tokenizer_encoding_name(model), input_files(input_dir))
+        if token_counter is not None
+        else None
+    )
+    token_counts = token_profile.tokens if token_profile else {}
+    weights: Counter[Path] = Counter()
+    pending_paths: list[Path] = []
+    pending_texts: list[str] = []
+
+    def count_pending() -> None:
+        for path, count in zip(
+            pending_paths,
+            token_counter.count_batch(pending_texts),
+            strict=True,
+        ):
+            weights[path] += count
+        pending_paths.clear()
+        pending_texts.clear()
+
+    for path, _, request in located_requests(
+        input_dir,
+        model,
+        ingest_workers=ingest_workers,
+        max_batch_inputs=max_batch_inputs,
+        columns=parse_column_mapping(input_columns, ROW_FIELDS),
+    ):
+        if record_counts is not None:
+            record_counts[path] += 1
+        if input_id_files is not None:
+            input_id_files.update(dict.fromkeys(request[REQUEST.input_ids], path))
+        if token_counter is None:
+            weights[path] += request[REQUEST.input_count]
+            continue
+        for input_id, text in zip(
+            request[REQUEST.input_ids],
+            request[REQUEST.texts],
+            strict=True,
+        ):
+            if input_id in token_counts:
+                weights[path] += token_counts[input_id]
+            else:
+                pending_paths.append(path)
+                pending_texts.append(text)
+        if len(pending_texts) >= TOKENIZE_CHUNK_INPUTS:
+            count_pending()
+    if pending_texts:
+        count_pending()
+    return dict(weights)
+
+
+def planned_file_groups(
+    paths: Iterable[Path],
+    plan: Iterable[PlannedRequest],
+    input_id_files: dict[str, Path],
+) -> list[tuple[Path, ...]]:
+    """Group files whose inputs share a planned request, so one shard replays it."""
+    parents = {path: path for path in paths}
+
+    def root(path: Path) -> Path:
+        while parents[path] != path:
+            parents[path] = parents[parents[path]]
+            path = parents[path]
+        return path
+
+    for planned in plan:
+        roots = {
+            root(input_id_files[input_id])
+            for input_id in planned.input_ids
+            if input_id in input_id_files
+        }
+        if len(roots) > 1:
+            first, *others = sorted(roots)
+            for other in others:
+                parents[other] = first
+    groups: defaultdict[Path, list[Path]] = defaultdict(list)
+    for path in parents:
+        groups[root(path)].append(path)
+    return [tuple(sorted(group)) for group in groups.values()]
+
+
+def assign_shards(
+    weights: dict[Path, int],
+    shard_count: int,
+    groups: list[tuple[Path, ...]] | None = None,
+) -> list[list[Path]]:
+    """Assign file groups to shards, heaviest first, each to the lightest shard."""
+    shards: list[list[Path]] = [[] for _ in range(shard_count)]
+    loads = [0] * shard_count
+    group_weights = {
+        group: sum(weights[path] for path in group)
+        for group in groups or [(path,) for path in weights]
+    }
+    for group, weight in sorted(group_weights.items(), key=lambda item: (-item[1], item[0])):
+        lightest = min(range(shard_count), key=lambda index: (loads[index], index))
+        shards[lightest].extend(group)
+        loads[lightest] += weight
+    return [sorted(paths) for paths in shards]
+
+
+def split(
+    input_dir: Path,
+    output_dirs: list[Path],
+    model: str,
+    shard_count: int,
+    balance: str = ShardBalance.INPUTS,
+    max_batch_inputs: int = DEFAULTS.max_batch_inputs,
+    input_columns: str = "",
+    ingest_workers: int = DEFAULTS.ingest_workers,
+    packing: str = DEFAULTS.packing,
+) -> list[int]:
+    """Write one manifest per shard listing its files under input_dir; nothing is copied."""
+    if shard_count < 1 or shard_count > min(len(output_dirs), LIMITS.max_shards):
+        raise ValueError(
+            "shard_count must be between 1 and "
+            f"{min(len(output_dirs), LIMITS.max_shards)}"
+        )
+    try:
+        selected_balance = ShardBalance(balance)
+    except ValueError as error:
+        raise ValueError(f"balance must be one of: {', '.join(ShardBalance)}") from error
+    plan_path = folder_packing_plan(input_dir) if packing == PackingMode.REPLAYED_PLAN else None
+    if packing == PackingMode.REPLAYED_PLAN and plan_path is None:
+        raise ValueError(f"packing {packing} needs {PLAN_FILE} in the input folder")
+    record_counts: Counter[Path] = Counter()
+    input_id_files: dict[str, Path] | None = {} if plan_path is not None else None
+    weights = file_weights(
+        input_dir,
+        model,
+        selected_balance,
+        max_batch_inputs,
+        input_columns,
+        record_counts,
+        ingest_workers,
+        input_id_files,
+    )
+    groups = (
+        planned_file_groups(weights, read_packing_plan(plan_path), input_id_files)
+        if plan_path is not None
+        else None
+    )
+    shard_loads = []
+    for output_dir, paths in zip(
+        output_dirs,
+        assign_shards(weights, shard_count, groups)
+        + [[]] * (len(output_dirs) - shard_count),
+        strict=True,
+    ):
+        output_dir.mkdir(parents=True, exist_ok=True)
+        write_manifest(
+            output_dir,
+            [manifest_entry(input_dir, path, record_counts[path]) for path in paths],
+        )
+        shard_loads.append(sum(weights[path] for path in paths))
+    for index, load in enumerate(shard_loads[:shard_count]):
+        print(f"Shard {index}: {load} {selected_balance}")
+    return shard_loads
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input-dir", type=Path, required=True)
+    parser.add_argument("--output-dirs", type=Path, nargs="+", required=True)
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--shard-count", type=int, required=True)
+    parser.add_argument(
+        "--balance",
+        choices=tuple(ShardBalance),
+        default=ShardBalance.INPUTS,
+        help="Balance shards by embedding input count or tokenizer token count",
+    )
+    parser.add_argument(
+        "--max-batch-inputs",
+        type=int,
+        default=DEFAULTS.max_batch_inputs,
+    )
+    parser.add_argument("--input-columns", default="")
+    parser.add_argument(
+        "--ingest-workers",
+        type=int,
+        default=DEFAULTS.ingest_workers,
+    )
+    parser.add_argument(
+        "--packing",
+        choices=tuple(PackingMode),
+        default=DEFAULTS.packing,
+        help=f"plan keeps the files of each request in {PLAN_FILE} on one shard",
+    )
+    args = parser.parse_args()
+    split(
+        args.input_dir,
+        args.output_dirs,
+        args.model,
+        args.shard_count,
+        args.balance,
+        args.max_batch_inputs,
+        args.input_columns,
+        args.ingest_workers,
+        args.packing,
+    )
+
+
+if __name__ == "__main__":
+    main()
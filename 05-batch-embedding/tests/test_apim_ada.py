@@ -1,3 +1,4 @@
+import asyncio
 import json
 import unittest
 from dataclasses import dataclass
@@ -5,17 +6,30 @@ from datetime import UTC, datetime
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from types import SimpleNamespace
-from unittest.mock import Mock
+from unittest.mock import Mock, call
 
+import tiktoken
 from azure.core.exceptions import ResourceNotFoundError
 
 from batch_embeddings import (
     ModelKey,
     PackingMode as AmlPackingMode,
+    count_jsonl_records,
     experiment_name,
     job_name,
     repeat_jsonl_inputs,
 )
+from utils.input_manifest import read_manifest
+from utils.packing_plan import PLAN_FILE, PlannedRequest, write_packing_plan
+from utils.token_cache import CachingTokenCounter
+from utils.tokenizer_bundle import load_encoding, write_tokenizer_bundle
+from utils.token_profile import (
+    TokenCounts,
+    TokenProfile,
+    load_token_profile,
+    profile_sources,
+    write_token_profile,
+)
 from component.embed import DEFAULTS as COMPONENT_DEFAULTS
 from component.embed import LIMITS as COMPONENT_LIMITS
 from component.embed import PackingMode as ComponentPackingMode
@@ -36,14 +50,23 @@ from permissions_setup import RbacRole, RequiredAssignment, ensure_assignment
 from utils.embedding_optimization import (
     PLAN,
     REQUEST,
+    AdaptiveConcurrency,
+    AdaptiveTokenBudget,
+    PackedRequest,
+    RateLimitHeaderGate,
+    TokenBucketLimiter,
+    calibrated_token_estimate_rate,
     capacity_units_to_tpm,
     embedding_request,
     input_pacing_interval_seconds,
     pack_compatible_requests,
     pacing_interval_seconds,
+    parse_reset_seconds,
     percentile as optimization_percentile,
+    replay_packing_plan,
     target_tokens_per_request,
     token_counter_for_model,
+    token_estimator,
     tokens_per_minute,
     utilization_target_tpm,
 )
@@ -51,6 +74,7 @@ from utils.aml_metrics import (
     METRICS,
     RequestMeasurement,
     calculate_run_metrics,
+    publish_metric_series,
     publish_run_metrics,
 )
 
@@ -187,6 +211,295 @@ class OptimizationUtilityTests(unittest.TestCase):
             [f"id-{index}" for index in range(5)],
         )
 
+    def test_packed_requests_share_group_inputs_until_sent(self) -> None:
+        requests = [
+            embedding_request(
+                input_ids=f"id-{index}",
+                texts=f"text-{index}",
+                model=VALUES.model_ada,
+                dimensions=256,
+            )
+            for index in range(3)
+        ]
+
+        first, second = pack_compatible_requests(requests, "batch", 2)
+
+        self.assertIsInstance(first, PackedRequest)
+        self.assertIs(first.text_store, second.text_store)
+        self.assertEqual(
+            dict(second),
+            {
+                REQUEST.input_ids: ["id-2"],
+                REQUEST.texts: ["text-2"],
+                REQUEST.body: {
+                    REQUEST.model: VALUES.model_ada,
+                    REQUEST.encoding_format: "float",
+                    REQUEST.dimensions: 256,
+                    REQUEST.input: ["text-2"],
+                },
+                REQUEST.input_count: 1,
+                REQUEST.estimated_tokens: 0,
+            },
+        )
+        self.assertIsNot(first[REQUEST.body], first[REQUEST.body])
+
+    def test_streaming_packing_yields_before_input_ends(self) -> None:
+        requests = [
+            embedding_request(
+                input_ids=f"id-{index}",
+                texts=f"text-{index}",
+                model=VALUES.model_ada,
+                encoding_format="base64" if index % 3 == 0 else "float",
+            )
+            for index in range(9)
+        ]
+        consumed: list[int] = []
+
+        def source():
+            for index, request in enumerate(requests):
+                consumed.append(index)
+                yield request
+
+        streamed = pack_compatible_requests(source(), "batch", 2, stream=True)
+        first = next(streamed)
+        consumed_before_first = len(consumed)
+        rest = list(streamed)
+        buffered = list(pack_compatible_requests(requests, "batch", 2))
+
+        self.assertEqual(first[REQUEST.input_ids], ["id-1", "id-2"])
+        self.assertEqual(consumed_before_first, 3)
+        self.assertCountEqual(
+            [dict(item) for item in [first, *rest]],
+            [dict(item) for item in buffered],
+        )
+
+    def test_binpack_fills_token_ceiling_with_fewer_requests(self) -> None:
+        lengths = (5, 2, 5, 2, 3, 3, 5, 5)
+        requests = [
+            embedding_request(
+                input_ids=f"id-{index}",
+                texts="x" * length,
+                model=VALUES.model_ada,
+            )
+            for index, length in enumerate(lengths)
+        ]
+
+        def packed_tokens(packing: str, window: int) -> list[int]:
+            return [
+                item[REQUEST.estimated_tokens]
+                for item in pack_compatible_requests(
+                    requests,
+                    packing,
+                    max_inputs_per_request=10,
+                    max_tokens_per_request=10,
+                    count_tokens=len,
+                    binpack_window=window,
+                )
+            ]
+
+        binpacked = list(
+            pack_compatible_requests(
+                requests,
+                "binpack",
+                max_inputs_per_request=10,
+                max_tokens_per_request=10,
+                count_tokens=len,
+            )
+        )
+
+        self.assertEqual(packed_tokens("batch", 8), [7, 10, 8, 5])
+        self.assertEqual(packed_tokens("binpack", 8), [10, 10, 10])
+        self.assertEqual(packed_tokens("binpack", 3), [10, 10, 10])
+        self.assertEqual(
+            sorted(input_id for item in binpacked for input_id in item[REQUEST.input_ids]),
+            sorted(f"id-{index}" for index in range(len(lengths))),
+        )
+
+    def test_sorted_packing_groups_inputs_of_similar_length(self) -> None:
+        lengths = (5, 2, 5, 2, 3, 3, 5, 5)
+        requests = [
+            embedding_request(
+                input_ids=f"id-{index}",
+                texts="x" * length,
+                model=VALUES.model_ada,
+            )
+            for index, length in enumerate(lengths)
+        ]
+
+        def packed_lengths(**options) -> list[list[int]]:
+            return [
+                [len(text) for text in item[REQUEST.body][REQUEST.input]]
+                for item in pack_compatible_requests(
+                    requests,
+                    "sorted",
+                    count_tokens=len,
+                    **options,
+                )
+            ]
+
+        sorted_packed = list(
+            pack_compatible_requests(
+                requests,
+                "sorted",
+                max_inputs_per_request=3,
+                count_tokens=len,
+            )
+        )
+
+        self.assertEqual(
+            packed_lengths(max_inputs_per_request=3),
+            [[2, 2, 3], [3, 5, 5], [5, 5]],
+        )
+        self.assertEqual(
+            packed_lengths(max_inputs_per_request=10, max_tokens_per_request=10),
+            [[2, 2, 3, 3], [5, 5], [5, 5]],
+        )
+        self.assertEqual(
+            packed_lengths(max_inputs_per_request=3, binpack_window=8),
+            [[3, 5, 5], [5, 5], [2, 2, 3]],
+        )
+        self.assertEqual(
+            sorted(input_id for item in sorted_packed for input_id in item[REQUEST.input_ids]),
+            sorted(f"id-{index}" for index in range(len(lengths))),
+        )
+        with self.assertRaisesRegex(ValueError, "count_tokens is required"):
+            list(pack_compatible_requests(requests, "sorted", 3))
+
+    def test_token_budget_cuts_each_new_request(self) -> None:
+        requests = [
+            embedding_request(
+                input_ids=f"id-{index}",
+                texts="xx",
+                model=VALUES.model_ada,
+            )
+            for index in range(7)
+        ]
+        budget = [4]
+        packed = pack_compatible_requests(
+            requests,
+            "batch",
+            max_inputs_per_request=10,
+            max_tokens_per_request=10,
+            count_tokens=len,
+            stream=True,
+            token_budget=lambda: budget[0],
+        )
+
+        first = next(packed)
+        budget[0] = 6
+        rest = list(packed)
+
+        self.assertEqual(
+            [item[REQUEST.input_count] for item in [first, *rest]],
+            [2, 3, 2],
+        )
+        with self.assertRaisesRegex(ValueError, "token_budget requires"):
+            list(pack_compatible_requests(requests, "batch", 10, token_budget=lambda: 4))
+
+    def test_adaptive_token_budget_climbs_throughput_and_backs_off_on_429(self) -> None:
+        token_budget = AdaptiveTokenBudget(1_000, 250, 4_000, window=2, step=0.5)
+        windows = (
+            ((0, 1, 1_000, 200), (0, 1, 1_000, 200)),
+            ((1, 2, 3_000, 200), (1, 2, 3_000, 200)),
+            ((2, 3, 100, 429), (2, 3, 100, 200)),
+            ((3, 4, 100, 200), (3, 4, 100, 200)),
+            ((4, 5, 50, 200), (4, 5, 50, 200)),
+        )
+        for window in windows:
+            for sample in window:
+                token_budget.observe(*sample)
+
+        self.assertEqual(
+            [budget for _, budget in token_budget.history],
+            [1_000, 1_500, 2_250, 1_125, 562, 843],
+        )
+        self.assertEqual([completed for completed, _ in token_budget.history][1:], [1, 2, 3, 4, 5])
+        self.assertEqual(token_budget(), 843)
+        with self.assertRaisesRegex(ValueError, "token budget bounds"):
+            AdaptiveTokenBudget(100, 200, 4_000)
+
+    def test_adaptive_concurrency_adds_on_success_and_halves_on_throttle(self) -> None:
+        now = [0.0]
+        concurrency = AdaptiveConcurrency(1, 6, clock=lambda: now[0])
+        for status_code in (200, 200, 200):
+            now[0] += 1
+            concurrency.record(status_code)
+        for _ in range(3):
+            concurrency.acquire()
+        concurrency.record(429)
+        concurrency.record(503)
+        for _ in range(3):
+            concurrency.release()
+        for successes in (2, 3, 4, 5, 6):
+            for _ in range(successes):
+                concurrency.record(200)
+        concurrency.record(400)
+        concurrency.record(429)
+
+        self.assertEqual(
+            [limit for _, limit in concurrency.history],
+            [1, 2, 3, 4, 2, 3, 4, 5, 6, 3],
+        )
+        self.assertEqual([changed for changed, _ in concurrency.history][:4], [0, 1, 2, 3])
+        self.assertEqual((concurrency(), concurrency.in_flight), (3, 0))
+        self.assertEqual([concurrency.try_acquire() for _ in range(4)], [True, True, True, False])
+        self.assertEqual(concurrency.in_flight, 3)
+        with self.assertRaisesRegex(ValueError, "concurrency bounds"):
+            AdaptiveConcurrency(4, 2)
+
+    def test_adaptive_concurrency_queues_async_tasks_at_the_limit(self) -> None:
+        concurrency = AdaptiveConcurrency(1, 2)
+        order = []
+
+        async def request(name: str) -> None:
+            await concurrency.acquire_async()
+            order.append((name, concurrency.in_flight, concurrency()))
+            await asyncio.sleep(0)
+            concurrency.record(200)
+            concurrency.release()
+
+        async def run_requests() -> None:
+            await asyncio.gather(*(request(name) for name in "abcd"))
+
+        asyncio.run(run_requests())
+
+        self.assertEqual([name for name, _, _ in order], list("abcd"))
+        self.assertTrue(all(in_flight <= limit for _, in_flight, limit in order))
+        self.assertEqual(order[0][1:], (1, 1))
+        self.assertEqual((concurrency(), concurrency.in_flight), (2, 0))
+
+    def test_packing_plan_replays_recorded_request_composition(self) -> None:
+        requests = [
+            embedding_request(
+                input_ids=[f"id-{index}", f"id-{index + 1}"],
+                texts=["a", "b"],
+                model=VALUES.model_ada,
+            )
+            for index in (0, 2, 4)
+        ]
+        plan = [
+            PlannedRequest(["id-5", "id-0"], 7),
+            PlannedRequest(["other-shard"], 1),
+            PlannedRequest(["id-1", "id-2", "id-3", "id-4"], 9),
+        ]
+
+        replayed = list(replay_packing_plan(requests, plan))
+
+        self.assertEqual(
+            [item[REQUEST.input_ids] for item in replayed],
+            [["id-5", "id-0"], ["id-1", "id-2", "id-3", "id-4"]],
+        )
+        self.assertEqual([item[REQUEST.estimated_tokens] for item in replayed], [7, 9])
+        self.assertEqual(replayed[0][REQUEST.body][REQUEST.input], ["b", "a"])
+        with self.assertRaisesRegex(ValueError, "'id-9' is not in the inputs"):
+            list(replay_packing_plan(requests, [PlannedRequest(["id-0", "id-9"], 0)]))
+        with self.assertRaisesRegex(ValueError, "5 inputs are not in the packing plan"):
+            list(replay_packing_plan(requests, [PlannedRequest(["id-0"], 0)]))
+        with self.assertRaisesRegex(ValueError, "4 inputs, exceeding max_inputs_per_request 3"):
+            list(replay_packing_plan(requests, plan, max_inputs_per_request=3))
+        with self.assertRaisesRegex(ValueError, "9 tokens, exceeding max_tokens_per_request 8"):
+            list(replay_packing_plan(requests, plan, max_tokens_per_request=8))
+
     def test_packing_keeps_different_settings_separate(self) -> None:
         requests = [
             embedding_request(
@@ -213,6 +526,84 @@ class OptimizationUtilityTests(unittest.TestCase):
         self.assertEqual(tokens_per_minute(1400, interval), 24000)
         self.assertEqual(input_pacing_interval_seconds(100, 720), 100 / 12)
 
+    def test_token_bucket_limiter_matches_pacing_without_burst(self) -> None:
+        now = [0.0]
+        limiter = TokenBucketLimiter(
+            tokens_per_minute=24000,
+            inputs_per_minute=720,
+            clock=lambda: now[0],
+        )
+
+        waits = [limiter.reserve(1400, 1) for _ in range(3)]
+        now[0] = 10.0
+        after_idle = limiter.reserve(1400, 100)
+
+        self.assertEqual(waits, [0.0, 3.5, 7.0])
+        self.assertEqual(after_idle, 0.5)
+        self.assertAlmostEqual(limiter.reserve(0, 0), 0.5 + 100 / 12)
+
+    def test_token_bucket_limiter_allows_configured_burst(self) -> None:
+        now = [0.0]
+        limiter = TokenBucketLimiter(
+            tokens_per_minute=6000,
+            burst_seconds=2,
+            clock=lambda: now[0],
+        )
+
+        waits = [limiter.reserve(50) for _ in range(5)]
+        now[0] = 60.0
+        oversized = [limiter.reserve(1000), limiter.reserve(50)]
+
+        self.assertEqual(waits, [0.0, 0.0, 0.0, 0.0, 0.5])
+        self.assertEqual(oversized, [0.0, 8.5])
+        self.assertFalse(TokenBucketLimiter())
+        with self.assertRaises(ValueError):
+            TokenBucketLimiter(tokens_per_minute=-1)
+
+    def test_parse_reset_seconds_reads_seconds_and_durations(self) -> None:
+        self.assertEqual(parse_reset_seconds("60"), 60.0)
+        self.assertEqual(parse_reset_seconds("0.5"), 0.5)
+        self.assertEqual(parse_reset_seconds("6m0s"), 360.0)
+        self.assertEqual(parse_reset_seconds("1h2m3.5s"), 3723.5)
+        self.assertEqual(parse_reset_seconds("120ms"), 0.12)
+        self.assertIsNone(parse_reset_seconds("soon"))
+        self.assertIsNone(parse_reset_seconds("6m later"))
+
+    def test_rate_limit_header_gate_holds_dispatch_until_reset(self) -> None:
+        now = [0.0]
+        gate = RateLimitHeaderGate(default_reset_seconds=2, clock=lambda: now[0])
+
+        ungated = gate.reserve(10_000)
+        gate.observe(
+            {
+                "x-ratelimit-remaining-tokens": "1500",
+                "x-ratelimit-limit-tokens": "120000",
+                "x-ratelimit-reset-tokens": "30s",
+                "x-ratelimit-remaining-requests": "5",
+                "x-ratelimit-limit-requests": "720",
+            }
+        )
+        waits = [gate.reserve(1000), gate.reserve(1000), gate.reserve(1000)]
+
+        self.assertEqual(ungated, 0.0)
+        self.assertEqual(waits, [0.0, 30.0, 30.0])
+        self.assertEqual(gate.gated_requests, 2)
+        self.assertEqual(gate.gated_seconds, 60.0)
+
+        now[0] = 40.0
+        gate.observe(
+            {
+                "x-ratelimit-remaining-tokens": "90000",
+                "x-ratelimit-remaining-requests": "0",
+                "x-ratelimit-reset-requests": "not a duration",
+            }
+        )
+        self.assertEqual(gate.reserve(1000), 2.0)
+        self.assertEqual(gate.reserve(1000), 2.0)
+        self.assertEqual(gate.gated_requests, 4)
+        with self.assertRaises(ValueError):
+            RateLimitHeaderGate(default_reset_seconds=0)
+
     def test_shared_percentile_validates_boundaries(self) -> None:
         self.assertIsNone(optimization_percentile([], 50))
         self.assertEqual(optimization_percentile([0.0, 10.0], 50), 5.0)
@@ -244,6 +635,166 @@ class OptimizationUtilityTests(unittest.TestCase):
             [4, 6, 4],
         )
 
+    def test_profiled_token_counts_replace_tokenizer_calls(self) -> None:
+        requests = [
+            embedding_request(
+                input_ids=f"id-{index}",
+                texts=text,
+                model=VALUES.model_ada,
+            )
+            for index, text in enumerate(("aaaa", "bbbb", "cc", "dddd"))
+        ]
+        counted: list[str] = []
+
+        def count_tokens(text: str) -> int:
+            counted.append(text)
+            return len(text)
+
+        packed = list(
+            pack_compatible_requests(
+                requests,
+                "batch",
+                max_inputs_per_request=10,
+                max_tokens_per_request=6,
+                count_tokens=count_tokens,
+                token_counts={"id-0": 1, "id-1": 1, "id-2": 5},
+            )
+        )
+
+        self.assertEqual(counted, ["dddd"])
+        self.assertEqual(
+            [item[REQUEST.estimated_tokens] for item in packed],
+            [2, 5, 4],
+        )
+
+    def test_batch_token_counting_keeps_packing_decisions(self) -> None:
+        requests = [
+            embedding_request(
+                input_ids=f"id-{index}",
+                texts="x" * (index % 7 + 1),
+                model=VALUES.model_ada,
+            )
+            for index in range(5_000)
+        ]
+        batches: list[int] = []
+
+        def count_tokens_batch(texts: list[str]) -> list[int]:
+            batches.append(len(texts))
+            return [len(text) for text in texts]
+
+        for packing, stream in (("batch", False), ("batch", True), ("binpack", True)):
+            with self.subTest(packing=packing, stream=stream):
+                batches.clear()
+                options = {
+                    "max_inputs_per_request": 64,
+                    "max_tokens_per_request": 40,
+                    "count_tokens": len,
+                    "token_counts": {"id-0": 9},
+                    "stream": stream,
+                }
+                expected = [
+                    dict(item)
+                    for item in pack_compatible_requests(requests, packing, **options)
+                ]
+                actual = [
+                    dict(item)
+                    for item in pack_compatible_requests(
+                        requests,
+                        packing,
+                        count_tokens_batch=count_tokens_batch,
+                        **options,
+                    )
+                ]
+
+                self.assertEqual(actual, expected)
+                self.assertEqual(
+                    batches,
+                    [63, 128, 256, 512, 1_024, 2_048, 968]
+                    if stream and packing == "batch"
+                    else [2_047, 2_048, 904],
+                )
+
+    def test_token_cache_counts_batches_once_per_distinct_text(self) -> None:
+        batches: list[list[str]] = []
+
+        def count_batch(texts: list[str]) -> list[int]:
+            batches.append(texts)
+            return [len(text) for text in texts]
+
+        counter = CachingTokenCounter(len, "cl100k_base", count_batch=count_batch)
+        counter("aa")
+        counts = counter.count_batch(["aa", "bbb", "", "bbb", "cccc"])
+
+        self.assertEqual(counts, [2, 3, 0, 3, 4])
+        self.assertEqual(batches, [["bbb", "cccc"]])
+        self.assertEqual((counter.hits, counter.misses), (2, 3))
+
+    def test_token_cache_is_bounded_and_persists_across_runs(self) -> None:
+        counted: list[str] = []
+
+        def count(text: str) -> int:
+            counted.append(text)
+            return len(text)
+
+        with TemporaryDirectory() as temporary_directory:
+            path = Path(temporary_directory) / "tokens.cache"
+            counter = CachingTokenCounter(count, "cl100k_base", max_entries=2, path=path)
+            results = [counter(text) for text in ("aa", "bbb", "aa", "cccc", "bbb", "")]
+            counter.save()
+            reloaded = CachingTokenCounter(count, "cl100k_base", path=path)
+            other_encoding = CachingTokenCounter(count, "o200k_base", path=path)
+            reloaded_entries = len(reloaded)
+            counted.clear()
+            reloaded_results = [reloaded("aa"), reloaded("cccc")]
+
+        self.assertEqual(results, [2, 3, 2, 4, 3, 0])
+        self.assertEqual((counter.hits, counter.misses), (1, 4))
+        self.assertEqual(reloaded_entries, 2)
+        self.assertEqual(len(other_encoding), 0)
+        self.assertEqual(reloaded_results, [2, 4])
+        self.assertEqual(counted, ["aa"])
+        self.assertEqual((reloaded.hits, reloaded.misses), (1, 1))
+
+    def test_token_estimator_scales_utf8_bytes_with_margin(self) -> None:
+        estimate = token_estimator(0.25, 0.1)
+
+        self.assertEqual(estimate(""), 0)
+        self.assertEqual(estimate("a" * 40), 11)
+        self.assertEqual(estimate("é" * 20), 11)
+        self.assertAlmostEqual(calibrated_token_estimate_rate(0.25, 0.1, 1.375), 0.2)
+        with self.assertRaisesRegex(ValueError, "rate must be positive"):
+            token_estimator(0, 0.1)
+        with self.assertRaisesRegex(ValueError, "estimated_to_actual_token_ratio"):
+            calibrated_token_estimate_rate(0.25, 0.1, 0)
+
+    def test_tokenizer_bundle_round_trips_an_encoding(self) -> None:
+        definition = {
+            "name": "bytes_with_merges",
+            "pat_str": r"\S+|\s+",
+            "mergeable_ranks": {
+                **{bytes([value]): value for value in range(256)},
+                b"ab": 256,
+                b"abc": 257,
+            },
+            "special_tokens": {"<|end|>": 258},
+        }
+        reference = tiktoken.Encoding(
+            definition["name"],
+            pat_str=definition["pat_str"],
+            mergeable_ranks=definition["mergeable_ranks"],
+            special_tokens=definition["special_tokens"],
+        )
+
+        with TemporaryDirectory() as temporary_directory:
+            bundle_root = Path(temporary_directory)
+            path = write_tokenizer_bundle(definition["name"], bundle_root, definition)
+            encoding = load_encoding(definition["name"], bundle_root)
+
+        self.assertEqual(path.name, "bytes_with_merges.tokbundle")
+        self.assertEqual(encoding.n_vocab, reference.n_vocab)
+        for text in ("abc ab", "é <|end|>", ""):
+            self.assertEqual(encoding.encode_ordinary(text), reference.encode_ordinary(text))
+
     def test_ada_token_counter_counts_nonempty_text(self) -> None:
         counter = token_counter_for_model(VALUES.model_ada)
         self.assertGreater(counter("Azure embedding input"), 0)
@@ -270,6 +821,8 @@ class AmlMetricTests(unittest.TestCase):
             max_tokens_per_request=1200,
             target_tpm=12000,
             target_inputs_per_minute=720,
+            token_cache_hits=3,
+            token_cache_misses=1,
         )
 
         self.assertEqual(metrics[METRICS.attempted_rpm], 30.0)
@@ -287,8 +840,15 @@ class AmlMetricTests(unittest.TestCase):
         self.assertEqual(metrics[METRICS.logical_inputs_per_minute], 1200.0)
         self.assertEqual(metrics[METRICS.inputs_per_request], 50.0)
         self.assertEqual(metrics[METRICS.token_ceiling_fill_ratio], 1_000 / 1_200)
+        self.assertEqual(
+            metrics[METRICS.estimated_token_ceiling_fill_ratio],
+            1_400 / 2_400,
+        )
         self.assertEqual(metrics[METRICS.item_ceiling_fill_ratio], 0.5)
         self.assertEqual(metrics[METRICS.estimated_to_actual_token_ratio], 1.0)
+        self.assertEqual(metrics[METRICS.token_estimate_error_p95], 0.0)
+        self.assertEqual(metrics[METRICS.token_cache_hits], 3.0)
+        self.assertEqual(metrics[METRICS.token_cache_misses], 1.0)
         self.assertEqual(metrics[METRICS.request_latency_p95_ms], 2000.0)
 
     def test_metric_publishing_is_namespaced_and_configurable(self) -> None:
@@ -318,6 +878,21 @@ class AmlMetricTests(unittest.TestCase):
         )
         logger.log_metrics.assert_not_called()
 
+        publish_metric_series(
+            METRICS.concurrency_limit,
+            [(0, 1.0), (250, 2.0)],
+            "mlflow",
+            "ada_batch",
+            logger=logger,
+        )
+        self.assertEqual(
+            logger.log_metrics.call_args_list,
+            [
+                call({"ada_batch.concurrency_limit": 1.0}, step=0),
+                call({"ada_batch.concurrency_limit": 2.0}, step=250),
+            ],
+        )
+
     def test_metric_prefix_rejects_unsafe_names(self) -> None:
         with self.assertRaisesRegex(ValueError, "metric_prefix"):
             publish_run_metrics(
@@ -530,10 +1105,97 @@ class AmlNamingTests(unittest.TestCase):
                 model=VALUES.model_ada,
             )
             row = json.loads((destination / "sample.jsonl").read_text())
+            manifest = read_manifest(destination)
+            unprofiled = load_token_profile(destination)
 
             self.assertEqual(count, 1)
+            self.assertEqual(
+                [(entry.path, entry.records) for entry in manifest],
+                [("sample.jsonl", 1)],
+            )
             self.assertEqual(row[COMPONENT_REQUEST.input_id], "chunk-001")
             self.assertEqual(row[COMPONENT_REQUEST.model], VALUES.model_ada)
+            self.assertIsNone(unprofiled)
+
+    def test_preparation_skips_a_packing_plan_staged_with_the_inputs(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            source = root / "source"
+            destination = root / "destination"
+            source.mkdir()
+            write_jsonl(
+                source / "sample.jsonl",
+                (
+                    {
+                        COMPONENT_REQUEST.input_id: "chunk-001",
+                        COMPONENT_REQUEST.input: "one",
+                        COMPONENT_REQUEST.model: VALUES.model_ada,
+                    },
+                ),
+            )
+            write_token_profile(
+                source,
+                TokenProfile(
+                    encoding="cl100k_base",
+                    sources=profile_sources(source, [source / "sample.jsonl"]),
+                    tokens=TokenCounts.from_items([("chunk-001", 3)]),
+                ),
+            )
+            write_packing_plan(source / PLAN_FILE, [PlannedRequest(["chunk-001"], 3)])
+
+            source_count = count_jsonl_records(source)
+            count = repeat_jsonl_inputs(source, destination, repetitions=1, model=VALUES.model_ada)
+            manifest = read_manifest(destination)
+            profile = load_token_profile(destination)
+            staged_plan = (destination / PLAN_FILE).exists()
+
+        self.assertEqual((source_count, count), (1, 1))
+        self.assertEqual([entry.path for entry in manifest], ["sample.jsonl"])
+        self.assertEqual(profile.tokens.get("chunk-001"), 3)
+        self.assertFalse(staged_plan)
+
+    def test_repeated_preparation_carries_token_profile(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            source = root / "source"
+            destination = root / "destination"
+            source.mkdir()
+            write_jsonl(
+                source / "sample.jsonl",
+                (
+                    {
+                        COMPONENT_REQUEST.input_id: ["chunk-001", "chunk-002"],
+                        COMPONENT_REQUEST.input: ["one", "two"],
+                        COMPONENT_REQUEST.model: VALUES.model_ada,
+                    },
+                ),
+            )
+            write_token_profile(
+                source,
+                TokenProfile(
+                    encoding="cl100k_base",
+                    sources=profile_sources(source, [source / "sample.jsonl"]),
+                    tokens=TokenCounts.from_items([("chunk-001", 3), ("chunk-002", 7)]),
+                ),
+            )
+
+            repeat_jsonl_inputs(source, destination, repetitions=2, model=VALUES.model_ada)
+            profile = load_token_profile(destination)
+
+        self.assertEqual(
+            [
+                profile.tokens.get(input_id)
+                for input_id in (
+                    "chunk-001-repeat-01",
+                    "chunk-002-repeat-01",
+                    "chunk-001-repeat-02",
+                    "chunk-002-repeat-02",
+                    "chunk-001",
+                )
+            ],
+            [3, 7, 3, 7, None],
+        )
+        self.assertEqual(profile.histogram(), {4: 2, 8: 2})
 
 
 if __name__ == "__main__":
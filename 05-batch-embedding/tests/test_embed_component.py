@@ -0,0 +1,1412 @@
+import asyncio
+import json
+import os
+import time
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+
+from batch_embeddings import create_sharded_pipeline_component
+from component.embed import (
+    FILES,
+    REQUEST,
+    RESPONSE,
+    ROW_FIELDS,
+    DispatchEngine,
+    ExecutionMode,
+    IngestStats,
+    InputStorage,
+    InputFile,
+    RequestValidator,
+    completed_async_results,
+    dry_run_response,
+    input_files,
+    ordered_async_results,
+    parse_request_file,
+    read_requests,
+    run,
+)
+from component.merge import merge
+from component.shard import split
+from utils.columnar_input import parse_column_mapping
+from utils.input_index import InputIdIndex
+from utils.packing_plan import PLAN_FILE
+from utils.input_manifest import (
+    MANIFEST_FILE,
+    manifest_entry,
+    read_manifest,
+    write_manifest,
+)
+from utils.record_index import (
+    RecordReader,
+    RecordText,
+    default_index_dir,
+    read_line_offsets,
+    sidecar_path,
+)
+from utils.embedding_optimization import RateLimitHeaderGate, TokenBucketLimiter
+from utils.token_cache import CachingTokenCounter
+from utils.token_profile import (
+    TokenCounts,
+    TokenProfile,
+    read_token_profile,
+    profile_sources,
+    write_token_profile,
+)
+
+MODEL = "text-embedding-3-small"
+
+
+def write_inputs(
+    directory: Path,
+    count: int,
+    name: str = "inputs.jsonl",
+    start: int = 0,
+) -> None:
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / name).write_text(
+        "".join(
+            json.dumps(
+                {
+                    REQUEST.input_id: f"chunk-{index:04d}",
+                    REQUEST.input: f"text {index}",
+                    REQUEST.model: MODEL,
+                }
+            )
+            + "\n"
+            for index in range(start, start + count)
+        ),
+        encoding="utf-8",
+    )
+
+
+def dry_run(input_dir: Path, output_dir: Path, **options) -> list[dict]:
+    with redirect_stdout(StringIO()):
+        run(
+            input_dir,
+            output_dir,
+            endpoint="https://example.invalid",
+            deployment="deployment",
+            model=MODEL,
+            dry_run=True,
+            **options,
+        )
+    return [
+        json.loads(line)
+        for line in (output_dir / FILES.embeddings).read_text().splitlines()
+    ]
+
+
+def root_span(output_dir: Path) -> dict:
+    spans = [
+        json.loads(line)
+        for line in (output_dir / FILES.trace).read_text().splitlines()
+    ]
+    return next(span for span in spans if span["name"] == "batch.embed")
+
+
+def output_ids(records: list[dict]) -> list[str]:
+    return [
+        item[REQUEST.input_id]
+        for record in records
+        for item in record[RESPONSE.data]
+    ]
+
+
+class ExecutionModeTests(unittest.TestCase):
+    def test_streaming_matches_buffered_output(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 25)
+            buffered = dry_run(
+                root / "input",
+                root / "buffered",
+                max_inputs_per_request=4,
+                request_concurrency=3,
+            )
+            streamed = dry_run(
+                root / "input",
+                root / "streamed",
+                max_inputs_per_request=4,
+                request_concurrency=3,
+                execution=ExecutionMode.STREAMING,
+                max_in_flight_requests=3,
+            )
+            attributes = root_span(root / "streamed")["attributes"]
+
+        self.assertEqual(streamed, buffered)
+        self.assertEqual(len(streamed), 7)
+        self.assertEqual(output_ids(streamed), [f"chunk-{index:04d}" for index in range(25)])
+        self.assertEqual(attributes["embedding.execution"], "streaming")
+        self.assertEqual(attributes["embedding.max_in_flight_requests"], 3)
+        self.assertGreater(attributes["metric.process_start_to_first_request_ms"], 0)
+        self.assertEqual(attributes["embedding.source_line_count"], 25)
+
+    def test_estimated_token_counting_packs_without_tokenizer(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 10)
+            records = dry_run(
+                root / "input",
+                root / "output",
+                max_inputs_per_request=16,
+                max_tokens_per_request=5,
+                token_counting="estimate",
+            )
+            attributes = root_span(root / "output")["attributes"]
+
+        self.assertEqual(len(records), 5)
+        self.assertEqual(output_ids(records), [f"chunk-{index:04d}" for index in range(10)])
+        self.assertEqual(attributes["embedding.token_counting"], "estimate")
+        self.assertEqual(attributes["metric.token_estimate_rate"], 0.25)
+        self.assertEqual(attributes["metric.token_estimate_margin"], 0.1)
+
+    def test_estimates_above_the_ceiling_are_sent_alone(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 4)
+            records = dry_run(
+                root / "input",
+                root / "output",
+                max_inputs_per_request=16,
+                max_tokens_per_request=1,
+                token_counting="estimate",
+            )
+            plan = [
+                json.loads(line)
+                for line in (root / "output" / FILES.packing_plan).read_text().splitlines()
+            ]
+
+        self.assertEqual([len(record[RESPONSE.data]) for record in records], [1, 1, 1, 1])
+        self.assertEqual([entry["estimated_tokens"] for entry in plan], [1, 1, 1, 1])
+
+    def test_sorted_packing_counts_tokens_without_a_token_ceiling(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 12)
+            records = dry_run(
+                root / "input",
+                root / "output",
+                packing="sorted",
+                max_inputs_per_request=8,
+                token_counting="estimate",
+            )
+
+        self.assertEqual([len(record[RESPONSE.data]) for record in records], [8, 4])
+        self.assertEqual(output_ids(records), [f"chunk-{index:04d}" for index in range(12)])
+
+    def test_adaptive_request_sizing_records_token_budgets(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 40)
+            records = dry_run(
+                root / "input",
+                root / "output",
+                max_tokens_per_request=8,
+                token_counting="estimate",
+                execution=ExecutionMode.STREAMING,
+                request_sizing="adaptive",
+            )
+            attributes = root_span(root / "output")["attributes"]
+            with self.assertRaisesRegex(ValueError, "requires streaming execution"):
+                dry_run(
+                    root / "input",
+                    root / "buffered",
+                    max_tokens_per_request=8,
+                    token_counting="estimate",
+                    request_sizing="adaptive",
+                )
+
+        self.assertEqual(output_ids(records), [f"chunk-{index:04d}" for index in range(40)])
+        self.assertEqual(attributes["embedding.request_sizing"], "adaptive")
+        self.assertEqual(attributes["embedding.token_budgets"][0], 8)
+        self.assertEqual(
+            len(attributes["embedding.token_budget_offsets_ms"]),
+            len(attributes["embedding.token_budgets"]),
+        )
+
+    def test_packing_plan_replay_reproduces_request_composition(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 30)
+            packed = dry_run(
+                root / "input",
+                root / "packed",
+                packing="binpack",
+                max_inputs_per_request=7,
+                max_tokens_per_request=9,
+                token_counting="estimate",
+            )
+            replayed = dry_run(
+                root / "input",
+                root / "replayed",
+                packing="plan",
+                max_inputs_per_request=7,
+                packing_plan_path=root / "packed" / FILES.packing_plan,
+            )
+            with self.assertRaisesRegex(ValueError, "exceeding max_inputs_per_request 2"):
+                dry_run(
+                    root / "input",
+                    root / "narrower",
+                    packing="plan",
+                    max_inputs_per_request=2,
+                    packing_plan_path=root / "packed" / FILES.packing_plan,
+                )
+            plans = [
+                (root / name / FILES.packing_plan).read_text(encoding="utf-8")
+                for name in ("packed", "replayed")
+            ]
+            attributes = root_span(root / "replayed")["attributes"]
+
+        self.assertEqual(replayed, packed)
+        self.assertEqual(plans[0], plans[1])
+        self.assertTrue(attributes["embedding.packing_plan_replayed"])
+        self.assertTrue(attributes["embedding.packing_plan"].endswith(FILES.packing_plan))
+        self.assertEqual(len(plans[0].splitlines()), len(packed))
+
+    def test_folder_packing_plan_is_replayed_only_with_plan_packing(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 6)
+            (root / "input" / PLAN_FILE).write_text(
+                "".join(
+                    json.dumps({"input_ids": [f"chunk-{index:04d}"], "estimated_tokens": 2})
+                    + "\n"
+                    for index in range(6)
+                ),
+                encoding="utf-8",
+            )
+            packed = dry_run(root / "input", root / "packed", max_inputs_per_request=4)
+            replayed = dry_run(root / "input", root / "replayed", packing="plan")
+            with self.assertRaisesRegex(ValueError, "packing_plan_path requires packing plan"):
+                dry_run(
+                    root / "input",
+                    root / "mixed",
+                    packing_plan_path=root / "input" / PLAN_FILE,
+                )
+            packed_root = root_span(root / "packed")["attributes"]
+
+        self.assertEqual(len(packed), 2)
+        self.assertEqual(len(replayed), 6)
+        self.assertFalse(packed_root["embedding.packing_plan_replayed"])
+
+    def test_failed_packed_requests_are_bisected_to_unprocessable_inputs(self) -> None:
+        class ContextLengthError(Exception):
+            status_code = 400
+            code = "context_length_exceeded"
+
+        bad_texts = {"text 5", "text 13"}
+        calls = []
+
+        def reject_bad_inputs(body: dict, model: str) -> dict:
+            calls.append(body)
+            if bad_texts.intersection(body[REQUEST.input]):
+                raise ContextLengthError("input too long")
+            return dry_run_response(body, model)
+
+        for engine in DispatchEngine:
+            calls.clear()
+            with self.subTest(engine=engine), TemporaryDirectory() as temporary_directory:
+                root = Path(temporary_directory)
+                write_inputs(root / "input", 16)
+                with patch(
+                    "component.embed.dry_run_response",
+                    side_effect=reject_bad_inputs,
+                ), patch.object(
+                    TokenBucketLimiter,
+                    "reserve",
+                    autospec=True,
+                    return_value=0.0,
+                ) as reserve, self.assertRaises(ContextLengthError):
+                    dry_run(
+                        root / "input",
+                        root / "output",
+                        max_inputs_per_request=8,
+                        request_concurrency=4,
+                        engine=engine,
+                    )
+                records = [
+                    json.loads(line)
+                    for line in (root / "output" / FILES.embeddings).read_text().splitlines()
+                ]
+                unprocessable = [
+                    json.loads(line)
+                    for line in (root / "output" / FILES.unprocessable_inputs)
+                    .read_text()
+                    .splitlines()
+                ]
+                attributes = root_span(root / "output")["attributes"]
+
+                successes = [record for record in records if RESPONSE.data in record]
+                errors = [record for record in records if RESPONSE.error in record]
+                self.assertEqual(
+                    output_ids(successes),
+                    [f"chunk-{index:04d}" for index in range(16) if index not in (5, 13)],
+                )
+                self.assertEqual(
+                    [record[REQUEST.input_ids] for record in errors],
+                    [["chunk-0005"], ["chunk-0013"]],
+                )
+                self.assertEqual(
+                    [entry[REQUEST.input_id] for entry in unprocessable],
+                    ["chunk-0005", "chunk-0013"],
+                )
+                self.assertEqual(attributes["embedding.unprocessable_input_count"], 2)
+                self.assertEqual(attributes["embedding.failed_count"], 2)
+                self.assertEqual(root_span(root / "output")["status"], "ERROR")
+                self.assertEqual(reserve.call_count, len(calls))
+
+    def test_run_fails_when_every_packed_input_is_unprocessable(self) -> None:
+        class ContextLengthError(Exception):
+            status_code = 400
+            code = "context_length_exceeded"
+
+        def reject_every_input(body: dict, model: str) -> dict:
+            raise ContextLengthError("input too long")
+
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 4)
+            with patch(
+                "component.embed.dry_run_response",
+                side_effect=reject_every_input,
+            ), self.assertRaises(ContextLengthError):
+                dry_run(root / "input", root / "output", max_inputs_per_request=4)
+            span = root_span(root / "output")
+            unprocessable = (
+                (root / "output" / FILES.unprocessable_inputs).read_text().splitlines()
+            )
+
+        self.assertEqual(span["status"], "ERROR")
+        self.assertEqual(span["attributes"]["embedding.failed_count"], 4)
+        self.assertEqual(len(unprocessable), 4)
+
+    def test_errors_that_splitting_cannot_fix_are_not_bisected(self) -> None:
+        class InvalidParameterError(Exception):
+            status_code = 400
+            code = None
+
+        calls = []
+
+        def reject_every_request(body: dict, model: str) -> dict:
+            calls.append(body)
+            raise InvalidParameterError("dimensions is not supported by this model")
+
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 16)
+            with patch(
+                "component.embed.dry_run_response",
+                side_effect=reject_every_request,
+            ), self.assertRaises(InvalidParameterError):
+                dry_run(root / "input", root / "output", max_inputs_per_request=8)
+            records = [
+                json.loads(line)
+                for line in (root / "output" / FILES.embeddings).read_text().splitlines()
+            ]
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual([len(record[REQUEST.input_ids]) for record in records], [8, 8])
+        self.assertTrue(all(RESPONSE.error in record for record in records))
+
+    def test_async_engine_matches_thread_engine(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 50)
+            outputs = {}
+            request_span_counts = {}
+            for engine in DispatchEngine:
+                for execution in ExecutionMode:
+                    output_dir = root / f"{engine}-{execution}"
+                    outputs[engine, execution] = dry_run(
+                        root / "input",
+                        output_dir,
+                        max_inputs_per_request=4,
+                        request_concurrency=(
+                            2_000 if engine == DispatchEngine.ASYNC else 8
+                        ),
+                        execution=execution,
+                        engine=engine,
+                    )
+                    request_span_counts[engine, execution] = sum(
+                        json.loads(line)["name"] == "embeddings.create"
+                        for line in (output_dir / FILES.trace).read_text().splitlines()
+                    )
+            attributes = root_span(root / "async-streaming")["attributes"]
+            with self.assertRaisesRegex(ValueError, "between 1 and 100 for the thread"):
+                dry_run(root / "input", root / "thread", request_concurrency=2_000)
+
+        expected = outputs[DispatchEngine.THREAD, ExecutionMode.BUFFERED]
+        self.assertEqual(output_ids(expected), [f"chunk-{index:04d}" for index in range(50)])
+        for key, records in outputs.items():
+            with self.subTest(key=key):
+                self.assertEqual(records, expected)
+                self.assertEqual(request_span_counts[key], 13)
+        self.assertEqual(attributes["embedding.engine"], "async")
+
+    def test_async_engine_bounds_tasks_in_buffered_execution(self) -> None:
+        windows = []
+
+        def recording_results(execute, items, max_in_flight=None):
+            windows.append(max_in_flight)
+            return ordered_async_results(execute, items, max_in_flight)
+
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 10)
+            with patch(
+                "component.embed.ordered_async_results",
+                side_effect=recording_results,
+            ):
+                records = dry_run(
+                    root / "input",
+                    root / "output",
+                    max_inputs_per_request=1,
+                    request_concurrency=2,
+                    engine="async",
+                )
+            attributes = root_span(root / "output")["attributes"]
+
+        self.assertEqual(output_ids(records), [f"chunk-{index:04d}" for index in range(10)])
+        self.assertEqual(windows, [4])
+        self.assertEqual(attributes["embedding.max_in_flight_requests"], 4)
+
+    def test_aimd_concurrency_backs_off_on_throttled_responses(self) -> None:
+        class RateLimitError(Exception):
+            status_code = 429
+
+        calls = []
+
+        def throttle_every_tenth_call(body: dict, model: str) -> dict:
+            calls.append(body)
+            if len(calls) % 10 == 0:
+                raise RateLimitError("rate limited")
+            return dry_run_response(body, model)
+
+        for engine in DispatchEngine:
+            calls.clear()
+            with self.subTest(engine=engine), TemporaryDirectory() as temporary_directory:
+                root = Path(temporary_directory)
+                write_inputs(root / "input", 60)
+                with patch(
+                    "component.embed.dry_run_response",
+                    side_effect=throttle_every_tenth_call,
+                ), self.assertRaises(RateLimitError):
+                    dry_run(
+                        root / "input",
+                        root / "output",
+                        max_inputs_per_request=1,
+                        request_concurrency=8,
+                        engine=engine,
+                        concurrency_control="aimd",
+                        min_request_concurrency=2,
+                    )
+                records = [
+                    json.loads(line)
+                    for line in (root / "output" / FILES.embeddings).read_text().splitlines()
+                ]
+                spans = [
+                    json.loads(line)
+                    for line in (root / "output" / FILES.trace).read_text().splitlines()
+                ]
+                attributes = root_span(root / "output")["attributes"]
+                limits = attributes["embedding.concurrency_limits"]
+
+                self.assertEqual(len(records), 60)
+                self.assertEqual(sum(RESPONSE.error in record for record in records), 6)
+                self.assertEqual(limits[0], 2)
+                self.assertEqual(max(limits), 8)
+                self.assertTrue(all(2 <= limit <= 8 for limit in limits))
+                self.assertTrue(
+                    any(later < earlier for earlier, later in zip(limits, limits[1:]))
+                )
+                self.assertEqual(
+                    len(attributes["embedding.concurrency_limit_offsets_ms"]),
+                    len(limits),
+                )
+                self.assertTrue(
+                    all(
+                        2 <= span["attributes"]["batch.concurrency_limit"] <= 8
+                        for span in spans
+                        if span["name"] == "embeddings.create"
+                    )
+                )
+
+    def test_header_pacing_holds_requests_until_the_reported_reset(self) -> None:
+        def exhausted_gate() -> RateLimitHeaderGate:
+            gate = RateLimitHeaderGate()
+            gate.observe(
+                {
+                    "x-ratelimit-remaining-requests": "2",
+                    "x-ratelimit-limit-requests": "2",
+                    "x-ratelimit-reset-requests": "20ms",
+                }
+            )
+            return gate
+
+        for engine in DispatchEngine:
+            with self.subTest(engine=engine), TemporaryDirectory() as temporary_directory:
+                root = Path(temporary_directory)
+                write_inputs(root / "input", 6)
+                with patch("component.embed.RateLimitHeaderGate", side_effect=exhausted_gate):
+                    records = dry_run(
+                        root / "input",
+                        root / "output",
+                        max_inputs_per_request=1,
+                        token_counting="estimate",
+                        engine=engine,
+                        pacing="headers",
+                    )
+                attributes = root_span(root / "output")["attributes"]
+
+                self.assertEqual(len(records), 6)
+                self.assertEqual(attributes["embedding.pacing"], "headers")
+                self.assertEqual(attributes["embedding.rate_limit_gated_requests"], 1)
+                self.assertGreater(attributes["embedding.rate_limit_gated_ms"], 0)
+                self.assertEqual(attributes["metric.rate_limit_gated_requests"], 1.0)
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 1)
+            with self.assertRaisesRegex(ValueError, "pacing must be one of"):
+                dry_run(root / "input", root / "output", pacing="server")
+
+    def test_completion_order_writes_past_a_slow_first_request(self) -> None:
+        def slow_first_request(body: dict, model: str) -> dict:
+            if body[REQUEST.input] == ["text 0"]:
+                time.sleep(0.2)
+            return dry_run_response(body, model)
+
+        outputs = {}
+        for output_order in ("submission", "completion"):
+            with TemporaryDirectory() as temporary_directory:
+                root = Path(temporary_directory)
+                write_inputs(root / "input", 20)
+                with patch(
+                    "component.embed.dry_run_response",
+                    side_effect=slow_first_request,
+                ):
+                    records = dry_run(
+                        root / "input",
+                        root / "output",
+                        max_inputs_per_request=1,
+                        request_concurrency=4,
+                        output_order=output_order,
+                    )
+                outputs[output_order] = records, root_span(root / "output")["attributes"]
+
+        ordered, ordered_attributes = outputs["submission"]
+        unordered, unordered_attributes = outputs["completion"]
+        self.assertEqual(output_ids(ordered), [f"chunk-{index:04d}" for index in range(20)])
+        self.assertEqual(sorted(output_ids(unordered)), output_ids(ordered))
+        self.assertNotEqual(output_ids(unordered)[0], "chunk-0000")
+        self.assertEqual(unordered_attributes["embedding.output_order"], "completion")
+        self.assertGreaterEqual(ordered_attributes["embedding.first_output_offset_ms"], 200)
+        self.assertLess(
+            unordered_attributes["embedding.first_output_offset_ms"],
+            ordered_attributes["embedding.first_output_offset_ms"],
+        )
+
+    def test_reorder_buffer_bounds_requests_sent_past_a_slow_one(self) -> None:
+        calls = []
+        sent_before_first_completed = []
+
+        def slow_first_request(body: dict, model: str) -> dict:
+            calls.append(body)
+            if body[REQUEST.input] == ["text 0"]:
+                time.sleep(0.2)
+                sent_before_first_completed.append(len(calls))
+            return dry_run_response(body, model)
+
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 20)
+            with patch("component.embed.dry_run_response", side_effect=slow_first_request):
+                records = dry_run(
+                    root / "input",
+                    root / "output",
+                    max_inputs_per_request=1,
+                    request_concurrency=2,
+                    reorder_buffer_size=3,
+                )
+            attributes = root_span(root / "output")["attributes"]
+            with self.assertRaisesRegex(ValueError, "requires submission output_order"):
+                dry_run(
+                    root / "input",
+                    root / "rejected",
+                    output_order="completion",
+                    reorder_buffer_size=3,
+                )
+            with self.assertRaisesRegex(
+                ValueError,
+                "reorder_buffer_size 3 is below request_concurrency 4",
+            ):
+                dry_run(
+                    root / "input",
+                    root / "rejected",
+                    request_concurrency=4,
+                    reorder_buffer_size=3,
+                )
+            dry_run(
+                root / "input",
+                root / "streaming",
+                request_concurrency=2,
+                execution="streaming",
+                max_in_flight_requests=3,
+                reorder_buffer_size=8,
+            )
+            streaming_attributes = root_span(root / "streaming")["attributes"]
+
+        self.assertEqual(output_ids(records), [f"chunk-{index:04d}" for index in range(20)])
+        self.assertEqual(sent_before_first_completed, [3])
+        self.assertEqual(attributes["embedding.reorder_buffer_size"], 3)
+        self.assertEqual(streaming_attributes["embedding.reorder_buffer_size"], 3)
+
+    def test_completed_async_results_yields_in_completion_order(self) -> None:
+        async def delayed(item: int) -> int:
+            await asyncio.sleep(0.01 * (3 - item))
+            return item * 10
+
+        async def collect(max_in_flight: int | None) -> list:
+            return [
+                pair
+                async for pair in completed_async_results(delayed, range(3), max_in_flight)
+            ]
+
+        self.assertEqual(asyncio.run(collect(None)), [(2, 20), (1, 10), (0, 0)])
+        self.assertEqual(asyncio.run(collect(2)), [(1, 10), (0, 0), (2, 20)])
+
+    def test_invalid_execution_mode_is_rejected(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 1)
+            with self.assertRaisesRegex(ValueError, "execution must be one of"):
+                dry_run(root / "input", root / "output", execution="eager")
+
+
+class IngestionTests(unittest.TestCase):
+    def test_parallel_ingestion_preserves_file_order_and_counts(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            for shard in range(4):
+                write_inputs(root, 10, f"shard-{shard}.jsonl", start=shard * 10)
+            sequential = list(read_requests(root, MODEL))
+            stats = IngestStats()
+            parallel = list(read_requests(root, MODEL, ingest_workers=3, stats=stats))
+
+        self.assertEqual(parallel, sequential)
+        self.assertEqual(stats.file_count, 4)
+        self.assertEqual(stats.row_count, 40)
+        self.assertGreater(stats.byte_count, 0)
+        self.assertGreater(stats.worker_parse_seconds, 0)
+
+    def test_duplicate_across_worker_files_reports_same_source(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root, 5, "shard-0.jsonl")
+            write_inputs(root, 5, "shard-1.jsonl", start=3)
+            for workers in (0, 2):
+                with self.subTest(workers=workers):
+                    with self.assertRaisesRegex(
+                        ValueError,
+                        "shard-1.jsonl:1: duplicate batch input_id 'chunk-0003'",
+                    ):
+                        list(read_requests(root, MODEL, ingest_workers=workers))
+
+    def test_duplicate_before_invalid_json_in_a_worker_file_is_reported_first(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root, 5, "shard-0.jsonl")
+            write_inputs(root, 2, "shard-1.jsonl", start=4)
+            with (root / "shard-1.jsonl").open("a", encoding="utf-8") as stream:
+                stream.write("{not json\n")
+            for workers in (0, 2):
+                with self.subTest(workers=workers):
+                    with self.assertRaisesRegex(
+                        ValueError,
+                        "shard-1.jsonl:1: duplicate batch input_id 'chunk-0004'",
+                    ):
+                        list(read_requests(root, MODEL, ingest_workers=workers))
+
+    def test_parallel_mapped_ingestion_matches_sequential(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root, 3, "shard-0.jsonl")
+            with (root / "shard-1.jsonl").open("w", encoding="utf-8") as stream:
+                stream.write(
+                    json.dumps(
+                        {
+                            REQUEST.input_id: ["array-0", "array-1"],
+                            REQUEST.input: ["first", "second"],
+                            REQUEST.model: MODEL,
+                            REQUEST.dimensions: 256,
+                        }
+                    )
+                    + "\n"
+                )
+            requests = {
+                workers: list(
+                    read_requests(
+                        root,
+                        MODEL,
+                        ingest_workers=workers,
+                        reader=RecordReader(root, input_files(root), root / f"index-{workers}"),
+                    )
+                )
+                for workers in (0, 2)
+            }
+
+        self.assertEqual(requests[2], requests[0])
+        self.assertEqual(requests[2][-1][REQUEST.body][REQUEST.dimensions], 256)
+
+    def test_worker_stops_a_file_past_the_batch_input_limit(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root, 10)
+            parsed = parse_request_file(
+                InputFile(0, root / "inputs.jsonl"),
+                RequestValidator(MODEL),
+                max_inputs=3,
+            )
+
+        self.assertEqual([row[0] for row in parsed.rows], [1, 2, 3, 4])
+        self.assertIsNone(parsed.error)
+
+
+class InputManifestTests(unittest.TestCase):
+    def test_manifest_replaces_directory_walk(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input" / "b", 2, "part.jsonl")
+            write_inputs(root / "input", 2, "a.jsonl", start=2)
+            write_manifest(
+                root / "input",
+                [
+                    manifest_entry(root / "input", root / "input" / "b" / "part.jsonl", 2),
+                    manifest_entry(root / "input", root / "input" / "a.jsonl", 2),
+                ],
+            )
+            write_inputs(root / "input", 2, "late.jsonl", start=4)
+            manifest = read_manifest(root / "input")
+            listed = input_files(root / "input")
+            records = dry_run(root / "input", root / "output")
+            manifest_used = root_span(root / "output")["attributes"][
+                "embedding.input_manifest"
+            ]
+
+        self.assertEqual([entry.path for entry in manifest], ["a.jsonl", "b/part.jsonl"])
+        self.assertEqual([entry.records for entry in manifest], [2, 2])
+        self.assertEqual(
+            listed,
+            [root / "input" / "a.jsonl", root / "input" / "b" / "part.jsonl"],
+        )
+        self.assertEqual(
+            output_ids(records),
+            ["chunk-0002", "chunk-0003", "chunk-0000", "chunk-0001"],
+        )
+        self.assertTrue(manifest_used)
+
+    def test_split_writes_shard_manifests(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 3, "a.jsonl")
+            write_inputs(root / "input", 2, "b.jsonl", start=3)
+            shard_dirs = [root / f"shard-{index}" for index in range(3)]
+            split(root / "input", shard_dirs, MODEL, shard_count=2)
+            manifests = [read_manifest(shard_dir) for shard_dir in shard_dirs]
+
+        self.assertEqual(
+            [[(entry.path, entry.records) for entry in manifest] for manifest in manifests],
+            [[("a.jsonl", 3)], [("b.jsonl", 2)], []],
+        )
+
+    def test_unsupported_manifest_version_fails(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            (root / MANIFEST_FILE).write_text('{"version":99,"files":[]}')
+            with self.assertRaisesRegex(ValueError, "unsupported manifest version 99"):
+                input_files(root)
+
+
+class TokenProfileTests(unittest.TestCase):
+    def test_profile_is_ignored_when_inputs_or_encoding_change(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root, 2, "a.jsonl")
+            write_inputs(root, 2, "b.jsonl", start=2)
+            paths = input_files(root)
+            write_token_profile(
+                root,
+                TokenProfile(
+                    encoding="cl100k_base",
+                    sources=profile_sources(root, paths),
+                    tokens=TokenCounts.from_items(
+                        (f"chunk-{index:04d}", index + 1) for index in range(4)
+                    ),
+                ),
+            )
+            current = read_token_profile(root, "cl100k_base", paths)
+            subset = read_token_profile(root, "cl100k_base", paths[1:])
+            other_encoding = read_token_profile(root, "o200k_base", paths)
+            write_inputs(root, 3, "b.jsonl", start=2)
+            changed = read_token_profile(root, "cl100k_base", paths)
+
+        self.assertEqual(current.total_tokens, 10)
+        self.assertEqual(current.histogram(), {1: 1, 2: 1, 4: 2})
+        self.assertIsNotNone(subset)
+        self.assertIsNone(other_encoding)
+        self.assertIsNone(changed)
+
+    def test_profile_staleness_uses_manifest_checksums_or_modification_times(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root, 2, "a.jsonl")
+            path = root / "a.jsonl"
+            write_token_profile(
+                root,
+                TokenProfile(
+                    encoding="cl100k_base",
+                    sources=profile_sources(root, [path]),
+                    tokens=TokenCounts.from_items([("chunk-0000", 1), ("chunk-0001", 2)]),
+                ),
+            )
+            os.utime(path, ns=(0, 0))
+            touched = read_token_profile(root, "cl100k_base", [path])
+            write_manifest(root, [manifest_entry(root, path, 2)])
+            touched_with_manifest = read_token_profile(root, "cl100k_base", [path])
+            path.write_text(path.read_text().replace("text 1", "text 9"))
+            write_manifest(root, [manifest_entry(root, path, 2)])
+            rewritten_with_manifest = read_token_profile(root, "cl100k_base", [path])
+
+        self.assertIsNone(touched)
+        self.assertEqual(touched_with_manifest.tokens.get("chunk-0001"), 2)
+        self.assertIsNone(rewritten_with_manifest)
+
+    def test_colliding_digests_are_left_for_the_tokenizer(self) -> None:
+        with patch("utils.token_profile.input_id_digest", side_effect=[7, 7, 3, 7, 3]):
+            counts = TokenCounts.from_items([("alpha", 1), ("beta", 2), ("gamma", 3)])
+            lookups = [counts.get("alpha"), counts.get("gamma")]
+
+        self.assertEqual(len(counts), 1)
+        self.assertEqual(counts.nbytes, 12)
+        self.assertEqual(lookups, [None, 3])
+
+    def test_shards_read_the_profile_of_the_original_inputs(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 3, "a.jsonl")
+            write_inputs(root / "input", 2, "b.jsonl", start=3)
+            write_token_profile(
+                root / "input",
+                TokenProfile(
+                    encoding="cl100k_base",
+                    sources=profile_sources(root / "input", input_files(root / "input")),
+                    tokens=TokenCounts.from_items([]),
+                ),
+            )
+            shard_dirs = [root / f"shard-{index}" for index in range(2)]
+            split(root / "input", shard_dirs, MODEL, shard_count=2)
+            shard_profiles = [
+                read_token_profile(
+                    root / "input",
+                    "cl100k_base",
+                    input_files(root / "input", shard_dir),
+                )
+                for shard_dir in shard_dirs
+            ]
+
+        self.assertTrue(all(profile is not None for profile in shard_profiles))
+
+
+class InputIdIndexTests(unittest.TestCase):
+    def test_digest_collisions_fall_back_to_exact_ids(self) -> None:
+        rows = {1: ["alpha"], 2: ["beta"]}
+        index = InputIdIndex(rows.__getitem__, digest=lambda _: 42)
+
+        self.assertTrue(index.add("alpha", 1))
+        self.assertTrue(index.add("beta", 2))
+        self.assertFalse(index.add("alpha", 3))
+        self.assertFalse(index.add("beta", 4))
+        self.assertEqual(len(index), 2)
+
+    def test_table_grows_and_keeps_every_id(self) -> None:
+        index = InputIdIndex(lambda location: [f"id-{location}"], capacity=4)
+        for number in range(5_000):
+            self.assertTrue(index.add(f"id-{number}", number))
+        self.assertFalse(index.add("id-4999", 5_000))
+        self.assertEqual(len(index), 5_000)
+        self.assertLess(index.nbytes, 5_000 * 32)
+
+    def test_batch_limit_is_configurable(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root, 12)
+            with self.assertRaisesRegex(ValueError, "batch exceeds the 10 embedding"):
+                list(read_requests(root, MODEL, max_batch_inputs=10))
+            self.assertEqual(len(list(read_requests(root, MODEL, max_batch_inputs=0))), 12)
+
+
+class RecordIndexTests(unittest.TestCase):
+    def test_mapped_storage_matches_memory_output(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 9, "a.jsonl")
+            with (root / "input" / "a.jsonl").open("a", encoding="utf-8") as stream:
+                stream.write("\n")
+                stream.write(
+                    json.dumps(
+                        {
+                            REQUEST.input_id: ["array-0", "array-1", "array-2"],
+                            REQUEST.input: ["first", "second", "third"],
+                            REQUEST.model: MODEL,
+                        }
+                    )
+                    + "\n"
+                )
+            write_inputs(root / "input", 6, "b.jsonl", start=9)
+            memory = dry_run(root / "input", root / "memory", max_inputs_per_request=4)
+            with patch("utils.record_index.tempfile.gettempdir", return_value=str(root)):
+                mapped = dry_run(
+                    root / "input",
+                    root / "mapped",
+                    max_inputs_per_request=4,
+                    input_storage=InputStorage.MAPPED,
+                )
+                sidecars = sorted(
+                    path.name for path in default_index_dir(root / "input").iterdir()
+                )
+            outputs = sorted(path.name for path in (root / "mapped").iterdir())
+            attributes = root_span(root / "mapped")["attributes"]
+
+        self.assertEqual(mapped, memory)
+        self.assertEqual(len(output_ids(mapped)), 18)
+        self.assertEqual(sidecars, ["a.jsonl.offsets", "b.jsonl.offsets"])
+        self.assertEqual(
+            outputs,
+            [FILES.embeddings, FILES.packing_plan, FILES.trace],
+        )
+        self.assertEqual(attributes["embedding.input_storage"], "mmap")
+
+    def test_mapped_reader_is_closed_when_ingestion_fails(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 4)
+            with (root / "input" / "inputs.jsonl").open("a", encoding="utf-8") as stream:
+                stream.write("{not json\n")
+            with patch(
+                "utils.record_index.tempfile.gettempdir",
+                return_value=str(root),
+            ), patch.object(
+                RecordReader,
+                "close",
+                autospec=True,
+                side_effect=RecordReader.close,
+            ) as close, self.assertRaisesRegex(ValueError, "inputs.jsonl:5"):
+                dry_run(root / "input", root / "output", input_storage="mmap")
+
+        close.assert_called_once()
+
+    def test_references_resolve_to_source_texts(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 5)
+            reader = RecordReader(root / "input", input_files(root / "input"), root / "index")
+            requests = list(read_requests(root / "input", MODEL, reader=reader))
+            texts = [reader.materialize(request[REQUEST.body][REQUEST.input]) for request in requests]
+            third_line = reader.line(0, 3)
+            reader.close()
+
+        self.assertIsInstance(requests[0][REQUEST.texts][0], RecordText)
+        self.assertEqual(texts, [f"text {index}" for index in range(5)])
+        self.assertEqual(json.loads(third_line)[REQUEST.input_id], "chunk-0002")
+
+    def test_sidecar_is_rebuilt_when_file_changes(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root, 3)
+            path = root / "inputs.jsonl"
+            sidecar = sidecar_path(path, root, None)
+            reader = RecordReader(root, [path])
+            self.assertEqual(len(reader.offsets(0)), 4)
+            reader.close()
+            self.assertIsNotNone(read_line_offsets(path, sidecar))
+            write_inputs(root, 4)
+            stale = read_line_offsets(path, sidecar)
+            reader = RecordReader(root, [path])
+            rebuilt = reader.offsets(0)
+            reader.close()
+
+        self.assertIsNone(stale)
+        self.assertEqual(len(rebuilt), 5)
+
+    def test_mapped_errors_keep_file_and_line(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 5, "shard-0.jsonl")
+            write_inputs(root / "input", 5, "shard-1.jsonl", start=3)
+            reader = RecordReader(root / "input", input_files(root / "input"), root / "index")
+            with self.assertRaisesRegex(
+                ValueError,
+                "shard-1.jsonl:1: duplicate batch input_id 'chunk-0003'",
+            ):
+                list(read_requests(root / "input", MODEL, ingest_workers=2, reader=reader))
+            reader.close()
+
+
+class RequestValidatorTests(unittest.TestCase):
+    def test_fast_path_matches_full_validation(self) -> None:
+        validator = RequestValidator(MODEL)
+        row = {REQUEST.input_id: "chunk-1", REQUEST.input: "text", REQUEST.model: MODEL}
+
+        self.assertEqual(validator(row, "a.jsonl:1"), validator.validate(row, "a.jsonl:1"))
+
+    def test_rejected_rows_report_full_validation_errors(self) -> None:
+        validator = RequestValidator(MODEL)
+        rows = {
+            "each line must be a JSON object": ["text"],
+            "unsupported fields: extra": {
+                REQUEST.input_id: "chunk-1",
+                REQUEST.input: "text",
+                "extra": 1,
+            },
+            "model must match": {
+                REQUEST.input_id: "chunk-1",
+                REQUEST.input: "text",
+                REQUEST.model: "other",
+            },
+            "input must not be empty": {
+                REQUEST.input_id: "chunk-1",
+                REQUEST.input: "",
+                REQUEST.model: MODEL,
+            },
+            "input_id must be a non-empty string": {
+                REQUEST.input_id: 7,
+                REQUEST.input: "text",
+                REQUEST.model: MODEL,
+            },
+            "input must contain only non-empty strings": {
+                REQUEST.input_id: ["a", "b"],
+                REQUEST.input: ["text", ""],
+                REQUEST.model: MODEL,
+            },
+            "input_id values must be unique": {
+                REQUEST.input_id: ["a", "a"],
+                REQUEST.input: ["text", "more"],
+                REQUEST.model: MODEL,
+            },
+        }
+        for message, row in rows.items():
+            with self.subTest(message=message):
+                with self.assertRaisesRegex(ValueError, f"^a.jsonl:3: {message}"):
+                    validator(row, "a.jsonl:3")
+
+
+class ColumnarInputTests(unittest.TestCase):
+    def write_table(self, path: Path, columns: dict[str, list]) -> None:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+
+        table = pyarrow.table(columns)
+        if path.suffix == ".parquet":
+            pyarrow.parquet.write_table(table, path, row_group_size=3)
+        else:
+            with pyarrow.ipc.new_file(path, table.schema) as writer:
+                writer.write_table(table, max_chunksize=3)
+
+    def test_mapped_columns_match_jsonl_requests(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "jsonl", 8)
+            (root / "parquet").mkdir()
+            self.write_table(
+                root / "parquet" / "a.parquet",
+                {
+                    "chunk_id": [f"chunk-{index:04d}" for index in range(5)],
+                    "text": [f"text {index}" for index in range(5)],
+                    "page": list(range(5)),
+                },
+            )
+            self.write_table(
+                root / "parquet" / "b.arrow",
+                {
+                    "chunk_id": [f"chunk-{index:04d}" for index in range(5, 8)],
+                    "text": [f"text {index}" for index in range(5, 8)],
+                    REQUEST.model: [MODEL] * 3,
+                },
+            )
+            expected = list(read_requests(root / "jsonl", MODEL))
+            columns = {REQUEST.input_id: "chunk_id", REQUEST.input: "text"}
+            stats = IngestStats()
+            actual = list(read_requests(root / "parquet", MODEL, stats=stats, columns=columns))
+            parallel = list(
+                read_requests(root / "parquet", MODEL, ingest_workers=2, columns=columns)
+            )
+
+        self.assertEqual(actual, expected)
+        self.assertEqual(parallel, expected)
+        self.assertEqual(stats.row_count, 8)
+
+    def test_row_errors_and_duplicates_name_file_and_row(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            self.write_table(
+                root / "a.parquet",
+                {
+                    REQUEST.input_id: ["a", "b", "c", "d"],
+                    REQUEST.input: ["one", "two", "three", None],
+                },
+            )
+            with self.assertRaisesRegex(
+                ValueError,
+                "a.parquet:4: input must be a non-empty string or array of strings",
+            ):
+                list(read_requests(root, MODEL))
+            self.write_table(
+                root / "a.parquet",
+                {
+                    REQUEST.input_id: ["a", "b", "c", "b"],
+                    REQUEST.input: ["one", "two", "three", "four"],
+                },
+            )
+            with self.assertRaisesRegex(ValueError, "a.parquet:4: duplicate batch input_id 'b'"):
+                list(read_requests(root, MODEL))
+
+    def test_missing_required_column_is_reported(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            self.write_table(root / "a.parquet", {REQUEST.input_id: ["a"], "body": ["one"]})
+            with self.assertRaisesRegex(ValueError, "a.parquet: missing column 'input' for input"):
+                list(read_requests(root, MODEL))
+
+    def test_column_mapping_is_validated(self) -> None:
+        with self.assertRaisesRegex(ValueError, "must use field=column"):
+            parse_column_mapping("input_id", ROW_FIELDS)
+        with self.assertRaisesRegex(ValueError, "field 'text' must be one of"):
+            parse_column_mapping("text=body", ROW_FIELDS)
+        self.assertEqual(
+            parse_column_mapping(" input_id=chunk_id, input=text ", ROW_FIELDS),
+            {REQUEST.input_id: "chunk_id", REQUEST.input: "text"},
+        )
+
+
+class ShardedPipelineTests(unittest.TestCase):
+    def test_split_balances_files_and_checks_ids_across_shards(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 8, "a.jsonl")
+            write_inputs(root / "input", 5, "b.jsonl", start=8)
+            write_inputs(root / "input", 4, "c.jsonl", start=13)
+            shard_dirs = [root / f"shard-{index}" for index in range(3)]
+            loads = split(root / "input", shard_dirs, MODEL, shard_count=2)
+            shard_files = [
+                [path.name for path in input_files(root / "input", shard_dir)]
+                for shard_dir in shard_dirs
+            ]
+            copied = [path.name for path in root.glob("shard-*/*.jsonl")]
+            write_inputs(root / "input", 2, "d.jsonl", start=16)
+            with self.assertRaisesRegex(
+                ValueError,
+                "d.jsonl:1: duplicate batch input_id 'chunk-0016'",
+            ):
+                split(root / "input", shard_dirs, MODEL, shard_count=2)
+
+        self.assertEqual(loads, [8, 9, 0])
+        self.assertEqual(shard_files, [["a.jsonl"], ["b.jsonl", "c.jsonl"], []])
+        self.assertEqual(copied, [])
+
+    def test_token_balance_counts_unprofiled_texts_in_batches(self) -> None:
+        count_batch = Mock(side_effect=lambda texts: [len(text) for text in texts])
+        counter = CachingTokenCounter(
+            Mock(side_effect=AssertionError("texts are counted in batches")),
+            "cl100k_base",
+            count_batch=count_batch,
+        )
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 3, "a.jsonl")
+            write_inputs(root / "input", 2, "b.jsonl", start=3)
+            write_inputs(root / "input", 2, "c.jsonl", start=5)
+            write_token_profile(
+                root / "input",
+                TokenProfile(
+                    encoding="cl100k_base",
+                    sources=profile_sources(root / "input", input_files(root / "input")),
+                    tokens=TokenCounts.from_items(
+                        (f"chunk-{index:04d}", 10) for index in range(3)
+                    ),
+                ),
+            )
+            shard_dirs = [root / f"shard-{index}" for index in range(2)]
+            with patch("component.shard.token_counter_for_model", return_value=counter):
+                with redirect_stdout(StringIO()):
+                    loads = split(
+                        root / "input",
+                        shard_dirs,
+                        MODEL,
+                        shard_count=2,
+                        balance="tokens",
+                        ingest_workers=2,
+                    )
+
+        self.assertEqual(loads, [30, 24])
+        count_batch.assert_called_once_with(["text 3", "text 4", "text 5", "text 6"])
+
+    def test_concurrency_below_shard_count_is_rejected(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 2)
+            with self.assertRaisesRegex(
+                ValueError,
+                "request_concurrency 2 cannot be shared by 3 shards",
+            ):
+                dry_run(
+                    root / "input",
+                    root / "output",
+                    request_concurrency=2,
+                    shard_count=3,
+                )
+
+    def test_sharded_pipeline_defaults_run_every_shard(self) -> None:
+        names = {"small": MODEL}
+        component = create_sharded_pipeline_component(
+            SimpleNamespace(
+                openai_models=names,
+                openai_endpoints=names,
+                openai_deployments=names,
+                token_scopes=names,
+            ),
+            "small",
+            max_shards=3,
+        )
+        defaults = {name: value.default for name, value in component.inputs.items()}
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 3, "a.jsonl")
+            write_inputs(root / "input", 2, "b.jsonl", start=3)
+            shard_dirs = [root / f"shard-{index}" for index in range(3)]
+            split(root / "input", shard_dirs, MODEL, shard_count=defaults["shard_count"])
+            for index, shard_dir in enumerate(shard_dirs):
+                dry_run(
+                    root / "input",
+                    root / f"output-{index}",
+                    shard_files=shard_dir,
+                    max_inputs_per_request=defaults["max_inputs_per_request"],
+                    request_concurrency=defaults["request_concurrency"],
+                    shard_count=defaults["shard_count"],
+                )
+            with redirect_stdout(StringIO()):
+                merge(
+                    [root / f"output-{index}" for index in range(3)],
+                    root / "merged",
+                    shard_count=defaults["shard_count"],
+                )
+            records = [
+                json.loads(line)
+                for line in (root / "merged" / FILES.embeddings).read_text().splitlines()
+            ]
+
+        self.assertEqual(defaults["request_concurrency"], 3)
+        self.assertEqual(output_ids(records), [f"chunk-{index:04d}" for index in range(5)])
+
+    def test_shards_replay_plans_whose_requests_span_files(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 5, "a.jsonl")
+            write_inputs(root / "input", 3, "b.jsonl", start=5)
+            write_inputs(root / "input", 4, "c.jsonl", start=8)
+            packed = dry_run(root / "input", root / "packed", max_inputs_per_request=4)
+            (root / "input" / PLAN_FILE).write_bytes(
+                (root / "packed" / FILES.packing_plan).read_bytes()
+            )
+            shard_dirs = [root / f"shard-{index}" for index in range(2)]
+            with redirect_stdout(StringIO()):
+                loads = split(root / "input", shard_dirs, MODEL, shard_count=2, packing="plan")
+            for index, shard_dir in enumerate(shard_dirs):
+                dry_run(
+                    root / "input",
+                    root / f"output-{index}",
+                    shard_files=shard_dir,
+                    packing="plan",
+                    max_inputs_per_request=4,
+                    request_concurrency=2,
+                    shard_count=2,
+                )
+            with redirect_stdout(StringIO()):
+                merge(
+                    [root / "output-0", root / "output-1"],
+                    root / "merged",
+                    shard_count=2,
+                )
+            merged = [
+                json.loads(line)
+                for line in (root / "merged" / FILES.embeddings).read_text().splitlines()
+            ]
+
+        self.assertEqual(loads, [8, 4])
+        self.assertEqual(
+            sorted(output_ids([record]) for record in merged),
+            sorted(output_ids([record]) for record in packed),
+        )
+
+    def test_empty_shard_writes_no_plan_or_unprocessable_inputs(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 3)
+            shard_dirs = [root / f"shard-{index}" for index in range(2)]
+            with redirect_stdout(StringIO()):
+                split(root / "input", shard_dirs, MODEL, shard_count=1)
+            records = dry_run(root / "input", root / "output", shard_files=shard_dirs[1])
+            outputs = sorted(path.name for path in (root / "output").iterdir())
+
+        self.assertEqual(records, [])
+        self.assertEqual(outputs, [FILES.embeddings, FILES.trace])
+
+    def test_merge_combines_outputs_and_recomputes_metrics(self) -> None:
+        with TemporaryDirectory() as temporary_directory:
+            root = Path(temporary_directory)
+            write_inputs(root / "input", 6, "a.jsonl")
+            write_inputs(root / "input", 6, "b.jsonl", start=6)
+            shard_dirs = [root / f"shard-{index}" for index in range(2)]
+            split(root / "input", shard_dirs, MODEL, shard_count=2)
+            for index, shard_dir in enumerate(shard_dirs):
+                dry_run(
+                    root / "input",
+                    root / f"output-{index}",
+                    shard_files=shard_dir,
+                    max_inputs_per_request=4,
+                    request_concurrency=4,
+                    target_inputs_per_minute=600_000,
+                    shard_count=2,
+                )
+            shard_root = root_span(root / "output-0")["attributes"]
+            with redirect_stdout(StringIO()):
+                metrics = merge(
+                    [root / "output-0", root / "output-1"],
+                    root / "merged",
+                    shard_count=2,
+                    max_inputs_per_request=4,
+                    target_inputs_per_minute=600_000,
+                )
+            records = [
+                json.loads(line)
+                for line in (root / "merged" / FILES.embeddings).read_text().splitlines()
+            ]
+            merged_root = root_span(root / "merged")["attributes"]
+
+        self.assertEqual(shard_root["embedding.request_concurrency"], 2)
+        self.assertEqual(shard_root["embedding.target_inputs_per_minute"], 300_000)
+        self.assertEqual(output_ids(records), [f"chunk-{index:04d}" for index in range(12)])
+        self.assertEqual(metrics["attempted_requests"], 4)
+        self.assertEqual(merged_root["embedding.shard_count"], 2)
+        self.assertEqual(merged_root["embedding.source_line_count"], 12)
+        self.assertEqual(merged_root["embedding.online_request_count"], 4)
+        self.assertEqual(merged_root["embedding.request_concurrency"], 4)
+        self.assertEqual(merged_root["metric.attempted_logical_inputs"], 12)
+
+
+if __name__ == "__main__":
+    unittest.main()
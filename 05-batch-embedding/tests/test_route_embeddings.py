@@ -60,6 +60,7 @@ class RouteLoadingTests(unittest.TestCase):
             route = load_route(root, "packed")
         self.assertEqual(len(route.vectors), 3)
         self.assertEqual(route.batch_sizes, [2, 1])
+        self.assertEqual(route.batches, [("a-repeat-1", "a-repeat-2"), ("b-repeat-1",)])
         self.assertEqual(route.dimensions, {DIM})
         self.assertEqual(route.prompt_tokens, 20)
         self.assertEqual(route.models, {"text-embedding-ada-002"})
@@ -43,8 +43,18 @@ class MetricNames:
     inputs_per_request: str = "inputs_per_request"
     prompt_tokens_per_successful_request: str = "prompt_tokens_per_successful_request"
     token_ceiling_fill_ratio: str = "token_ceiling_fill_ratio"
+    estimated_token_ceiling_fill_ratio: str = "estimated_token_ceiling_fill_ratio"
     item_ceiling_fill_ratio: str = "item_ceiling_fill_ratio"
     estimated_to_actual_token_ratio: str = "estimated_to_actual_token_ratio"
+    token_estimate_error_p95: str = "token_estimate_error_p95"
+    token_estimate_rate: str = "token_estimate_rate"
+    token_estimate_margin: str = "token_estimate_margin"
+    process_start_to_first_request_ms: str = "process_start_to_first_request_ms"
+    token_cache_hits: str = "token_cache_hits"
+    token_cache_misses: str = "token_cache_misses"
+    concurrency_limit: str = "concurrency_limit"
+    rate_limit_gated_requests: str = "rate_limit_gated_requests"
+    rate_limit_gated_seconds: str = "rate_limit_gated_seconds"
 
 
 METRICS = MetricNames()
@@ -53,7 +63,7 @@ _METRIC_PREFIX_PATTERN = re.compile(r"^[A-Za-z][A-Za-z0-9_.-]{0,63}$")
 
 
 class MetricLogger(Protocol):
-    def log_metrics(self, metrics: dict[str, float]) -> None: ...
+    def log_metrics(self, metrics: dict[str, float], step: int | None = None) -> None: ...
 
 
 def percentile(values: list[float], percent: float) -> float:
@@ -73,6 +83,8 @@ def calculate_run_metrics(
     max_tokens_per_request: int = 0,
     target_tpm: int = 0,
     target_inputs_per_minute: float = 0,
+    token_cache_hits: int = 0,
+    token_cache_misses: int = 0,
 ) -> dict[str, float]:
     if not measurements:
         return {
@@ -100,8 +112,12 @@ def calculate_run_metrics(
             METRICS.inputs_per_request: 0.0,
             METRICS.prompt_tokens_per_successful_request: 0.0,
             METRICS.token_ceiling_fill_ratio: 0.0,
+            METRICS.estimated_token_ceiling_fill_ratio: 0.0,
             METRICS.item_ceiling_fill_ratio: 0.0,
             METRICS.estimated_to_actual_token_ratio: 0.0,
+            METRICS.token_estimate_error_p95: 0.0,
+            METRICS.token_cache_hits: float(token_cache_hits),
+            METRICS.token_cache_misses: float(token_cache_misses),
         }
 
     attempted_requests = len(measurements)
@@ -161,6 +177,12 @@ def calculate_run_metrics(
             if successful_requests and max_tokens_per_request
             else 0.0
         ),
+        METRICS.estimated_token_ceiling_fill_ratio: (
+            sum(measurement.estimated_tokens for measurement in measurements)
+            / (attempted_requests * max_tokens_per_request)
+            if max_tokens_per_request
+            else 0.0
+        ),
         METRICS.item_ceiling_fill_ratio: (
             attempted_logical_inputs / (attempted_requests * max_inputs_per_request)
             if max_inputs_per_request
@@ -169,6 +191,17 @@ def calculate_run_metrics(
         METRICS.estimated_to_actual_token_ratio: (
             estimated_tokens / prompt_tokens if prompt_tokens else 0.0
         ),
+        METRICS.token_estimate_error_p95: percentile(
+            [
+                abs(measurement.estimated_tokens - measurement.prompt_tokens)
+                / measurement.prompt_tokens
+                for measurement in successful
+                if measurement.prompt_tokens
+            ],
+            95,
+        ),
+        METRICS.token_cache_hits: float(token_cache_hits),
+        METRICS.token_cache_misses: float(token_cache_misses),
     }
 
 
@@ -200,4 +233,26 @@ def publish_run_metrics(
 
         logger = mlflow
     logger.log_metrics(namespaced_metrics)
-    return namespaced_metrics
\ No newline at end of file
+    return namespaced_metrics
+
+
+def publish_metric_series(
+    name: str,
+    points: list[tuple[int, float]],
+    mode: str,
+    prefix: str = DEFAULT_METRIC_PREFIX,
+    logger: MetricLogger | None = None,
+) -> list[tuple[int, float]]:
+    """Log (step, value) points as one MLflow metric history."""
+    selected_mode = MetricLoggingMode(mode)
+    if selected_mode == MetricLoggingMode.DISABLED or not points:
+        return []
+
+    metric_name = f"{validate_metric_prefix(prefix)}.{name}"
+    if logger is None:
+        import mlflow
+
+        logger = mlflow
+    for step, value in points:
+        logger.log_metrics({metric_name: value}, step=step)
+    return points
@@ -0,0 +1,127 @@
+from collections.abc import Collection, Iterator, Mapping
+from pathlib import Path
+from typing import Any
+
+
+PARQUET_SUFFIXES = (".parquet",)
+ARROW_SUFFIXES = (".arrow", ".feather")
+COLUMNAR_SUFFIXES = PARQUET_SUFFIXES + ARROW_SUFFIXES
+
+
+def is_columnar(path: Path) -> bool:
+    return path.suffix in COLUMNAR_SUFFIXES
+
+
+def parse_column_mapping(value: str, fields: Collection[str]) -> dict[str, str]:
+    """Parse ``field=column`` pairs separated by commas."""
+    mapping: dict[str, str] = {}
+    for pair in filter(None, (item.strip() for item in value.split(","))):
+        field, separator, column = pair.partition("=")
+        field = field.strip()
+        column = column.strip()
+        if not separator or not field or not column:
+            raise ValueError(f"input column mapping {pair!r} must use field=column")
+        if field not in fields:
+            raise ValueError(
+                f"input column mapping field {field!r} must be one of: "
+                f"{', '.join(fields)}"
+            )
+        mapping[field] = column
+    return mapping
+
+
+def _schema_names(path: Path) -> list[str]:
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    if path.suffix in PARQUET_SUFFIXES:
+        return pyarrow.parquet.read_schema(path).names
+    with pyarrow.ipc.open_file(path) as reader:
+        return reader.schema.names
+
+
+def _selected_columns(
+    path: Path,
+    fields: Collection[str],
+    columns: Mapping[str, str],
+    required: Collection[str],
+) -> dict[str, str]:
+    names = set(_schema_names(path))
+    selected = {}
+    for field in fields:
+        column = columns.get(field, field)
+        if column in names:
+            selected[field] = column
+        elif field in required:
+            raise ValueError(f"{path.name}: missing column {column!r} for {field}")
+    return selected
+
+
+def column_batches(
+    path: Path,
+    fields: Collection[str],
+    columns: Mapping[str, str],
+    required: Collection[str],
+    batch_rows: int,
+) -> Iterator[dict[str, list[Any]]]:
+    """Yield mapped columns batch by batch as field-keyed value lists."""
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    selected = _selected_columns(path, fields, columns, required)
+    names = list(selected.values())
+    if path.suffix in PARQUET_SUFFIXES:
+        batches = pyarrow.parquet.ParquetFile(path).iter_batches(
+            batch_size=batch_rows,
+            columns=names,
+        )
+        for batch in batches:
+            yield {
+                field: batch.column(column).to_pylist()
+                for field, column in selected.items()
+            }
+        return
+    with pyarrow.memory_map(str(path)) as source:
+        reader = pyarrow.ipc.open_file(source)
+        for batch_index in range(reader.num_record_batches):
+            batch = reader.get_batch(batch_index)
+            for start in range(0, batch.num_rows, batch_rows):
+                chunk = batch.slice(start, batch_rows)
+                yield {
+                    field: chunk.column(column).to_pylist()
+                    for field, column in selected.items()
+                }
+
+
+def column_value(path: Path, column: str, row_index: int) -> Any:
+    """Read one cell by zero-based row index."""
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    if path.suffix in PARQUET_SUFFIXES:
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        for group in range(parquet_file.num_row_groups):
+            group_rows = parquet_file.metadata.row_group(group).num_rows
+            if row_index < group_rows:
+                values = parquet_file.read_row_group(group, columns=[column])
+                return values.column(column)[row_index].as_py()
+            row_index -= group_rows
+        raise IndexError(f"{path.name}: row {row_index} is out of range")
+    with pyarrow.memory_map(str(path)) as source:
+        table = pyarrow.ipc.open_file(source).read_all()
+        return table.column(column)[row_index].as_py()
+
+
+def columnar_row_count(path: Path) -> int:
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    if path.suffix in PARQUET_SUFFIXES:
+        return pyarrow.parquet.ParquetFile(path).metadata.num_rows
+    with pyarrow.memory_map(str(path)) as source:
+        reader = pyarrow.ipc.open_file(source)
+        return sum(
+            reader.get_batch(batch_index).num_rows
+            for batch_index in range(reader.num_record_batches)
+        )
@@ -1,11 +1,36 @@
-from collections.abc import Callable, Iterable, Iterator
+import asyncio
+import math
+import os
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator, Mapping
 from dataclasses import dataclass
+from pathlib import Path
 from typing import Any
 
 import tiktoken
 
+from utils.packing_plan import PlannedRequest
+from utils.token_cache import DEFAULT_CACHE_ENTRIES, CachingTokenCounter
+from utils.tokenizer_bundle import load_encoding
+
 
 TokenCounter = Callable[[str], int]
+BatchTokenCounter = Callable[[list[Any]], list[int]]
+BINPACK_WINDOW_INPUTS = 4_096
+TOKENIZE_CHUNK_INPUTS = 2_048
+TOKENIZER_THREADS = os.cpu_count() or 1
+DEFAULT_TOKEN_ESTIMATE_RATE = 0.25
+ADAPTIVE_SIZING_WINDOW = 16
+ADAPTIVE_SIZING_STEP = 0.25
+ADAPTIVE_SIZING_TOLERANCE = 0.02
+AIMD_DECREASE_FACTOR = 0.5
+THROTTLE_STATUS_CODES = (429, 503)
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
 
 
 @dataclass(frozen=True)
@@ -41,6 +66,59 @@ class OptimizationPlanFields:
 
 
 PLAN = OptimizationPlanFields()
+PACKED_FIELDS = (
+    REQUEST.input_ids,
+    REQUEST.texts,
+    REQUEST.body,
+    REQUEST.input_count,
+    REQUEST.estimated_tokens,
+)
+
+
+@dataclass(frozen=True, eq=False, slots=True)
+class PackedRequest(Mapping[str, Any]):
+    """One packed request as a slice of its settings group's shared inputs."""
+
+    settings: dict[str, Any]
+    input_id_store: list[str]
+    text_store: list[Any]
+    start: int
+    stop: int
+    estimated_tokens: int = 0
+
+    @property
+    def input_count(self) -> int:
+        return self.stop - self.start
+
+    @property
+    def input_ids(self) -> list[str]:
+        return self.input_id_store[self.start : self.stop]
+
+    @property
+    def texts(self) -> list[Any]:
+        return self.text_store[self.start : self.stop]
+
+    def body(self) -> dict[str, Any]:
+        return {**self.settings, REQUEST.input: self.texts}
+
+    def __getitem__(self, key: str) -> Any:
+        if key == REQUEST.input_ids:
+            return self.input_ids
+        if key == REQUEST.texts:
+            return self.texts
+        if key == REQUEST.body:
+            return self.body()
+        if key == REQUEST.input_count:
+            return self.input_count
+        if key == REQUEST.estimated_tokens:
+            return self.estimated_tokens
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(PACKED_FIELDS)
+
+    def __len__(self) -> int:
+        return len(PACKED_FIELDS)
 
 
 def embedding_request(
@@ -76,13 +154,311 @@ def embedding_request(
     }
 
 
-def token_counter_for_model(model: str) -> TokenCounter:
-    """Create a tokenizer-backed counter for an embedding model."""
+def tokenizer_encoding_name(model: str) -> str:
+    """Name the tiktoken encoding used for a model without loading it."""
     try:
-        encoding = tiktoken.encoding_for_model(model)
+        return tiktoken.encoding_name_for_model(model)
     except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
-    return lambda text: len(encoding.encode(text))
+        return "cl100k_base"
+
+
+def token_counter_for_model(
+    model: str,
+    cache_entries: int = DEFAULT_CACHE_ENTRIES,
+    cache_path: Path | None = None,
+) -> CachingTokenCounter:
+    """Create a cached, tokenizer-backed counter for an embedding model."""
+    encoding_name = tokenizer_encoding_name(model)
+    encoding = load_encoding(encoding_name)
+    return CachingTokenCounter(
+        lambda text: len(encoding.encode_ordinary(text)),
+        encoding_name,
+        cache_entries,
+        cache_path,
+        count_batch=lambda texts: [
+            len(tokens)
+            for tokens in encoding.encode_ordinary_batch(
+                texts,
+                num_threads=TOKENIZER_THREADS,
+            )
+        ],
+    )
+
+
+def request_settings_key(body: Mapping[str, Any]) -> tuple[Any, ...]:
+    """Key the body settings that must match for inputs to share a request."""
+    return (
+        body[REQUEST.model],
+        body.get(REQUEST.dimensions),
+        body.get(REQUEST.encoding_format, "float"),
+        body.get(REQUEST.user),
+    )
+
+
+def first_fit_decreasing(
+    items: list[tuple[str, Any, int]],
+    max_inputs: int,
+    max_tokens: int | None,
+) -> list[tuple[list[tuple[str, Any, int]], int]]:
+    """Place token-counted items, largest first, into the first bin with room."""
+    bins: list[tuple[list[tuple[str, Any, int]], int]] = []
+    for item in sorted(items, key=lambda item: -item[2]):
+        for index, (bin_items, load) in enumerate(bins):
+            if len(bin_items) < max_inputs and (
+                max_tokens is None or load + item[2] <= max_tokens
+            ):
+                bin_items.append(item)
+                bins[index] = (bin_items, load + item[2])
+                break
+        else:
+            bins.append(([item], item[2]))
+    return bins
+
+
+def length_sorted_chunks(
+    items: list[tuple[str, Any, int]],
+    max_inputs: int,
+    max_tokens: int | None,
+) -> list[tuple[list[tuple[str, Any, int]], int]]:
+    """Cut token-counted items, shortest first, into consecutive requests."""
+    chunks: list[tuple[list[tuple[str, Any, int]], int]] = []
+    chunk: list[tuple[str, Any, int]] = []
+    load = 0
+    for item in sorted(items, key=lambda item: item[2]):
+        if chunk and (
+            len(chunk) >= max_inputs
+            or (max_tokens is not None and load + item[2] > max_tokens)
+        ):
+            chunks.append((chunk, load))
+            chunk = []
+            load = 0
+        chunk.append(item)
+        load += item[2]
+    if chunk:
+        chunks.append((chunk, load))
+    return chunks
+
+
+@dataclass(slots=True)
+class _OpenRequest:
+    settings: dict[str, Any]
+    input_ids: list[str]
+    texts: list[Any]
+    token_count: int = 0
+
+    def packed(self) -> PackedRequest:
+        return PackedRequest(
+            self.settings,
+            self.input_ids,
+            self.texts,
+            0,
+            len(self.texts),
+            self.token_count,
+        )
+
+
+def token_estimator(rate: float, margin: float) -> TokenCounter:
+    """Estimate tokens from UTF-8 length at a calibrated rate plus a safety margin."""
+    if rate <= 0:
+        raise ValueError("token estimate rate must be positive")
+    if margin < 0:
+        raise ValueError("token estimate margin must be non-negative")
+    scale = rate * (1 + margin)
+    return lambda text: math.ceil(len(text.encode("utf-8")) * scale)
+
+
+def calibrated_token_estimate_rate(
+    rate: float,
+    margin: float,
+    estimated_to_actual_token_ratio: float,
+) -> float:
+    """Return the rate that would have matched the service's prompt tokens."""
+    if estimated_to_actual_token_ratio <= 0:
+        raise ValueError("estimated_to_actual_token_ratio must be positive")
+    return rate * (1 + margin) / estimated_to_actual_token_ratio
+
+
+class AdaptiveTokenBudget:
+    """Hill-climb the per-request token budget over rolling request windows."""
+
+    def __init__(
+        self,
+        initial_tokens: int,
+        min_tokens: int,
+        max_tokens: int,
+        window: int = ADAPTIVE_SIZING_WINDOW,
+        step: float = ADAPTIVE_SIZING_STEP,
+    ) -> None:
+        if not 1 <= min_tokens <= initial_tokens <= max_tokens:
+            raise ValueError("token budget bounds must satisfy 1 <= min <= initial <= max")
+        if window < 1:
+            raise ValueError("window must be positive")
+        if step <= 0 or step >= 1:
+            raise ValueError("step must be in (0, 1)")
+        self.budget = initial_tokens
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.window = window
+        self.step = step
+        self.history: list[tuple[float | None, int]] = [(None, initial_tokens)]
+        self._direction = 1
+        self._previous: tuple[float, float] | None = None
+        self._samples: list[tuple[float, float, int, int | None]] = []
+        self._lock = threading.Lock()
+
+    def __call__(self) -> int:
+        return self.budget
+
+    def observe(
+        self,
+        started_seconds: float,
+        completed_seconds: float,
+        prompt_tokens: int,
+        status_code: int | None,
+    ) -> None:
+        with self._lock:
+            self._samples.append(
+                (started_seconds, completed_seconds, prompt_tokens, status_code)
+            )
+            if len(self._samples) < self.window:
+                return
+            samples, self._samples = self._samples, []
+            elapsed = max(completed for _, completed, _, _ in samples) - min(
+                started for started, _, _, _ in samples
+            )
+            accepted_tpm = (
+                sum(tokens for _, _, tokens, status in samples if status == 200)
+                * 60
+                / elapsed
+                if elapsed > 0
+                else 0.0
+            )
+            latency_p95 = percentile(
+                [completed - started for started, completed, _, _ in samples],
+                95,
+            )
+            if any(status == 429 for _, _, _, status in samples):
+                self._direction = -1
+            elif self._previous is not None:
+                previous_tpm, previous_latency = self._previous
+                if accepted_tpm < previous_tpm * (1 - ADAPTIVE_SIZING_TOLERANCE) or (
+                    accepted_tpm <= previous_tpm * (1 + ADAPTIVE_SIZING_TOLERANCE)
+                    and latency_p95 > previous_latency
+                ):
+                    self._direction = -self._direction
+            self._previous = (accepted_tpm, latency_p95)
+            budget = min(
+                max(
+                    round(self.budget * (1 + self.step * self._direction)),
+                    self.min_tokens,
+                ),
+                self.max_tokens,
+            )
+            if budget != self.budget:
+                self.budget = budget
+                self.history.append((completed_seconds, budget))
+
+
+class AdaptiveConcurrency:
+    """Limit in-flight requests with additive increase, multiplicative decrease."""
+
+    def __init__(
+        self,
+        min_limit: int,
+        max_limit: int,
+        decrease_factor: float = AIMD_DECREASE_FACTOR,
+        clock: Callable[[], float] = time.perf_counter,
+    ) -> None:
+        if not 1 <= min_limit <= max_limit:
+            raise ValueError("concurrency bounds must satisfy 1 <= min <= max")
+        if decrease_factor <= 0 or decrease_factor >= 1:
+            raise ValueError("decrease_factor must be in (0, 1)")
+        self.limit = min_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self.history: list[tuple[float, int]] = [(clock(), min_limit)]
+        self._clock = clock
+        self._slow_start = True
+        self._successes = 0
+        self._responses = 0
+        self._ignore_throttles_until = 0
+        self._condition = threading.Condition()
+        self._async_waiters: deque[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+
+    def __call__(self) -> int:
+        return self.limit
+
+    def acquire(self) -> None:
+        with self._condition:
+            self._condition.wait_for(
+                lambda: not self._async_waiters and self.in_flight < self.limit
+            )
+            self.in_flight += 1
+
+    async def acquire_async(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._condition:
+            if not self._async_waiters and self.in_flight < self.limit:
+                self.in_flight += 1
+                return
+            granted = loop.create_future()
+            self._async_waiters.append((loop, granted))
+        try:
+            await granted
+        except asyncio.CancelledError:
+            with self._condition:
+                if (loop, granted) in self._async_waiters:
+                    self._async_waiters.remove((loop, granted))
+                else:
+                    self.in_flight -= 1
+                self._wake()
+            raise
+
+    def try_acquire(self) -> bool:
+        with self._condition:
+            if self._async_waiters or self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            self._wake()
+
+    def record(self, status_code: int | None) -> None:
+        with self._condition:
+            self._responses += 1
+            limit = self.limit
+            if status_code in THROTTLE_STATUS_CODES:
+                if self._responses > self._ignore_throttles_until:
+                    self._slow_start = False
+                    self._successes = 0
+                    limit = max(int(self.limit * self.decrease_factor), self.min_limit)
+                    self._ignore_throttles_until = self._responses + self.in_flight
+            elif status_code == 200:
+                self._successes += 1
+                if self._slow_start or self._successes >= self.limit:
+                    self._successes = 0
+                    limit = min(self.limit + 1, self.max_limit)
+            if limit != self.limit:
+                self.limit = limit
+                self.history.append((self._clock(), limit))
+                self._wake()
+
+    def _wake(self) -> None:
+        while self._async_waiters and self.in_flight < self.limit:
+            loop, granted = self._async_waiters.popleft()
+            self.in_flight += 1
+            loop.call_soon_threadsafe(_grant, granted)
+        self._condition.notify_all()
+
+
+def _grant(granted: asyncio.Future) -> None:
+    if not granted.done():
+        granted.set_result(None)
 
 
 def pack_compatible_requests(
@@ -91,6 +467,12 @@ def pack_compatible_requests(
     max_inputs_per_request: int,
     max_tokens_per_request: int | None = None,
     count_tokens: TokenCounter | None = None,
+    token_counts: Mapping[str, int] | None = None,
+    stream: bool = False,
+    binpack_window: int = BINPACK_WINDOW_INPUTS,
+    count_tokens_batch: BatchTokenCounter | None = None,
+    token_budget: Callable[[], int] | None = None,
+    estimated_counts: bool = False,
 ) -> Iterator[dict[str, Any]]:
     """Pack embedding inputs that share the same request settings."""
     if max_inputs_per_request < 1:
@@ -99,79 +481,287 @@ def pack_compatible_requests(
         raise ValueError("max_tokens_per_request must be positive")
     if max_tokens_per_request is not None and count_tokens is None:
         raise ValueError("count_tokens is required with max_tokens_per_request")
+    if token_budget is not None and max_tokens_per_request is None:
+        raise ValueError("token_budget requires max_tokens_per_request")
     if packing == "none":
         yield from requests
         return
-    if packing != "batch":
+    if packing not in ("batch", "binpack", "sorted"):
         raise ValueError(f"Unsupported packing mode: {packing}")
+    if packing == "sorted" and count_tokens is None:
+        raise ValueError("count_tokens is required with sorted packing")
+    if binpack_window < 1:
+        raise ValueError("binpack_window must be positive")
+
+    precounted: dict[str, int] = {}
+
+    def batch_counted(requests: Iterable[dict[str, Any]]) -> Iterator[dict[str, Any]]:
+        # Streaming batch packing starts with one request's worth of inputs and
+        # doubles the chunk, so the first request does not wait for a full chunk.
+        chunk_limit = (
+            min(max_inputs_per_request, TOKENIZE_CHUNK_INPUTS)
+            if stream and packing == "batch"
+            else TOKENIZE_CHUNK_INPUTS
+        )
+        chunk: list[dict[str, Any]] = []
+        chunk_inputs = 0
+        for request in requests:
+            chunk.append(request)
+            chunk_inputs += len(request[REQUEST.input_ids])
+            if chunk_inputs >= chunk_limit:
+                count_chunk(chunk)
+                yield from chunk
+                chunk = []
+                chunk_inputs = 0
+                chunk_limit = min(chunk_limit * 2, TOKENIZE_CHUNK_INPUTS)
+        count_chunk(chunk)
+        yield from chunk
+
+    def count_chunk(chunk: list[dict[str, Any]]) -> None:
+        pending = [
+            (input_id, text)
+            for request in chunk
+            for input_id, text in zip(
+                request[REQUEST.input_ids],
+                request[REQUEST.texts],
+                strict=True,
+            )
+            if token_counts is None or input_id not in token_counts
+        ]
+        if pending:
+            precounted.update(
+                zip(
+                    [input_id for input_id, _ in pending],
+                    count_tokens_batch([text for _, text in pending]),
+                    strict=True,
+                )
+            )
+
+    if count_tokens is not None and count_tokens_batch is not None:
+        requests = batch_counted(requests)
+
+    def input_tokens(input_id: str, text: Any) -> int:
+        text_tokens = token_counts.get(input_id) if token_counts is not None else None
+        if text_tokens is None:
+            text_tokens = precounted.pop(input_id, None)
+        if text_tokens is None:
+            text_tokens = count_tokens(text) if count_tokens else 0
+            if estimated_counts and max_tokens_per_request is not None:
+                text_tokens = min(text_tokens, max_tokens_per_request)
+        if max_tokens_per_request is not None and text_tokens > max_tokens_per_request:
+            raise ValueError(
+                f"One input uses {text_tokens} tokens, exceeding the "
+                f"{max_tokens_per_request}-token request target"
+            )
+        return text_tokens
+
+    def request_token_limit() -> int | None:
+        return token_budget() if token_budget is not None else max_tokens_per_request
+
+    def reaches_limit(input_count: int, token_count: int, text_tokens: int) -> bool:
+        token_limit = request_token_limit()
+        return input_count >= max_inputs_per_request or (
+            token_limit is not None
+            and input_count > 0
+            and token_count + text_tokens > token_limit
+        )
+
+    def settings_without_input(body: Mapping[str, Any]) -> dict[str, Any]:
+        return {field: value for field, value in body.items() if field != REQUEST.input}
+
+    if packing in ("binpack", "sorted"):
+        pack_window = first_fit_decreasing if packing == "binpack" else length_sorted_chunks
+        windows: dict[tuple[Any, ...], tuple[dict[str, Any], list[tuple[str, Any, int]]]] = {}
+
+        def packed_window(
+            settings: dict[str, Any],
+            items: list[tuple[str, Any, int]],
+            final: bool,
+        ) -> Iterator[PackedRequest]:
+            bins = pack_window(items, max_inputs_per_request, request_token_limit())
+            carried = None
+            if not final:
+                carried = min(
+                    range(len(bins)),
+                    key=lambda index: (bins[index][1], len(bins[index][0])),
+                )
+                items[:] = bins[carried][0]
+            else:
+                items.clear()
+            for index, (bin_items, load) in enumerate(bins):
+                if index != carried:
+                    yield PackedRequest(
+                        settings,
+                        [input_id for input_id, _, _ in bin_items],
+                        [text for _, text, _ in bin_items],
+                        0,
+                        len(bin_items),
+                        load,
+                    )
+
+        for request in requests:
+            body = request[REQUEST.body]
+            key = request_settings_key(body)
+            if key not in windows:
+                windows[key] = (settings_without_input(body), [])
+            settings, items = windows[key]
+            for input_id, text in zip(
+                request[REQUEST.input_ids],
+                request[REQUEST.texts],
+                strict=True,
+            ):
+                items.append((input_id, text, input_tokens(input_id, text)))
+                if len(items) >= binpack_window:
+                    yield from packed_window(settings, items, final=False)
+        for settings, items in windows.values():
+            if items:
+                yield from packed_window(settings, items, final=True)
+        return
+
+    if stream:
+        open_requests: dict[tuple[Any, ...], _OpenRequest] = {}
+        for request in requests:
+            body = request[REQUEST.body]
+            key = request_settings_key(body)
+            open_request = open_requests.get(key)
+            if open_request is None:
+                open_request = open_requests[key] = _OpenRequest(
+                    settings_without_input(body), [], []
+                )
+            for input_id, text in zip(
+                request[REQUEST.input_ids],
+                request[REQUEST.texts],
+                strict=True,
+            ):
+                text_tokens = input_tokens(input_id, text)
+                if reaches_limit(
+                    len(open_request.texts),
+                    open_request.token_count,
+                    text_tokens,
+                ):
+                    yield open_request.packed()
+                    open_request = open_requests[key] = _OpenRequest(
+                        open_request.settings, [], []
+                    )
+                open_request.input_ids.append(input_id)
+                open_request.texts.append(text)
+                open_request.token_count += text_tokens
+                if len(open_request.texts) >= max_inputs_per_request:
+                    yield open_request.packed()
+                    open_request = open_requests[key] = _OpenRequest(
+                        open_request.settings, [], []
+                    )
+        for open_request in open_requests.values():
+            if open_request.texts:
+                yield open_request.packed()
+        return
 
     groups: dict[tuple[Any, ...], dict[str, Any]] = {}
     for request in requests:
         body = request[REQUEST.body]
-        key = (
-            body[REQUEST.model],
-            body.get(REQUEST.dimensions),
-            body.get(REQUEST.encoding_format, "float"),
-            body.get(REQUEST.user),
-        )
         group = groups.setdefault(
-            key,
+            request_settings_key(body),
             {
                 REQUEST.input_ids: [],
                 REQUEST.texts: [],
-                REQUEST.body: {
-                    field: value
-                    for field, value in body.items()
-                    if field != REQUEST.input
-                },
+                REQUEST.body: settings_without_input(body),
             },
         )
         group[REQUEST.input_ids].extend(request[REQUEST.input_ids])
         group[REQUEST.texts].extend(request[REQUEST.texts])
 
     for group in groups.values():
-        input_ids: list[str] = []
-        texts: list[str] = []
+        group_input_ids = group[REQUEST.input_ids]
+        group_texts = group[REQUEST.texts]
+        start = 0
         token_count = 0
-        for input_id, text in zip(
-            group[REQUEST.input_ids],
-            group[REQUEST.texts],
-            strict=True,
+        for position, (input_id, text) in enumerate(
+            zip(group_input_ids, group_texts, strict=True)
         ):
-            text_tokens = count_tokens(text) if count_tokens else 0
-            if max_tokens_per_request is not None and text_tokens > max_tokens_per_request:
-                raise ValueError(
-                    f"One input uses {text_tokens} tokens, exceeding the "
-                    f"{max_tokens_per_request}-token request target"
+            text_tokens = input_tokens(input_id, text)
+            if reaches_limit(position - start, token_count, text_tokens):
+                yield PackedRequest(
+                    group[REQUEST.body],
+                    group_input_ids,
+                    group_texts,
+                    start,
+                    position,
+                    token_count,
                 )
-            reaches_input_limit = len(texts) >= max_inputs_per_request
-            reaches_token_limit = (
-                max_tokens_per_request is not None
-                and bool(texts)
-                and token_count + text_tokens > max_tokens_per_request
-            )
-            if reaches_input_limit or reaches_token_limit:
-                yield {
-                    REQUEST.input_ids: input_ids,
-                    REQUEST.texts: texts,
-                    REQUEST.body: {**group[REQUEST.body], REQUEST.input: texts},
-                    REQUEST.input_count: len(texts),
-                    REQUEST.estimated_tokens: token_count,
-                }
-                input_ids = []
-                texts = []
+                start = position
                 token_count = 0
-            input_ids.append(input_id)
-            texts.append(text)
             token_count += text_tokens
-        if texts:
-            yield {
-                REQUEST.input_ids: input_ids,
-                REQUEST.texts: texts,
-                REQUEST.body: {**group[REQUEST.body], REQUEST.input: texts},
-                REQUEST.input_count: len(texts),
-                REQUEST.estimated_tokens: token_count,
+        if len(group_texts) > start:
+            yield PackedRequest(
+                group[REQUEST.body],
+                group_input_ids,
+                group_texts,
+                start,
+                len(group_texts),
+                token_count,
+            )
+
+
+def replay_packing_plan(
+    requests: Iterable[dict[str, Any]],
+    plan: Iterable[PlannedRequest],
+    max_inputs_per_request: int | None = None,
+    max_tokens_per_request: int | None = None,
+) -> Iterator[PackedRequest]:
+    """Rebuild packed requests from a recorded plan instead of packing."""
+    settings_by_key: dict[tuple[Any, ...], dict[str, Any]] = {}
+    inputs: dict[str, tuple[tuple[Any, ...], Any]] = {}
+    for request in requests:
+        body = request[REQUEST.body]
+        key = request_settings_key(body)
+        if key not in settings_by_key:
+            settings_by_key[key] = {
+                field: value for field, value in body.items() if field != REQUEST.input
             }
+        for input_id, text in zip(
+            request[REQUEST.input_ids],
+            request[REQUEST.texts],
+            strict=True,
+        ):
+            inputs[input_id] = (key, text)
+    for planned in plan:
+        if max_inputs_per_request and len(planned.input_ids) > max_inputs_per_request:
+            raise ValueError(
+                f"packing plan request with {planned.input_ids[0]!r} has "
+                f"{len(planned.input_ids)} inputs, exceeding max_inputs_per_request "
+                f"{max_inputs_per_request}"
+            )
+        if max_tokens_per_request and planned.estimated_tokens > max_tokens_per_request:
+            raise ValueError(
+                f"packing plan request with {planned.input_ids[0]!r} estimates "
+                f"{planned.estimated_tokens} tokens, exceeding max_tokens_per_request "
+                f"{max_tokens_per_request}"
+            )
+        entries = [inputs.pop(input_id, None) for input_id in planned.input_ids]
+        present = [entry for entry in entries if entry is not None]
+        if not present:
+            continue
+        if len(present) != len(entries):
+            missing = planned.input_ids[entries.index(None)]
+            raise ValueError(f"packing plan input_id {missing!r} is not in the inputs")
+        keys = {key for key, _ in present}
+        if len(keys) != 1:
+            raise ValueError(
+                f"packing plan request with {planned.input_ids[0]!r} mixes request settings"
+            )
+        yield PackedRequest(
+            settings_by_key[keys.pop()],
+            planned.input_ids,
+            [text for _, text in present],
+            0,
+            len(present),
+            planned.estimated_tokens,
+        )
+    if inputs:
+        raise ValueError(
+            f"{len(inputs)} inputs are not in the packing plan, "
+            f"starting with {next(iter(inputs))!r}"
+        )
 
 
 def capacity_units_to_tpm(capacity_units: int) -> int:
@@ -220,6 +810,172 @@ def input_pacing_interval_seconds(
     return input_count * 60 / target_inputs_per_minute
 
 
+class _TokenBucket:
+    """One rate in GCRA form, so a charge can be dated at a future start time."""
+
+    def __init__(self, per_minute: float, burst_seconds: float, now: float) -> None:
+        self.seconds_per_unit = 60 / per_minute
+        self.burst_seconds = burst_seconds
+        self.empty_at = now - burst_seconds
+
+    def ready_at(self, amount: float) -> float:
+        # A request larger than the burst waits for a full bucket, then overdraws it.
+        return self.empty_at + min(amount * self.seconds_per_unit, self.burst_seconds)
+
+    def charge(self, amount: float, start: float) -> None:
+        self.empty_at = (
+            max(self.empty_at, start - self.burst_seconds) + amount * self.seconds_per_unit
+        )
+
+
+class _DelayedDispatch(ABC):
+    """Base for pacers whose reserve() returns a delay that wait() sleeps out."""
+
+    @abstractmethod
+    def reserve(self, tokens: int, inputs: int = 1) -> float:
+        """Charge one request and return the seconds to wait before sending it."""
+
+    def wait(self, tokens: int, inputs: int = 1) -> None:
+        delay = self.reserve(tokens, inputs)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self, tokens: int, inputs: int = 1) -> None:
+        delay = self.reserve(tokens, inputs)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class TokenBucketLimiter(_DelayedDispatch):
+    """Pace requests against token and input rates with one bucket per rate."""
+
+    def __init__(
+        self,
+        tokens_per_minute: float = 0,
+        inputs_per_minute: float = 0,
+        burst_seconds: float = 0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if tokens_per_minute < 0 or inputs_per_minute < 0:
+            raise ValueError("rates must be non-negative")
+        if burst_seconds < 0:
+            raise ValueError("burst_seconds must be non-negative")
+        self._clock = clock
+        now = clock()
+        self._tokens = (
+            _TokenBucket(tokens_per_minute, burst_seconds, now) if tokens_per_minute else None
+        )
+        self._inputs = (
+            _TokenBucket(inputs_per_minute, burst_seconds, now) if inputs_per_minute else None
+        )
+        self._lock = threading.Lock()
+
+    def __bool__(self) -> bool:
+        return self._tokens is not None or self._inputs is not None
+
+    def reserve(self, tokens: int, inputs: int = 1) -> float:
+        """Charge one request and return the seconds to wait before sending it."""
+        if tokens < 0 or inputs < 0:
+            raise ValueError("tokens and inputs must be non-negative")
+        charges = [
+            (bucket, amount)
+            for bucket, amount in ((self._tokens, tokens), (self._inputs, inputs))
+            if bucket is not None
+        ]
+        if not charges:
+            return 0.0
+        with self._lock:
+            now = self._clock()
+            start = max([now, *(bucket.ready_at(amount) for bucket, amount in charges)])
+            for bucket, amount in charges:
+                bucket.charge(amount, start)
+        return start - now
+
+
+def parse_reset_seconds(value: str) -> float | None:
+    """Parse an x-ratelimit-reset-* value given in seconds or as a duration."""
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts or "".join(number + unit for number, unit in parts) != value:
+        return None
+    return sum(float(number) * _DURATION_SECONDS[unit] for number, unit in parts)
+
+
+@dataclass
+class _ReportedQuota:
+    remaining: float | None = None
+    limit: float | None = None
+    reset_at: float | None = None
+
+
+class RateLimitHeaderGate(_DelayedDispatch):
+    """Hold dispatch while the server-reported quota cannot cover the next request."""
+
+    def __init__(
+        self,
+        default_reset_seconds: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if default_reset_seconds <= 0:
+            raise ValueError("default_reset_seconds must be positive")
+        self.default_reset_seconds = default_reset_seconds
+        self._clock = clock
+        self._quotas = {"tokens": _ReportedQuota(), "requests": _ReportedQuota()}
+        self._next_start = 0.0
+        self._lock = threading.Lock()
+        self.gated_requests = 0
+        self.gated_seconds = 0.0
+
+    def observe(self, headers: Mapping[str, str]) -> None:
+        now = self._clock()
+        with self._lock:
+            for kind, quota in self._quotas.items():
+                try:
+                    remaining = float(headers[f"x-ratelimit-remaining-{kind}"])
+                except (KeyError, ValueError):
+                    continue
+                try:
+                    limit = float(headers[f"x-ratelimit-limit-{kind}"])
+                except (KeyError, ValueError):
+                    limit = None
+                reset = headers.get(f"x-ratelimit-reset-{kind}")
+                reset_seconds = parse_reset_seconds(reset) if reset is not None else None
+                if reset_seconds is None:
+                    reset_seconds = self.default_reset_seconds
+                quota.remaining = remaining
+                quota.limit = limit
+                quota.reset_at = now + reset_seconds
+
+    def reserve(self, tokens: int, inputs: int = 1) -> float:
+        """Charge one request and return its delay; inputs is unused, as quotas count requests."""
+        charges = {"tokens": tokens, "requests": 1}
+        with self._lock:
+            now = self._clock()
+            start = max(now, self._next_start)
+            for kind, quota in self._quotas.items():
+                if (
+                    quota.remaining is not None
+                    and quota.remaining < charges[kind]
+                    and quota.reset_at is not None
+                ):
+                    start = max(start, quota.reset_at)
+            for kind, quota in self._quotas.items():
+                if quota.reset_at is not None and quota.reset_at <= start:
+                    quota.remaining = quota.limit
+                    quota.reset_at = None
+                if quota.remaining is not None:
+                    quota.remaining -= charges[kind]
+            self._next_start = start
+            if start > now:
+                self.gated_requests += 1
+                self.gated_seconds += start - now
+        return start - now
+
+
 def tokens_per_minute(prompt_tokens: int, elapsed_seconds: float) -> float:
     """Normalize accepted prompt tokens to a one-minute rate."""
     if prompt_tokens < 0:
@@ -0,0 +1,86 @@
+from array import array
+from collections.abc import Callable, Collection
+from hashlib import blake2b
+
+
+LocationResolver = Callable[[int], Collection[str]]
+
+_EMPTY = 0
+_INITIAL_CAPACITY = 1024
+_MAX_LOAD_FACTOR = 0.7
+
+
+def input_id_digest(input_id: str) -> int:
+    """Return a non-zero 64-bit digest for an input ID."""
+    value = int.from_bytes(
+        blake2b(input_id.encode("utf-8"), digest_size=8).digest(),
+        "little",
+    )
+    return value or 1
+
+
+class InputIdIndex:
+    """Input ID set stored as 64-bit digests in an open-addressing table."""
+
+    def __init__(
+        self,
+        resolve_location: LocationResolver,
+        digest: Callable[[str], int] = input_id_digest,
+        capacity: int = _INITIAL_CAPACITY,
+    ) -> None:
+        size = 1
+        while size < capacity:
+            size *= 2
+        self._resolve_location = resolve_location
+        self._digest = digest
+        self._digests = array("Q", bytes(8 * size))
+        self._locations = array("Q", bytes(8 * size))
+        self._overflow: set[str] = set()
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count + len(self._overflow)
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self._digests.itemsize * len(self._digests)
+            + self._locations.itemsize * len(self._locations)
+        )
+
+    def add(self, input_id: str, location: int) -> bool:
+        """Add an ID found at a row location; return False for a duplicate."""
+        digest = self._digest(input_id)
+        slot = self._find(digest)
+        if self._digests[slot] == _EMPTY:
+            if self._count + 1 > len(self._digests) * _MAX_LOAD_FACTOR:
+                self._grow()
+                slot = self._find(digest)
+            self._digests[slot] = digest
+            self._locations[slot] = location
+            self._count += 1
+            return True
+        if input_id in self._overflow:
+            return False
+        if input_id in self._resolve_location(self._locations[slot]):
+            return False
+        self._overflow.add(input_id)
+        return True
+
+    def _find(self, digest: int) -> int:
+        mask = len(self._digests) - 1
+        slot = digest & mask
+        while self._digests[slot] not in (_EMPTY, digest):
+            slot = (slot + 1) & mask
+        return slot
+
+    def _grow(self) -> None:
+        digests = self._digests
+        locations = self._locations
+        self._digests = array("Q", bytes(16 * len(digests)))
+        self._locations = array("Q", bytes(16 * len(locations)))
+        for digest, location in zip(digests, locations, strict=True):
+            if digest != _EMPTY:
+                slot = self._find(digest)
+                self._digests[slot] = digest
+                self._locations[slot] = location
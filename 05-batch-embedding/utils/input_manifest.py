@@ -0,0 +1,71 @@
+import hashlib
+import json
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+
+MANIFEST_FILE = "_input_manifest.json"
+MANIFEST_VERSION = 1
+_CHUNK_BYTES = 1 << 20
+
+
+@dataclass(frozen=True)
+class ManifestEntry:
+    path: str
+    size: int
+    records: int
+    sha256: str
+
+
+def file_sha256(path: Path) -> tuple[int, str]:
+    """Return a file's size and SHA-256 from one streaming read."""
+    digest = hashlib.sha256()
+    size = 0
+    with path.open("rb") as stream:
+        while chunk := stream.read(_CHUNK_BYTES):
+            digest.update(chunk)
+            size += len(chunk)
+    return size, digest.hexdigest()
+
+
+def manifest_entry(input_dir: Path, path: Path, records: int) -> ManifestEntry:
+    """Describe one input file with its size and content checksum."""
+    size, sha256 = file_sha256(path)
+    return ManifestEntry(
+        path=path.relative_to(input_dir).as_posix(),
+        size=size,
+        records=records,
+        sha256=sha256,
+    )
+
+
+def write_manifest(input_dir: Path, entries: list[ManifestEntry]) -> Path:
+    """Write entries in the same order as a sorted tree walk of the folder."""
+    path = input_dir / MANIFEST_FILE
+    ordered = sorted(entries, key=lambda entry: entry.path.split("/"))
+    path.write_text(
+        json.dumps(
+            {
+                "version": MANIFEST_VERSION,
+                "files": [asdict(entry) for entry in ordered],
+            },
+            separators=(",", ":"),
+        )
+        + "\n",
+        encoding="utf-8",
+    )
+    return path
+
+
+def read_manifest(input_dir: Path) -> list[ManifestEntry] | None:
+    """Return the folder's manifest entries, or None when it has no manifest."""
+    try:
+        document = json.loads((input_dir / MANIFEST_FILE).read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+    if document.get("version") != MANIFEST_VERSION:
+        raise ValueError(
+            f"{MANIFEST_FILE}: unsupported manifest version {document.get('version')!r}"
+        )
+    return [ManifestEntry(**entry) for entry in document["files"]]
+
@@ -0,0 +1,50 @@
+import json
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TextIO
+
+
+PLAN_FILE = "_packing_plan.jsonl"
+
+
+@dataclass(frozen=True)
+class PlannedRequest:
+    """The input IDs of one sent request, in array order, and its token estimate."""
+
+    input_ids: list[str]
+    estimated_tokens: int
+
+
+def write_plan_entry(stream: TextIO, input_ids: Iterable[str], estimated_tokens: int) -> None:
+    stream.write(
+        json.dumps(
+            {"input_ids": list(input_ids), "estimated_tokens": estimated_tokens},
+            separators=(",", ":"),
+        )
+        + "\n"
+    )
+
+
+def read_packing_plan(path: Path) -> Iterator[PlannedRequest]:
+    with path.open(encoding="utf-8") as stream:
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            input_ids = entry.get("input_ids")
+            if not isinstance(input_ids, list) or not input_ids:
+                raise ValueError(f"{path}:{line_number}: input_ids must be a non-empty array")
+            yield PlannedRequest(input_ids, int(entry.get("estimated_tokens", 0)))
+
+
+def write_packing_plan(path: Path, plan: Iterable[PlannedRequest]) -> None:
+    with path.open("w", encoding="utf-8") as stream:
+        for planned in plan:
+            write_plan_entry(stream, planned.input_ids, planned.estimated_tokens)
+
+
+def folder_packing_plan(input_dir: Path) -> Path | None:
+    """Return the plan staged next to the inputs, if there is one."""
+    path = input_dir / PLAN_FILE
+    return path if path.is_file() else None
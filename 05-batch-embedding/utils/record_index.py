@@ -0,0 +1,178 @@
+import hashlib
+import json
+import mmap
+import struct
+import tempfile
+import threading
+from array import array
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+
+INDEX_SUFFIX = ".offsets"
+INDEX_CACHE_DIR = "jsonl-line-offsets"
+_INDEX_MAGIC = b"JSONLIDX"
+_INDEX_HEADER = struct.Struct("<8sQqQ")
+
+
+@dataclass(frozen=True, slots=True)
+class RecordText:
+    """One input text kept on disk as a JSONL line location."""
+
+    file_index: int
+    offset: int
+    length: int
+    position: int | None = None
+
+
+def line_offsets(data: bytes | mmap.mmap) -> array:
+    """Return the start offset of every line plus a final end offset."""
+    offsets = array("Q", [0])
+    position = data.find(b"\n")
+    while position != -1:
+        offsets.append(position + 1)
+        position = data.find(b"\n", position + 1)
+    if offsets[-1] != len(data):
+        offsets.append(len(data))
+    return offsets
+
+
+def default_index_dir(input_dir: Path) -> Path:
+    """Keep an input folder's sidecars in a temp cache, away from inputs and outputs."""
+    key = hashlib.sha256(str(input_dir.resolve()).encode("utf-8")).hexdigest()[:16]
+    return Path(tempfile.gettempdir()) / INDEX_CACHE_DIR / key
+
+
+def sidecar_path(path: Path, input_dir: Path, index_dir: Path | None) -> Path:
+    if index_dir is None:
+        return path.with_name(path.name + INDEX_SUFFIX)
+    return index_dir / (path.relative_to(input_dir).as_posix() + INDEX_SUFFIX)
+
+
+def write_line_offsets(path: Path, sidecar: Path, offsets: array) -> None:
+    stat = path.stat()
+    sidecar.parent.mkdir(parents=True, exist_ok=True)
+    temporary = sidecar.with_name(sidecar.name + ".tmp")
+    with temporary.open("wb") as stream:
+        stream.write(
+            _INDEX_HEADER.pack(_INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, len(offsets))
+        )
+        offsets.tofile(stream)
+    temporary.replace(sidecar)
+
+
+def read_line_offsets(path: Path, sidecar: Path) -> array | None:
+    """Load a sidecar index if it still describes the current file."""
+    try:
+        with sidecar.open("rb") as stream:
+            header = stream.read(_INDEX_HEADER.size)
+            if len(header) != _INDEX_HEADER.size:
+                return None
+            magic, size, mtime_ns, count = _INDEX_HEADER.unpack(header)
+            stat = path.stat()
+            if (magic, size, mtime_ns) != (_INDEX_MAGIC, stat.st_size, stat.st_mtime_ns):
+                return None
+            offsets = array("Q")
+            offsets.fromfile(stream, count)
+            return offsets
+    except (FileNotFoundError, EOFError):
+        return None
+
+
+class RecordReader:
+    """Memory-mapped random access to JSONL lines across an input folder."""
+
+    def __init__(
+        self,
+        input_dir: Path,
+        paths: list[Path],
+        index_dir: Path | None = None,
+    ) -> None:
+        self.input_dir = input_dir
+        self.paths = paths
+        self.index_dir = index_dir
+        self._maps: dict[int, mmap.mmap] = {}
+        self._offsets: dict[int, array] = {}
+        self._lock = threading.Lock()
+        self._last_row: tuple[tuple[int, int] | None, Any] = (None, None)
+
+    def sidecar(self, file_index: int) -> Path:
+        return sidecar_path(self.paths[file_index], self.input_dir, self.index_dir)
+
+    def _map(self, file_index: int) -> mmap.mmap:
+        mapped = self._maps.get(file_index)
+        if mapped is None:
+            with self._lock:
+                mapped = self._maps.get(file_index)
+                if mapped is None:
+                    with self.paths[file_index].open("rb") as stream:
+                        mapped = mmap.mmap(
+                            stream.fileno(), 0, access=mmap.ACCESS_READ
+                        )
+                    self._maps[file_index] = mapped
+        return mapped
+
+    def offsets(self, file_index: int) -> array:
+        offsets = self._offsets.get(file_index)
+        if offsets is None:
+            path = self.paths[file_index]
+            sidecar = self.sidecar(file_index)
+            offsets = read_line_offsets(path, sidecar)
+            if offsets is None:
+                offsets = line_offsets(self._map(file_index))
+                write_line_offsets(path, sidecar, offsets)
+            self._offsets[file_index] = offsets
+        return offsets
+
+    def read(self, file_index: int, offset: int, length: int) -> bytes:
+        return self._map(file_index)[offset : offset + length]
+
+    def line(self, file_index: int, line_number: int) -> bytes:
+        offsets = self.offsets(file_index)
+        start = offsets[line_number - 1]
+        return self.read(file_index, start, offsets[line_number] - start)
+
+    def text(self, reference: RecordText, input_field: str = "input") -> str:
+        """Read one text, reusing the last decoded line for array rows."""
+        key = (reference.file_index, reference.offset)
+        last_key, value = self._last_row
+        if key != last_key:
+            value = json.loads(
+                self.read(reference.file_index, reference.offset, reference.length)
+            )[input_field]
+            self._last_row = (key, value)
+        return value if reference.position is None else value[reference.position]
+
+    def materialize(self, value: Any, input_field: str = "input") -> Any:
+        """Replace record references with text, parsing each line once."""
+        if isinstance(value, RecordText):
+            return self.text(value, input_field)
+        if not isinstance(value, list) or not value:
+            return value
+        rows: dict[tuple[int, int], Any] = {}
+        texts = []
+        for item in value:
+            if not isinstance(item, RecordText):
+                texts.append(item)
+                continue
+            key = (item.file_index, item.offset)
+            if key not in rows:
+                rows[key] = json.loads(
+                    self.read(item.file_index, item.offset, item.length)
+                )[input_field]
+            row_input = rows[key]
+            texts.append(row_input if item.position is None else row_input[item.position])
+        return texts
+
+    def close(self) -> None:
+        for mapped in self._maps.values():
+            mapped.close()
+        self._maps.clear()
+        self._offsets.clear()
+
+    def __enter__(self) -> "RecordReader":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
@@ -0,0 +1,131 @@
+import struct
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from hashlib import blake2b
+from pathlib import Path
+
+
+DEFAULT_CACHE_ENTRIES = 65_536
+_CACHE_MAGIC = b"TOKCACHE"
+_CACHE_HEADER = struct.Struct("<8sHQ")
+_CACHE_ENTRY = struct.Struct("<16sI")
+
+
+def text_digest(text: str) -> bytes:
+    return blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class CachingTokenCounter:
+    """Token counter with a bounded LRU cache keyed by a 128-bit text digest."""
+
+    def __init__(
+        self,
+        count: Callable[[str], int],
+        encoding: str,
+        max_entries: int = DEFAULT_CACHE_ENTRIES,
+        path: Path | None = None,
+        count_batch: Callable[[list[str]], list[int]] | None = None,
+    ) -> None:
+        if max_entries < 1:
+            raise ValueError("max_entries must be positive")
+        self._count = count
+        self._count_batch = count_batch or (lambda texts: [count(text) for text in texts])
+        self.encoding = encoding
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[bytes, int] = OrderedDict()
+        self._lock = threading.Lock()
+        if path is not None:
+            self._load(path)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __call__(self, text: str) -> int:
+        if not text:
+            return 0
+        key = text_digest(text)
+        with self._lock:
+            count = self._entries.get(key)
+            if count is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return count
+        count = self._count(text)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = count
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return count
+
+    def count_batch(self, texts: list[str]) -> list[int]:
+        counts: list[int] = [0] * len(texts)
+        missing: dict[bytes, list[int]] = {}
+        with self._lock:
+            for position, text in enumerate(texts):
+                if not text:
+                    continue
+                key = text_digest(text)
+                count = self._entries.get(key)
+                if count is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    counts[position] = count
+                else:
+                    missing.setdefault(key, []).append(position)
+        if not missing:
+            return counts
+        missing_counts = self._count_batch(
+            [texts[positions[0]] for positions in missing.values()]
+        )
+        with self._lock:
+            for (key, positions), count in zip(missing.items(), missing_counts, strict=True):
+                self.misses += 1
+                self.hits += len(positions) - 1
+                self._entries[key] = count
+                for position in positions:
+                    counts[position] = count
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return counts
+
+    def _load(self, path: Path) -> None:
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return
+        if len(data) < _CACHE_HEADER.size:
+            return
+        magic, encoding_length, count = _CACHE_HEADER.unpack_from(data)
+        encoding_end = _CACHE_HEADER.size + encoding_length
+        if magic != _CACHE_MAGIC or data[_CACHE_HEADER.size : encoding_end] != (
+            self.encoding.encode("utf-8")
+        ):
+            return
+        count = min(count, (len(data) - encoding_end) // _CACHE_ENTRY.size)
+        for key, tokens in _CACHE_ENTRY.iter_unpack(
+            data[encoding_end : encoding_end + count * _CACHE_ENTRY.size]
+        ):
+            self._entries[key] = tokens
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def save(self) -> None:
+        """Write the cached counts, least recently used first."""
+        if self.path is None:
+            return
+        encoding = self.encoding.encode("utf-8")
+        with self._lock:
+            entries = list(self._entries.items())
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_name(self.path.name + ".tmp")
+        with temporary.open("wb") as stream:
+            stream.write(_CACHE_HEADER.pack(_CACHE_MAGIC, len(encoding), len(entries)))
+            stream.write(encoding)
+            for key, tokens in entries:
+                stream.write(_CACHE_ENTRY.pack(key, tokens))
+        temporary.replace(self.path)
@@ -0,0 +1,208 @@
+import json
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from collections.abc import Iterable
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any
+
+from utils.input_index import input_id_digest
+from utils.input_manifest import file_sha256, read_manifest
+
+
+PROFILE_FILE = "_token_profile.json"
+COUNTS_FILE = "_token_profile.counts"
+PROFILE_VERSION = 2
+
+
+class TokenCounts:
+    """Token counts keyed by 64-bit input ID digests in two sorted arrays."""
+
+    def __init__(self, digests: array, counts: array) -> None:
+        if len(digests) != len(counts):
+            raise ValueError("digests and counts must have the same length")
+        self._digests = digests
+        self._counts = counts
+
+    @classmethod
+    def from_items(cls, items: Iterable[tuple[str, int]]) -> "TokenCounts":
+        """Build counts from (input_id, tokens) pairs, dropping colliding digests."""
+        by_digest: dict[int, int] = {}
+        collided: set[int] = set()
+        for input_id, count in items:
+            digest = input_id_digest(input_id)
+            if digest in by_digest:
+                collided.add(digest)
+            by_digest[digest] = count
+        digests = array("Q", sorted(by_digest.keys() - collided))
+        return cls(digests, array("I", (by_digest[digest] for digest in digests)))
+
+    def __len__(self) -> int:
+        return len(self._digests)
+
+    def __contains__(self, input_id: object) -> bool:
+        return isinstance(input_id, str) and self.get(input_id) is not None
+
+    def __getitem__(self, input_id: str) -> int:
+        count = self.get(input_id)
+        if count is None:
+            raise KeyError(input_id)
+        return count
+
+    def get(self, input_id: str, default: int | None = None) -> int | None:
+        digest = input_id_digest(input_id)
+        position = bisect_left(self._digests, digest)
+        if position < len(self._digests) and self._digests[position] == digest:
+            return self._counts[position]
+        return default
+
+    def values(self) -> array:
+        return self._counts
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self._digests.itemsize * len(self._digests)
+            + self._counts.itemsize * len(self._counts)
+        )
+
+    def tobytes(self) -> bytes:
+        return self._digests.tobytes() + self._counts.tobytes()
+
+    @classmethod
+    def frombytes(cls, data: bytes, input_count: int) -> "TokenCounts":
+        digests = array("Q")
+        counts = array("I")
+        if len(data) != input_count * (digests.itemsize + counts.itemsize):
+            raise ValueError(f"{COUNTS_FILE}: expected {input_count} token counts")
+        view = memoryview(data)
+        digests.frombytes(view[: input_count * digests.itemsize])
+        counts.frombytes(view[input_count * digests.itemsize :])
+        return cls(digests, counts)
+
+
+@dataclass(frozen=True)
+class ProfileSource:
+    size: int
+    mtime_ns: int
+    sha256: str
+
+
+@dataclass(frozen=True)
+class TokenProfile:
+    """Per-input token counts for one input folder and tokenizer encoding."""
+
+    encoding: str
+    sources: dict[str, ProfileSource]
+    tokens: TokenCounts
+
+    @property
+    def input_count(self) -> int:
+        return len(self.tokens)
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(self.tokens.values())
+
+    def histogram(self) -> dict[int, int]:
+        """Count inputs per power-of-two token bucket, keyed by upper bound."""
+        buckets = Counter(1 << max(count - 1, 0).bit_length() for count in self.tokens.values())
+        return dict(sorted(buckets.items()))
+
+
+def profile_source(path: Path, sha256: str | None = None) -> ProfileSource:
+    """Fingerprint one input file, hashing it unless a checksum is known."""
+    stat = path.stat()
+    return ProfileSource(
+        size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+        sha256=sha256 if sha256 is not None else file_sha256(path)[1],
+    )
+
+
+def profile_sources(input_dir: Path, paths: list[Path]) -> dict[str, ProfileSource]:
+    return {path.relative_to(input_dir).as_posix(): profile_source(path) for path in paths}
+
+
+def write_token_profile(directory: Path, profile: TokenProfile) -> Path:
+    (directory / COUNTS_FILE).write_bytes(profile.tokens.tobytes())
+    path = directory / PROFILE_FILE
+    path.write_text(
+        json.dumps(
+            {
+                "version": PROFILE_VERSION,
+                "encoding": profile.encoding,
+                "sources": {
+                    name: asdict(source) for name, source in profile.sources.items()
+                },
+                "input_count": profile.input_count,
+                "total_tokens": profile.total_tokens,
+                "histogram": {
+                    str(bound): count for bound, count in profile.histogram().items()
+                },
+            },
+            separators=(",", ":"),
+        )
+        + "\n",
+        encoding="utf-8",
+    )
+    return path
+
+
+def _load_header(directory: Path) -> dict[str, Any] | None:
+    try:
+        document = json.loads((directory / PROFILE_FILE).read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+    if document.get("version") != PROFILE_VERSION:
+        raise ValueError(
+            f"{PROFILE_FILE}: unsupported profile version {document.get('version')!r}"
+        )
+    return document
+
+
+def _profile(directory: Path, document: dict[str, Any]) -> TokenProfile:
+    return TokenProfile(
+        encoding=document["encoding"],
+        sources={
+            name: ProfileSource(**source) for name, source in document["sources"].items()
+        },
+        tokens=TokenCounts.frombytes(
+            (directory / COUNTS_FILE).read_bytes(),
+            document["input_count"],
+        ),
+    )
+
+
+def load_token_profile(directory: Path) -> TokenProfile | None:
+    document = _load_header(directory)
+    return _profile(directory, document) if document is not None else None
+
+
+def read_token_profile(
+    input_dir: Path,
+    encoding: str,
+    paths: list[Path],
+    manifest_dir: Path | None = None,
+) -> TokenProfile | None:
+    """Load the folder's profile if it still describes these input files."""
+    document = _load_header(input_dir)
+    if document is None or document["encoding"] != encoding:
+        return None
+    checksums = {
+        entry.path: entry.sha256 for entry in read_manifest(manifest_dir or input_dir) or ()
+    }
+    for path in paths:
+        name = path.relative_to(input_dir).as_posix()
+        source = document["sources"].get(name)
+        if source is None:
+            return None
+        if name in checksums:
+            if checksums[name] != source["sha256"]:
+                return None
+            continue
+        stat = path.stat()
+        if (stat.st_size, stat.st_mtime_ns) != (source["size"], source["mtime_ns"]):
+            return None
+    return _profile(input_dir, document)
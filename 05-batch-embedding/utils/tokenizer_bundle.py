@@ -0,0 +1,101 @@
+import json
+import struct
+from functools import cache
+from pathlib import Path
+from typing import Any
+
+import tiktoken
+
+
+BUNDLE_DIR = "tokenizers"
+BUNDLE_SUFFIX = ".tokbundle"
+DEFAULT_BUNDLE_ROOT = Path(__file__).resolve().parents[1] / BUNDLE_DIR
+_BUNDLE_MAGIC = b"TOKBNDL1"
+_BUNDLE_HEADER = struct.Struct("<8sIII")
+
+
+def bundle_path(encoding_name: str, bundle_root: Path = DEFAULT_BUNDLE_ROOT) -> Path:
+    return bundle_root / f"{encoding_name}{BUNDLE_SUFFIX}"
+
+
+def write_tokenizer_bundle(
+    encoding_name: str,
+    bundle_root: Path,
+    definition: dict[str, Any] | None = None,
+) -> Path:
+    """Serialize a tiktoken encoding so components can load it without network."""
+    if definition is None:
+        from tiktoken_ext.openai_public import ENCODING_CONSTRUCTORS
+
+        definition = ENCODING_CONSTRUCTORS[encoding_name]()
+    ranked = sorted(definition["mergeable_ranks"].items(), key=lambda item: item[1])
+    metadata = json.dumps(
+        {
+            "name": definition["name"],
+            "pat_str": definition["pat_str"],
+            "special_tokens": definition["special_tokens"],
+            "explicit_n_vocab": definition.get("explicit_n_vocab"),
+        },
+        separators=(",", ":"),
+    ).encode("utf-8")
+    offsets = []
+    end = 0
+    for token, _ in ranked:
+        end += len(token)
+        offsets.append(end)
+    path = bundle_path(encoding_name, bundle_root)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(path.name + ".tmp")
+    with temporary.open("wb") as stream:
+        stream.write(_BUNDLE_HEADER.pack(_BUNDLE_MAGIC, len(metadata), len(ranked), end))
+        stream.write(metadata)
+        stream.write(struct.pack(f"<{len(ranked)}I", *(rank for _, rank in ranked)))
+        stream.write(struct.pack(f"<{len(ranked)}I", *offsets))
+        for token, _ in ranked:
+            stream.write(token)
+    temporary.replace(path)
+    return path
+
+
+def read_tokenizer_bundle(path: Path) -> tiktoken.Encoding:
+    """Build an encoding from a bundle file read in one binary read."""
+    data = path.read_bytes()
+    magic, metadata_length, token_count, blob_length = _BUNDLE_HEADER.unpack_from(data)
+    if magic != _BUNDLE_MAGIC:
+        raise ValueError(f"{path}: not a tokenizer bundle")
+    position = _BUNDLE_HEADER.size
+    metadata = json.loads(data[position : position + metadata_length])
+    position += metadata_length
+    table_bytes = token_count * 4
+    ranks = struct.unpack_from(f"<{token_count}I", data, position)
+    offsets = struct.unpack_from(f"<{token_count}I", data, position + table_bytes)
+    blob_start = position + 2 * table_bytes
+    if len(data) < blob_start + blob_length:
+        raise ValueError(f"{path}: truncated tokenizer bundle")
+    blob = data[blob_start : blob_start + blob_length]
+    mergeable_ranks = dict(
+        zip(
+            map(blob.__getitem__, map(slice, (0, *offsets[:-1]), offsets)),
+            ranks,
+            strict=True,
+        )
+    )
+    return tiktoken.Encoding(
+        metadata["name"],
+        pat_str=metadata["pat_str"],
+        mergeable_ranks=mergeable_ranks,
+        special_tokens=metadata["special_tokens"],
+        explicit_n_vocab=metadata["explicit_n_vocab"],
+    )
+
+
+@cache
+def load_encoding(
+    encoding_name: str,
+    bundle_root: Path = DEFAULT_BUNDLE_ROOT,
+) -> tiktoken.Encoding:
+    """Load an encoding from the shipped bundle, falling back to tiktoken."""
+    path = bundle_path(encoding_name, bundle_root)
+    if path.is_file():
+        return read_tokenizer_bundle(path)
+    return tiktoken.get_encoding(encoding_name)